@@ -8,12 +8,15 @@ import os
 import re
 import time
 import json
+import hashlib
+import random
 import tempfile
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
-from typing import List, Dict, Any, Optional, Tuple, Callable
+from typing import List, Dict, Any, Iterable, Iterator, Optional, Tuple, Callable, Union
 from datetime import datetime
 import logging
-from dataclasses import dataclass
+from dataclasses import dataclass, field
 from abc import ABC, abstractmethod
 
 # OpenAI SDK のインポート
@@ -40,6 +43,41 @@ except ImportError as e:
     HELPER_AVAILABLE = False
     logging.warning(f"ヘルパーモジュールのインポートに失敗: {e}")
 
+# 埋め込み前の重複・近似重複除去（helper_dedup.py、numpy が必要）
+try:
+    from helper_dedup import DEFAULT_DEDUP, NearDuplicateFilter, format_dedup_report
+
+    DEDUP_AVAILABLE = True
+except ImportError:
+    DEFAULT_DEDUP = {"enabled": False}
+    DEDUP_AVAILABLE = False
+
+# config.yml の読み込み（PyYAML が無い場合は既定値を使用）
+try:
+    import yaml
+
+    YAML_AVAILABLE = True
+except ImportError:
+    YAML_AVAILABLE = False
+
+# トークン数基準のチャンク分割（helper_chunk.py、tiktoken が無い場合は文字数で分割）
+from helper_chunk import MIN_PARALLEL_ROWS, chunk_text_tokens, chunk_texts, make_chunk_pool
+
+
+def load_dedup_config(path: str = "config.yml") -> Dict[str, Any]:
+    """config.yml の dedup セクションを DEFAULT_DEDUP とマージして返す"""
+    cfg = dict(DEFAULT_DEDUP)
+    if YAML_AVAILABLE and os.path.exists(path):
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                cfg.update((yaml.safe_load(f) or {}).get("dedup") or {})
+        except Exception as e:
+            logger.warning(f"config.yml の dedup 設定の読み込みに失敗: {e}")
+    return cfg
+
+# 単一データセットの Vector Store に書き出す JSONL の上限（MB）
+SINGLE_STORE_MAX_FILE_MB = 25
+
 # ===================================================================
 # ログ設定
 # ===================================================================
@@ -57,11 +95,12 @@ class VectorStoreConfig:
     filename: str
     store_name: str
     description: str
-    chunk_size: int = 1000
-    overlap: int = 100
+    chunk_size: int = 256  # チャンクの最大トークン数（tiktoken cl100k_base）
+    overlap: int = 25  # 前チャンク末尾から重ねるトークン数（文単位）
     max_file_size_mb: int = 400  # OpenAI制限より少し余裕を持って設定
     max_chunks_per_file: int = 40000  # チャンク数制限
     csv_text_column: str = "Combined_Text"  # CSVファイルから読み込むテキストカラム名
+    domain: str = "general"  # Vector Store ファイル属性の domain（file_search の filters で絞り込む）
 
     @classmethod
     def get_unified_config(cls) -> 'VectorStoreConfig':
@@ -71,8 +110,8 @@ class VectorStoreConfig:
             filename="unified_datasets.csv",  # 仮想ファイル名
             store_name="Unified Knowledge Base - All Domains",
             description="全ドメイン統合ナレッジベース（医療・法律・科学・FAQ・雑学）",
-            chunk_size=3000,  # 中間的なサイズ
-            overlap=200,
+            chunk_size=800,  # 中間的なサイズ（トークン）
+            overlap=50,
             max_file_size_mb=100,  # 統合時の制限を緩和
             max_chunks_per_file=50000,  # チャンク数制限を拡大
             csv_text_column="Combined_Text"
@@ -87,92 +126,301 @@ class VectorStoreConfig:
                 filename="preprocessed_customer_support_faq.csv",
                 store_name="Customer Support FAQ Knowledge Base",
                 description="カスタマーサポートFAQデータベース",
-                chunk_size=2000,  # サイズ拡大
-                overlap=100,
+                chunk_size=512,  # トークン
+                overlap=25,
                 max_file_size_mb=30,  # より保守的な制限
                 max_chunks_per_file=4000,  # チャンク数削減
-                csv_text_column="Combined_Text"
+                csv_text_column="Combined_Text",
+                domain="customer_support"
             ),
             "medical_qa"          : cls(
                 dataset_type="medical_qa",
                 filename="preprocessed_medical_qa.csv",
                 store_name="Medical Q&A Knowledge Base",
                 description="医療質問回答データベース",
-                chunk_size=16000,  # 大幅増加：チャンク数を半減
-                overlap=300,
-                max_file_size_mb=20,  # さらに厳格なファイルサイズ制限
-                max_chunks_per_file=6000,  # チャンク数を大幅削減
-                csv_text_column="Combined_Text"
+                chunk_size=4000,  # 大幅増加：チャンク数を半減（トークン）
+                overlap=75,
+                max_file_size_mb=15,  # さらに厳格なファイルサイズ制限
+                max_chunks_per_file=5000,  # チャンク数を大幅削減
+                csv_text_column="Combined_Text",
+                domain="medical"
             ),
             "sciq_qa"             : cls(
                 dataset_type="sciq_qa",
                 filename="preprocessed_sciq_qa.csv",
                 store_name="Science & Technology Q&A Knowledge Base",
                 description="科学技術質問回答データベース",
-                chunk_size=2000,  # サイズ拡大
-                overlap=100,
+                chunk_size=512,  # トークン
+                overlap=25,
                 max_file_size_mb=25,  # より保守的な制限
                 max_chunks_per_file=8000,  # チャンク数削減
-                csv_text_column="Combined_Text"
+                csv_text_column="Combined_Text",
+                domain="science"
             ),
             "legal_qa"            : cls(
                 dataset_type="legal_qa",
                 filename="preprocessed_legal_qa.csv",
                 store_name="Legal Q&A Knowledge Base",
                 description="法律質問回答データベース",
-                chunk_size=3000,  # サイズ拡大
-                overlap=150,
+                chunk_size=768,  # トークン
+                overlap=40,
                 max_file_size_mb=25,  # より保守的な制限
                 max_chunks_per_file=6000,  # チャンク数削減
-                csv_text_column="Combined_Text"
+                csv_text_column="Combined_Text",
+                domain="legal"
             ),
             "trivia_qa"           : cls(
                 dataset_type="trivia_qa",
                 filename="preprocessed_trivia_qa.csv",
                 store_name="Trivia Q&A Knowledge Base",
                 description="雑学質問回答データベース",
-                chunk_size=2500,  # 適切なサイズに設定
-                overlap=100,
+                chunk_size=640,  # 適切なサイズに設定（トークン）
+                overlap=25,
                 max_file_size_mb=25,
                 max_chunks_per_file=7000,
-                csv_text_column="Combined_Text"  # TriviaQAでは大文字のCombined_Text
+                csv_text_column="Combined_Text",  # TriviaQAでは大文字のCombined_Text
+                domain="trivia"
             )
         }
 
 
+# ===================================================================
+# JSONL書き出し（バイト数・チャンク数の上限管理）
+# ===================================================================
+class JsonlBudgetWriter:
+    """JSONL を1行ずつファイルへ書き出し、書き込んだバイト数とチャンク数を正確に管理する
+
+    各エントリのシリアライズは1回だけで、アップロードされるバイト列そのものを数える。
+    上限を超える行は書かずに打ち切り、full_reason（"chunks" / "bytes"）を設定する。
+    shards > 1 のときは書き込み済みバイト数が最も少ないシャードへ振り分け、サイズの揃った複数ファイルにする。
+    write(shard=...) で振り分け先を指定でき、key を渡すとシャードごとに記録する（差分同期用）。
+    """
+
+    def __init__(self, path: Path, max_bytes: int, max_chunks: int, shards: int = 1):
+        self.path = Path(path)
+        self.max_bytes = max_bytes
+        self.max_chunks = max_chunks
+        self.bytes_written = 0
+        self.chunks = 0
+        self.full_reason: Optional[str] = None
+        shards = max(1, shards)
+        self.paths = [self.path] if shards == 1 else [
+            self.path.with_name(f"{self.path.stem}.{i:02d}{self.path.suffix}") for i in range(shards)
+        ]
+        self.shard_bytes = [0] * shards
+        self.shard_chunks = [0] * shards
+        self.shard_keys: List[List[str]] = [[] for _ in range(shards)]
+        self._files = [open(p, "wb") for p in self.paths]
+
+    @property
+    def size_mb(self) -> float:
+        return self.bytes_written / (1024 * 1024)
+
+    @staticmethod
+    def encode(entry: Dict[str, Any]) -> bytes:
+        return (json.dumps(entry, ensure_ascii=False) + "\n").encode("utf-8")
+
+    def write(self, entry: Dict[str, Any], shard: Optional[int] = None, key: Optional[str] = None) -> bool:
+        """1エントリを書き出す（上限に達していれば書かずに False）"""
+        if self.full_reason:
+            return False
+        return self.write_line(self.encode(entry), shard, key)
+
+    def write_line(self, line: bytes, shard: Optional[int] = None, key: Optional[str] = None) -> bool:
+        """シリアライズ済みの1行を書き出す（上限に達していれば書かずに False）"""
+        if self.full_reason:
+            return False
+        if self.chunks >= self.max_chunks:
+            self.full_reason = "chunks"
+            return False
+        if self.bytes_written + len(line) > self.max_bytes:
+            self.full_reason = "bytes"
+            return False
+        if shard is None:
+            shard = min(range(len(self._files)), key=self.shard_bytes.__getitem__)
+        if key is not None:
+            self.shard_keys[shard].append(key)
+        self._files[shard].write(line)
+        self.shard_bytes[shard] += len(line)
+        self.shard_chunks[shard] += 1
+        self.bytes_written += len(line)
+        self.chunks += 1
+        return True
+
+    def sub_budget(self, max_bytes: int, max_chunks: int, shards: Optional[range] = None) -> "JsonlBudgetView":
+        """このファイルへ書き込む、より小さい予算の書き込み口（統合時のドメイン別予算）
+
+        shards を渡すとそのシャード番号の範囲だけに書き込む（ドメインごとにファイルを分ける）
+        """
+        return JsonlBudgetView(self, max_bytes, max_chunks, shards)
+
+    def written_paths(self) -> List[Path]:
+        """1件以上書き込んだシャードのパス"""
+        return [p for p, n in zip(self.paths, self.shard_chunks) if n]
+
+    def close(self):
+        for f in self._files:
+            if not f.closed:
+                f.close()
+
+    def remove(self):
+        """書き出したファイルを削除（アップロード後の後始末）"""
+        self.close()
+        for p in {self.path, *self.paths}:
+            if p.exists():
+                p.unlink()
+
+    def __enter__(self) -> "JsonlBudgetWriter":
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+
+class JsonlBudgetView:
+    """JsonlBudgetWriter の予算の一部（バイト数・チャンク数）だけを使う書き込み口
+
+    text_to_jsonl_file からは JsonlBudgetWriter と同じように使える。各行のシリアライズは1回だけ。
+    shards を指定した場合は親のシャードのうちその範囲だけを使い、範囲内で最も少ないシャードへ振り分ける。
+    """
+
+    def __init__(self, parent: JsonlBudgetWriter, max_bytes: int, max_chunks: int,
+                 shards: Optional[range] = None):
+        self.parent = parent
+        self.shards = shards if shards is not None else range(len(parent.paths))
+        self.max_bytes = max_bytes
+        self.max_chunks = max_chunks
+        self.bytes_written = 0
+        self.chunks = 0
+        self.full_reason: Optional[str] = None
+
+    @property
+    def paths(self) -> List[Path]:
+        return [self.parent.paths[i] for i in self.shards]
+
+    @property
+    def size_mb(self) -> float:
+        return self.bytes_written / (1024 * 1024)
+
+    def write(self, entry: Dict[str, Any], shard: Optional[int] = None, key: Optional[str] = None) -> bool:
+        """予算内なら親ファイルへ書き出す（上限に達していれば書かずに False）"""
+        if self.full_reason:
+            return False
+        if self.chunks >= self.max_chunks:
+            self.full_reason = "chunks"
+            return False
+        line = self.parent.encode(entry)
+        if self.bytes_written + len(line) > self.max_bytes:
+            self.full_reason = "bytes"
+            return False
+        if shard is None:
+            shard = min(self.shards, key=self.parent.shard_bytes.__getitem__)
+        else:
+            shard = self.shards[shard]
+        if not self.parent.write_line(line, shard, key):
+            self.full_reason = self.parent.full_reason
+            return False
+        self.bytes_written += len(line)
+        self.chunks += 1
+        return True
+
+
+# ===================================================================
+# 差分同期マニフェスト
+# ===================================================================
+def chunk_digest(text: str) -> str:
+    """チャンク内容のハッシュ（差分同期の ID・シャード振り分けに使用）"""
+    return hashlib.blake2b(text.encode("utf-8"), digest_size=16).hexdigest()
+
+
+class VectorStoreManifest:
+    """差分同期用のローカルマニフェスト（JSON）
+
+    key（dataset_type）ごとに以下を記録する:
+      - vector_store_id / store_name / shard_count
+      - shards: シャード番号 → {digest, file_id, chunks, bytes}（digest はシャード内チャンクハッシュの集合から計算）
+      - chunk_files: チャンク内容ハッシュ → file_id
+    """
+
+    VERSION = 1
+
+    def __init__(self, path: Path):
+        self.path = Path(path)
+        self.data: Dict[str, Any] = {"version": self.VERSION, "stores": {}}
+        if self.path.exists():
+            try:
+                with open(self.path, encoding="utf-8") as f:
+                    self.data = json.load(f)
+            except (OSError, json.JSONDecodeError) as e:
+                logger.warning(f"⚠️ マニフェストを読み込めないため新規作成します: {self.path} - {e}")
+
+    def get(self, key: str) -> Optional[Dict[str, Any]]:
+        return self.data["stores"].get(key)
+
+    def set(self, key: str, entry: Dict[str, Any]):
+        self.data["stores"][key] = {**entry, "updated_at": datetime.now().isoformat(timespec="seconds")}
+        self.save()
+
+    def remove(self, key: str):
+        if self.data["stores"].pop(key, None) is not None:
+            self.save()
+
+    def save(self):
+        """一時ファイルに書いてから置き換える（書き込み途中で壊れないように）"""
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = self.path.with_name(self.path.name + ".tmp")
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(self.data, f, ensure_ascii=False, indent=1)
+        os.replace(tmp_path, self.path)
+
+
 # ===================================================================
 # Vector Store処理クラス
 # ===================================================================
 class VectorStoreProcessor:
     """Vector Store用データ処理クラス"""
 
-    def __init__(self):
+    def __init__(self, dedup_cfg: Optional[Dict[str, Any]] = None, chunk_workers: Optional[int] = None):
         self.configs = VectorStoreConfig.get_all_configs()
+        # 表記ゆれ・近似重複の除去設定（helper_dedup.DEFAULT_DEDUP を上書き）
+        self.dedup_cfg = dedup_cfg
+        # チャンク分割のプロセス数（None: CPU数、1: 逐次。行数が少ない場合は常に逐次）
+        self.chunk_workers = chunk_workers
 
-    def load_csv_file(self, filepath: Path, text_column: str = "Combined_Text") -> List[str]:
-        """CSVファイルを読み込み、指定カラムのテキストをリストとして返す"""
-        try:
-            # CSVファイルを読み込み
-            df = pd.read_csv(filepath, encoding='utf-8')
-            
+    def iter_csv_file(self, filepath: Path, text_column: str = "Combined_Text",
+                      chunk_rows: int = 10000) -> Iterator[str]:
+        """CSVファイルをチャンク単位で読み込み、指定カラムのテキストを1件ずつ返す（メモリ使用量一定）
+
+        チャンクをまたいだ重複テキストはダイジェストの集合で除外する
+        """
+        seen = set()
+        for df in pd.read_csv(filepath, encoding='utf-8', chunksize=chunk_rows):
             # 指定カラムが存在するか確認
             if text_column not in df.columns:
-                logger.error(f"指定されたカラム '{text_column}' が見つかりません。利用可能なカラム: {df.columns.tolist()}")
-                return []
-            
+                raise ValueError(f"指定されたカラム '{text_column}' が見つかりません。利用可能なカラム: {df.columns.tolist()}")
+
             # テキストカラムから値を取得（NaNを除外）
-            texts = df[text_column].dropna().astype(str).tolist()
-            
-            # 空文字列と短すぎるテキストを除去
-            cleaned_lines = []
-            for text in texts:
+            for text in df[text_column].dropna().astype(str):
+                # 空文字列と短すぎるテキストを除去
                 text = text.strip()
-                if text and len(text) > 10:  # 10文字以上のテキストのみ保持
-                    cleaned_lines.append(text)
+                if not text or len(text) <= 10:  # 10文字以上のテキストのみ保持
+                    continue
+                digest = hashlib.blake2b(text.encode('utf-8'), digest_size=16).digest()
+                if digest in seen:
+                    continue
+                seen.add(digest)
+                yield text
 
+    def load_csv_file(self, filepath: Path, text_column: str = "Combined_Text") -> List[str]:
+        """CSVファイルを読み込み、指定カラムのテキストをリストとして返す"""
+        try:
+            cleaned_lines = list(self.iter_csv_file(filepath, text_column))
             logger.info(f"CSVファイル読み込み完了: {filepath.name} - {len(cleaned_lines)}件のテキスト")
             return cleaned_lines
 
+        except ValueError as e:
+            logger.error(str(e))
+            return []
         except FileNotFoundError:
             logger.error(f"ファイルが見つかりません: {filepath}")
             return []
@@ -183,38 +431,9 @@ class VectorStoreProcessor:
             logger.error(f"CSVファイル読み込みエラー: {filepath} - {e}")
             return []
 
-    def chunk_text(self, text: str, chunk_size: int = 1000, overlap: int = 100) -> List[str]:
-        """長いテキストを指定サイズのチャンクに分割"""
-        if len(text) <= chunk_size:
-            return [text]
-
-        chunks = []
-        start = 0
-
-        while start < len(text):
-            end = start + chunk_size
-
-            # 文の境界で分割するように調整
-            if end < len(text):
-                # 句読点を探す
-                for punct in ['。', '！', '？', '.', '!', '?']:
-                    punct_pos = text.rfind(punct, start, end)
-                    if punct_pos > start + chunk_size // 2:
-                        end = punct_pos + 1
-                        break
-
-            chunk = text[start:end].strip()
-            if chunk:
-                chunks.append(chunk)
-
-            # 次の開始位置を設定（オーバーラップを考慮）
-            start = max(start + 1, end - overlap)
-
-            # 無限ループ防止
-            if start >= len(text):
-                break
-
-        return chunks
+    def chunk_text(self, text: str, chunk_size: int = 256, overlap: int = 25) -> List[str]:
+        """長いテキストを最大 chunk_size トークンのチャンクに分割（文境界優先・O(n)・同じ入力なら同じ結果）"""
+        return chunk_text_tokens(text, chunk_size, overlap)
 
     def clean_text(self, text: str) -> str:
         """テキストのクレンジング処理"""
@@ -232,13 +451,22 @@ class VectorStoreProcessor:
 
         return text
 
-    def text_to_jsonl_data(self, lines: List[str], dataset_type: str, source_dataset: str = None) -> Tuple[List[Dict[str, Any]], Dict[str, Any]]:
-        """テキスト行をJSONL用のデータ構造に変換（サイズ制限チェック付き）
-        
+    def text_to_jsonl_file(self, lines: Iterable[str], dataset_type: str,
+                           writer: Union[JsonlBudgetWriter, JsonlBudgetView],
+                           source_dataset: str = None, block_rows: int = 4096,
+                           stable_ids: bool = False) -> Dict[str, Any]:
+        """テキスト行をチャンク化し、JSONL として writer へ逐次書き出す（サイズ・チャンク数の上限は writer が管理）
+
+        行は block_rows 件ずつクリーニング・重複除去・チャンク分割するため、
+        メモリ使用量はコーパスの大きさによらず一定。
+
         Args:
-            lines: テキスト行のリスト
+            lines: テキスト行（iter_csv_file のイテレータなど）
             dataset_type: データセットタイプ（設定キー）
+            writer: 書き出し先（統合時はデータセットごとの予算付きビュー）
             source_dataset: 元のデータセット名（統合時に使用）
+            stable_ids: True ならチャンク内容のハッシュを ID にし、ハッシュでシャードを決める（差分同期用。
+                行の追加・削除で他のチャンクの ID・シャードが変わらない）
         """
         # 統合モードの場合は統合設定を使用
         if dataset_type == "unified_all":
@@ -250,93 +478,267 @@ class VectorStoreProcessor:
 
         chunk_size = config.chunk_size
         overlap = config.overlap
-        max_chunks = config.max_chunks_per_file
+        dedup = NearDuplicateFilter.from_config(self.dedup_cfg) if DEDUP_AVAILABLE else None
+        dataset_label = source_dataset if source_dataset else dataset_type
 
-        jsonl_data = []
-        total_size = 0
+        start_chunks = writer.chunks
+        start_bytes = writer.bytes_written
         warnings = []
-
-        for idx, line in enumerate(lines):
-            # テキストクリーニング
-            cleaned_text = self.clean_text(line)
-
-            if not cleaned_text:
-                continue
-
-            # 長いテキストをチャンクに分割
-            chunks = self.chunk_text(cleaned_text, chunk_size, overlap)
-
-            for chunk_idx, chunk in enumerate(chunks):
-                # チャンク数制限チェック
-                if len(jsonl_data) >= max_chunks:
-                    warnings.append(
-                        f"⚠️ チャンク数が上限({max_chunks:,})に達しました。残り{len(lines) - idx:,}行はスキップされます。")
-                    break
-
-                # 統合モード用のメタデータ設定
-                metadata = {
-                    "dataset"      : source_dataset if source_dataset else dataset_type,
-                    "original_line": idx,
-                    "chunk_index"  : chunk_idx,
-                    "total_chunks" : len(chunks)
-                }
-                
-                # ドメイン情報追加（統合モード時）
-                if source_dataset:
-                    if "medical" in source_dataset:
-                        metadata["domain"] = "medical"
-                    elif "legal" in source_dataset:
-                        metadata["domain"] = "legal"
-                    elif "sciq" in source_dataset or "science" in source_dataset:
-                        metadata["domain"] = "science"
-                    elif "customer" in source_dataset or "faq" in source_dataset:
-                        metadata["domain"] = "customer_support"
-                    elif "trivia" in source_dataset:
-                        metadata["domain"] = "trivia"
+        read_lines = 0
+        processed_lines = 0
+        pool = None  # ファイル内の全ブロックで使い回すプロセスプール（並列化する大きさのブロックが来たら作る）
+
+        def write_block(block: List[Tuple[int, str]]) -> bool:
+            """行ブロックをチャンク分割して書き出す（上限に達したら False）"""
+            nonlocal processed_lines, pool
+            if pool is None and len(block) >= MIN_PARALLEL_ROWS:
+                pool = make_chunk_pool(self.chunk_workers)
+            # 長いテキストをトークン数基準でチャンクに分割（行をまたいでプロセスプールで並行処理、順序は保持）
+            chunked = chunk_texts([text for _, text in block], chunk_size, overlap, workers=self.chunk_workers,
+                                  pool=pool)
+            for (idx, _), chunks in zip(block, chunked):
+                for chunk_idx, chunk in enumerate(chunks):
+                    if stable_ids:
+                        chunk_hash = chunk_digest(chunk)
+                        entry = {"id": f"{dataset_label}_{chunk_hash}", "text": chunk}
+                        written = writer.write(entry, shard=int(chunk_hash[:8], 16) % len(writer.paths),
+                                               key=chunk_hash)
                     else:
-                        metadata["domain"] = "general"
-
-                jsonl_entry = {
-                    "id"      : f"{source_dataset if source_dataset else dataset_type}_{idx}_{chunk_idx}",
-                    "text"    : chunk,
-                    "metadata": metadata
-                }
-
-                jsonl_data.append(jsonl_entry)
-                total_size += len(json.dumps(jsonl_entry, ensure_ascii=False))
-
-                # ファイルサイズ制限チェック（概算）
-                estimated_size_mb = total_size / (1024 * 1024)
-                if estimated_size_mb > config.max_file_size_mb:
-                    warnings.append(
-                        f"⚠️ ファイルサイズが上限({config.max_file_size_mb}MB)に達しました。残りはスキップされます。")
+                        entry = {"id": f"{dataset_label}_{idx}_{chunk_idx}", "text": chunk}
+                        written = writer.write(entry)
+                    if not written:
+                        if writer.full_reason == "chunks":
+                            warnings.append(
+                                f"⚠️ チャンク数が上限({writer.max_chunks:,})に達しました。{idx + 1:,}行目以降はスキップされます。")
+                        else:
+                            warnings.append(
+                                f"⚠️ ファイルサイズが上限({writer.max_bytes / (1024 * 1024):.0f}MB)に達しました。"
+                                f"{idx + 1:,}行目以降はスキップされます。")
+                        return False
+                processed_lines = idx + 1
+            return True
+
+        # テキストクリーニングと重複除去（先勝ちなので行順に逐次処理）
+        block: List[Tuple[int, str]] = []
+        full = writer.full_reason is not None
+        try:
+            for idx, line in enumerate(lines):
+                if full:
                     break
+                read_lines = idx + 1
+                cleaned_text = self.clean_text(line)
 
-            # 制限に達した場合はループを抜ける
-            if len(jsonl_data) >= max_chunks or total_size / (1024 * 1024) > config.max_file_size_mb:
-                break
+                if not cleaned_text:
+                    continue
+                # 正規化後に一致する・近似重複の行は登録しない（先勝ち）
+                if dedup is not None and dedup.is_duplicate(cleaned_text):
+                    continue
+                block.append((idx, cleaned_text))
+                if len(block) >= block_rows:
+                    full = not write_block(block)
+                    block = []
+            if block and not full:
+                write_block(block)
+        finally:
+            if pool is not None:
+                pool.shutdown()
+
+        written_chunks = writer.chunks - start_chunks
+        written_bytes = writer.bytes_written - start_bytes
 
         # 統計情報
         stats = {
-            "original_lines"   : len(lines),
-            "processed_lines"  : idx + 1 if jsonl_data else 0,
-            "total_chunks"     : len(jsonl_data),
-            "estimated_size_mb": total_size / (1024 * 1024),
+            "original_lines"   : read_lines,
+            "processed_lines"  : processed_lines,
+            "total_chunks"     : written_chunks,
+            "size_bytes"       : written_bytes,
+            "estimated_size_mb": written_bytes / (1024 * 1024),
             "warnings"         : warnings,
             "chunk_size_used"  : chunk_size,
             "overlap_used"     : overlap,
-            "source_dataset"   : source_dataset if source_dataset else dataset_type
+            "source_dataset"   : dataset_label,
+            "dedup"            : dedup.report() if dedup is not None else None
         }
 
-        dataset_label = source_dataset if source_dataset else dataset_type
         logger.info(
-            f"{dataset_label}: {len(lines)}行 -> {len(jsonl_data)}チャンク (推定{stats['estimated_size_mb']:.1f}MB)")
+            f"{dataset_label}: {read_lines}行 -> {written_chunks}チャンク ({stats['estimated_size_mb']:.1f}MB)")
+
+        if dedup is not None and dedup.rows:
+            logger.info(format_dedup_report(dataset_label, stats["dedup"]))
 
         if warnings:
             for warning in warnings:
                 logger.warning(warning)
 
-        return jsonl_data, stats
+        return stats
+
+
+# ===================================================================
+# Vector Store処理状況のポーリング
+# ===================================================================
+@dataclass
+class PollTarget:
+    """ポーリング対象（Vector Store の file batch、batch_id が None なら Vector Store 全体）の状態"""
+    key: str
+    vector_store_id: str
+    batch_id: Optional[str]
+    started: float = field(default_factory=time.time)
+    status: str = "in_progress"
+    completed: int = 0
+    failed: int = 0
+    total: int = 0
+    polls: int = 0
+    interval: float = 0.0
+    next_poll: float = 0.0
+    elapsed_s: float = 0.0
+    file_completed_s: Dict[str, float] = field(default_factory=dict)  # file_id -> completed までの秒数
+    failed_files: List[Any] = field(default_factory=list)
+
+    @property
+    def done(self) -> bool:
+        return self.status in VectorStorePoller.TERMINAL
+
+
+class VectorStorePoller:
+    """複数の file batch の処理状況を1つのループで監視する（指数バックオフ＋ジッター）
+
+    completed / failed 数が変化した対象は間隔を initial_interval に戻し、変化が無ければ
+    multiplier 倍ずつ max_interval まで延ばす。次回時刻には ±jitter の揺らぎを加え、
+    多数のストアを同時に待つときに問い合わせが同じ時刻に集中しないようにする。
+    """
+
+    TERMINAL = ("completed", "failed", "cancelled", "timeout")
+
+    def __init__(self, client: "OpenAI", initial_interval: float = 1.0, max_interval: float = 30.0,
+                 multiplier: float = 2.0, jitter: float = 0.2, timeout: float = 600.0,
+                 on_progress: Optional[Callable[[PollTarget], None]] = None, rng: Optional[random.Random] = None):
+        self.client = client
+        self.initial_interval = initial_interval
+        self.max_interval = max_interval
+        self.multiplier = multiplier
+        self.jitter = jitter
+        self.timeout = timeout
+        self.on_progress = on_progress
+        self.rng = rng or random.Random()
+        self.targets: Dict[str, PollTarget] = {}
+
+    def add(self, key: str, vector_store_id: str, batch_id: Optional[str],
+            started: Optional[float] = None) -> PollTarget:
+        """監視対象を追加（初回の問い合わせは initial_interval 後）"""
+        target = PollTarget(key=key, vector_store_id=vector_store_id, batch_id=batch_id,
+                            started=started if started is not None else time.time())
+        self._schedule(target, progressed=True)
+        self.targets[key] = target
+        return target
+
+    def _schedule(self, target: PollTarget, progressed: bool):
+        if progressed or not target.interval:
+            target.interval = self.initial_interval
+        else:
+            target.interval = min(self.max_interval, target.interval * self.multiplier)
+        spread = target.interval * self.jitter
+        target.next_poll = time.time() + max(0.0, target.interval + self.rng.uniform(-spread, spread))
+
+    def poll(self, target: PollTarget):
+        """1対象の状態を1回問い合わせて更新"""
+        target.polls += 1
+        target.elapsed_s = time.time() - target.started
+        try:
+            if target.batch_id:
+                batch = self.client.vector_stores.file_batches.retrieve(
+                    vector_store_id=target.vector_store_id,
+                    batch_id=target.batch_id
+                )
+                counts, status = batch.file_counts, batch.status
+            else:
+                store = self.client.vector_stores.retrieve(target.vector_store_id)
+                counts = store.file_counts
+                status = "in_progress" if counts.in_progress or not counts.total else "completed"
+        except Exception as e:
+            # 一時的なAPIエラーは間隔を延ばして再試行
+            logger.warning(f"⚠️ {target.key}: ステータス取得エラー: {e}")
+            self._check_timeout(target)
+            self._schedule(target, progressed=False)
+            return
+
+        progressed = counts.completed != target.completed or counts.failed != target.failed
+        new_failures = counts.failed > target.failed
+        target.completed, target.failed, target.total = counts.completed, counts.failed, counts.total
+        if progressed:
+            # 完了・失敗したファイルを特定（件数が変化したときだけ一覧を取得）
+            try:
+                vs_files = list(self._iter_files(target))
+            except Exception as e:
+                # 一覧の取得に失敗しても前回の failed_files を保持して監視を続ける
+                logger.warning(f"⚠️ {target.key}: ファイル一覧の取得エラー: {e}")
+            else:
+                target.failed_files = []
+                for vs_file in vs_files:
+                    if vs_file.status == "completed":
+                        target.file_completed_s.setdefault(vs_file.id, target.elapsed_s)
+                    elif vs_file.status == "failed":
+                        target.failed_files.append(vs_file)
+
+        # 完了判定は終端ステータスのときだけ行う（処理中の部分的な失敗は警告のみ）
+        target.status = status
+        if status not in self.TERMINAL and new_failures:
+            logger.warning(f"⚠️ {target.key}: 処理中に失敗したファイルがあります: "
+                           f"{target.failed}/{target.total}（完了を待って判定）")
+        if status == "completed" and target.failed:
+            target.status = "failed"
+        self._check_timeout(target)
+        if not target.done:
+            self._schedule(target, progressed)
+
+    def _iter_files(self, target: PollTarget, page_size: int = 100) -> Iterator[Any]:
+        """対象の Vector Store ファイルを after カーソルで全ページ分列挙"""
+        after = None
+        while True:
+            kwargs = {"vector_store_id": target.vector_store_id, "limit": page_size}
+            if after:
+                kwargs["after"] = after
+            if target.batch_id:
+                page = self.client.vector_stores.file_batches.list_files(batch_id=target.batch_id, **kwargs)
+            else:
+                page = self.client.vector_stores.files.list(**kwargs)
+            data = list(page.data)
+            yield from data
+            if not data or not getattr(page, "has_more", False):
+                return
+            after = data[-1].id
+
+    def _check_timeout(self, target: PollTarget):
+        if not target.done and target.elapsed_s >= self.timeout:
+            target.status = "timeout"
+
+    def wait(self) -> Dict[str, PollTarget]:
+        """全対象が完了・失敗・タイムアウトするまで、次回時刻の早い対象から順に問い合わせる"""
+        while True:
+            pending = [t for t in self.targets.values() if not t.done]
+            if not pending:
+                return self.targets
+            target = min(pending, key=lambda t: t.next_poll)
+            delay = target.next_poll - time.time()
+            if delay > 0:
+                time.sleep(delay)
+            self.poll(target)
+            if self.on_progress:
+                self.on_progress(target)
+
+
+@dataclass
+class PendingBuild:
+    """ファイル登録済みで、サーバ側の処理完了を待っている Vector Store"""
+    key: str
+    vector_store_id: str
+    batch_id: Optional[str]  # None: ファイルを個別に登録した（Vector Store 単位で完了を待つ）
+    store_name: str
+    shards: List[Dict[str, Any]]
+    started: float
+    upload_s: float
+    result: Dict[str, Any] = field(default_factory=dict)  # 完了時に返す結果（upload_report は完了時に追加）
+    finalize: Optional[Callable[[], None]] = None  # 処理完了後に1回だけ呼ぶ（差分同期の後始末など）
+    rollback: Optional[Callable[[], None]] = None  # 失敗・タイムアウト時に1回だけ呼ぶ（追加したファイルの取り消し）
 
 
 # ===================================================================
@@ -345,7 +747,9 @@ class VectorStoreProcessor:
 class VectorStoreManager:
     """Vector Store管理クラス"""
 
-    def __init__(self, api_key: str = None):
+    def __init__(self, api_key: str = None, upload_shards: int = 1, upload_workers: int = 8,
+                 poll_timeout: float = 600.0, manifest_path: Path = None, sync_shards: int = 8,
+                 dedup_cfg: Optional[Dict[str, Any]] = None):
         if api_key is None:
             api_key = os.getenv("OPENAI_API_KEY")
 
@@ -353,146 +757,228 @@ class VectorStoreManager:
             raise ValueError("OpenAI APIキーが設定されていません。環境変数 OPENAI_API_KEY を確認してください。")
 
         self.client = OpenAI(api_key=api_key)
-        self.processor = VectorStoreProcessor()
+        # dedup_cfg: config.yml の dedup セクション（enabled: true で重複・近似重複を除去）
+        self.processor = VectorStoreProcessor(dedup_cfg=dedup_cfg)
         self.configs = VectorStoreConfig.get_all_configs()
         self.created_stores = {}
+        # JSONL の分割数（サイズの揃ったシャードに分けて並行アップロード）と同時アップロード数
+        self.upload_shards = max(1, upload_shards)
+        self.upload_workers = upload_workers
+        # file batch の処理完了を待つ最大秒数（VectorStorePoller）
+        self.poll_timeout = poll_timeout
+        # 差分同期のマニフェストと、新規同期時のハッシュ分割シャード数
+        self.manifest = VectorStoreManifest(manifest_path or Path("OUTPUT") / "vector_store_manifest.json")
+        self.sync_shards = max(1, sync_shards)
+        # vector_store_id -> シャードごとのアップロード・completed までの時間
+        self.upload_reports: Dict[str, Dict[str, Any]] = {}
+
+    @staticmethod
+    def new_jsonl_path() -> Path:
+        """アップロード用 JSONL の一時ファイルパス（呼び出し側で削除する）"""
+        fd, path = tempfile.mkstemp(suffix='.txt')
+        os.close(fd)
+        return Path(path)
+
+    def upload_jsonl_files(self, paths: List[Path]) -> List[Dict[str, Any]]:
+        """JSONL シャードを並行して OpenAI にアップロード（入力順で file_id・所要時間を返す）"""
+
+        def upload(path: Path) -> Dict[str, Any]:
+            started = time.time()
+            with open(path, 'rb') as file:
+                uploaded_file = self.client.files.create(file=file, purpose="assistants")
+            return {
+                "path"    : str(path),
+                "file_id" : uploaded_file.id,
+                "bytes"   : path.stat().st_size,
+                "upload_s": time.time() - started,
+            }
 
-    def create_vector_store_from_jsonl_data(self, jsonl_data: List[Dict], store_name: str) -> Optional[str]:
-        """JSONL形式のデータからVector Storeを作成"""
-        temp_file_path = None
-        uploaded_file_id = None
+        with ThreadPoolExecutor(max_workers=max(1, min(self.upload_workers, len(paths)))) as pool:
+            return list(pool.map(upload, paths))
 
-        try:
-            # 入力データの検証
-            if not isinstance(jsonl_data, list):
-                logger.error(f"❌ jsonl_dataがリストではありません: {type(jsonl_data)}")
-                return None
+    def start_vector_store_from_jsonl_files(self, jsonl_paths: List[Path], store_name: str, entry_count: int,
+                                            key: str = "", vector_store_id: Optional[str] = None,
+                                            attributes: Optional[Dict[str, Any]] = None,
+                                            file_attributes: Optional[List[Dict[str, Any]]] = None
+                                            ) -> Optional[PendingBuild]:
+        """JSONL シャードを並行アップロードし、Vector Store を作成して file batch で登録する（完了は待たない）
 
-            if not jsonl_data:
-                logger.error("❌ jsonl_dataが空です")
+        vector_store_id を渡すと新規作成せず、既存の Vector Store にファイルを追加する。
+        attributes は全ファイル共通の属性（file batch に付与）。file_attributes（jsonl_paths と同順）を
+        渡した場合はファイルごとに属性を付けて vector_stores.files.create で並行登録する（統合Storeのドメイン別ファイル）。
+        """
+        try:
+            if file_attributes is None:
+                file_attributes = [None] * len(jsonl_paths)
+            pairs = [(Path(p), attrs) for p, attrs in zip(jsonl_paths, file_attributes)
+                     if Path(p).exists() and Path(p).stat().st_size > 0]
+            jsonl_paths = [p for p, _ in pairs]
+            if entry_count <= 0 or not jsonl_paths:
+                logger.error("❌ アップロードするJSONLがありません")
                 return None
 
-            logger.info(f"Vector Store作成開始: {len(jsonl_data)}エントリ")
-
-            # 一時ファイルを作成してアップロード用のJSONLファイルを準備
-            with tempfile.NamedTemporaryFile(mode='w', suffix='.txt', delete=False, encoding='utf-8') as temp_file:
-                for i, entry in enumerate(jsonl_data):
-                    # エントリが辞書型であることを確認
-                    if not isinstance(entry, dict):
-                        logger.error(f"エントリ {i} が辞書型ではありません: {type(entry)}")
-                        return None
-
-                    # 必要なキーが存在することを確認
-                    if "id" not in entry or "text" not in entry:
-                        logger.error(f"エントリ {i} に必要なキーがありません: {list(entry.keys())}")
-                        return None
-
-                    # メタデータは文字列として保存（OpenAI側の制限対応）
-                    jsonl_entry = {
-                        "id"  : entry["id"],
-                        "text": entry["text"]
+            started = time.time()
+            total_mb = sum(p.stat().st_size for p in jsonl_paths) / (1024 * 1024)
+            logger.info(f"Vector Store作成開始: {entry_count}エントリ ({total_mb:.1f}MB, {len(jsonl_paths)}ファイル)")
+
+            # Step 1: シャードを並行してOpenAIにアップロード
+            shards = self.upload_jsonl_files(jsonl_paths)
+            upload_s = time.time() - started
+            file_ids = [s["file_id"] for s in shards]
+
+            logger.info(f"ファイルアップロード完了: {len(file_ids)}ファイル ({upload_s:.1f}秒)")
+
+            # Step 2: Vector Storeを作成（差分同期では既存のStoreを使う）
+            if vector_store_id is None:
+                vector_store = self.client.vector_stores.create(
+                    name=store_name,
+                    metadata={
+                        "created_by" : "vector_store_streamlit_app",
+                        "version"    : "2025.1",
+                        "data_format": "jsonl_as_txt",
+                        "entry_count": str(entry_count),
+                        "shards"     : str(len(file_ids))
                     }
-                    temp_file.write(json.dumps(jsonl_entry, ensure_ascii=False) + '\n')
-
-                temp_file_path = temp_file.name
-
-            logger.info(f"JSONLファイル作成完了: {len(jsonl_data)}エントリ")
-
-            # Step 1: ファイルをOpenAIにアップロード
-            with open(temp_file_path, 'rb') as file:
-                uploaded_file = self.client.files.create(
-                    file=file,
-                    purpose="assistants"
                 )
-                uploaded_file_id = uploaded_file.id
-
-            logger.info(f"ファイルアップロード完了: File ID={uploaded_file_id}")
-
-            # Step 2: Vector Storeを作成
-            vector_store = self.client.vector_stores.create(
-                name=store_name,
-                metadata={
-                    "created_by" : "vector_store_streamlit_app",
-                    "version"    : "2025.1",
-                    "data_format": "jsonl_as_txt",
-                    "entry_count": str(len(jsonl_data))
-                }
-            )
-
-            logger.info(f"Vector Store作成完了: ID={vector_store.id}")
-
-            # Step 3: ファイルをVector Storeに追加
-            vector_store_file = self.client.vector_stores.files.create(
-                vector_store_id=vector_store.id,
-                file_id=uploaded_file_id
-            )
-
-            logger.info(f"Vector StoreFileリンク作成完了")
-
-            # Step 4: ファイル処理完了を待機
-            max_wait_time = 600  # 最大10分待機
-            wait_interval = 5  # 5秒間隔でチェック
-            waited_time = 0
+                vector_store_id = vector_store.id
+
+                logger.info(f"Vector Store作成完了: ID={vector_store_id}")
+
+            # Step 3: ファイルごとの属性があれば1件ずつ並行して登録（完了は Vector Store 単位で待つ）
+            if any(attrs for _, attrs in pairs):
+                def attach(args: Tuple[str, Dict[str, Any]]):
+                    file_id, attrs = args
+                    self.client.vector_stores.files.create(
+                        vector_store_id=vector_store_id,
+                        file_id=file_id,
+                        attributes=attrs
+                    )
 
-            while waited_time < max_wait_time:
-                file_status = self.client.vector_stores.files.retrieve(
-                    vector_store_id=vector_store.id,
-                    file_id=uploaded_file_id
-                )
+                with ThreadPoolExecutor(max_workers=max(1, min(self.upload_workers, len(file_ids)))) as pool:
+                    list(pool.map(attach, [(file_id, attrs or {}) for file_id, (_, attrs) in zip(file_ids, pairs)]))
+                for shard, (_, attrs) in zip(shards, pairs):
+                    shard["attributes"] = attrs
 
-                if file_status.status == "completed":
-                    updated_vector_store = self.client.vector_stores.retrieve(vector_store.id)
+                logger.info(f"Vector Store ファイル登録完了（属性付き）: {len(file_ids)}ファイル")
 
-                    logger.info(f"✅ Vector Store作成完了:")
-                    logger.info(f"  - ID: {vector_store.id}")
-                    logger.info(f"  - Name: {vector_store.name}")
-                    logger.info(f"  - ファイル数: {updated_vector_store.file_counts.total}")
-                    logger.info(f"  - ストレージ使用量: {updated_vector_store.usage_bytes} bytes")
+                return PendingBuild(key=key or vector_store_id, vector_store_id=vector_store_id, batch_id=None,
+                                    store_name=store_name, shards=shards, started=started, upload_s=upload_s)
 
-                    return vector_store.id
+            # Step 3: シャードをまとめてVector Storeに追加（サーバ側で並行処理される）
+            batch_params: Dict[str, Any] = {"vector_store_id": vector_store_id, "file_ids": file_ids}
+            if attributes:
+                batch_params["attributes"] = attributes
+            batch = self.client.vector_stores.file_batches.create(**batch_params)
 
-                elif file_status.status == "failed":
-                    error_msg = getattr(file_status, 'last_error', 'Unknown error')
-                    logger.error(f"❌ ファイル処理失敗: {error_msg}")
+            logger.info(f"Vector Store file batch 作成完了: ID={batch.id}")
 
-                    # 詳細エラー情報をログ出力
-                    if hasattr(file_status, 'last_error') and file_status.last_error:
-                        logger.error(f"エラーコード: {getattr(file_status.last_error, 'code', 'N/A')}")
-                        logger.error(f"エラーメッセージ: {getattr(file_status.last_error, 'message', 'N/A')}")
+            return PendingBuild(key=key or vector_store_id, vector_store_id=vector_store_id, batch_id=batch.id,
+                                store_name=store_name, shards=shards, started=started, upload_s=upload_s)
 
-                    return None
+        except Exception as e:
+            logger.error(f"Vector Store作成エラー: {e}")
+            return None
 
-                elif file_status.status in ["in_progress", "cancelling"]:
-                    time.sleep(wait_interval)
-                    waited_time += wait_interval
+    def wait_for_builds(self, builds: List[PendingBuild],
+                        on_progress: Optional[Callable[[PollTarget], None]] = None) -> Dict[str, Dict[str, Any]]:
+        """登録済みの全 Vector Store の処理完了を1つのポーリングループで待ち、key ごとの結果を返す"""
+        poller = VectorStorePoller(self.client, timeout=self.poll_timeout, on_progress=on_progress)
+        for build in builds:
+            poller.add(build.key, build.vector_store_id, build.batch_id, started=build.started)
+        targets = poller.wait()
+
+        results = {}
+        for build in builds:
+            target = targets[build.key]
+            if target.status != "completed":
+                if target.status == "timeout":
+                    logger.error(f"❌ {build.key}: Vector Store作成タイムアウト (制限時間: {self.poll_timeout:.0f}秒)")
                 else:
-                    logger.warning(f"⚠️ 予期しないステータス: {file_status.status}")
-                    time.sleep(wait_interval)
-                    waited_time += wait_interval
+                    logger.error(f"❌ {build.key}: ファイル処理失敗: status={target.status}, 失敗ファイル数={target.failed}")
+
+                # 詳細エラー情報をログ出力
+                for vs_file in target.failed_files:
+                    last_error = getattr(vs_file, 'last_error', None)
+                    logger.error(f"  {vs_file.id}: エラーコード={getattr(last_error, 'code', 'N/A')}, "
+                                 f"エラーメッセージ={getattr(last_error, 'message', 'N/A')}")
+
+                if build.rollback:
+                    build.rollback()
+                results[build.key] = {"success": False,
+                                      "error"  : f"Vector Store作成に失敗: {build.key} ({target.status})"}
+                continue
 
-            logger.error(f"❌ Vector Store作成タイムアウト (制限時間: {max_wait_time}秒)")
-            return None
+            for s in build.shards:
+                s["completed_s"] = target.file_completed_s.get(s["file_id"], target.elapsed_s)
+            report = {
+                "shards"  : build.shards,
+                "upload_s": build.upload_s,
+                "total_s" : target.elapsed_s,
+                "polls"   : target.polls,
+            }
+            self.upload_reports[build.vector_store_id] = report
+            self.created_stores[build.key] = build.vector_store_id
+            if build.finalize:
+                build.finalize()
+
+            updated_vector_store = self.client.vector_stores.retrieve(build.vector_store_id)
+            logger.info(f"✅ Vector Store作成完了:")
+            logger.info(f"  - ID: {build.vector_store_id}")
+            logger.info(f"  - Name: {build.store_name}")
+            logger.info(f"  - ファイル数: {updated_vector_store.file_counts.total}")
+            logger.info(f"  - ストレージ使用量: {updated_vector_store.usage_bytes} bytes")
+            for i, s in enumerate(build.shards):
+                logger.info(f"  - shard {i}: {s['bytes'] / (1024 * 1024):.1f}MB "
+                            f"upload={s['upload_s']:.1f}s completed={s['completed_s']:.1f}s")
+            logger.info(f"  - 合計: upload={build.upload_s:.1f}s completed={target.elapsed_s:.1f}s "
+                        f"(問い合わせ {target.polls}回)")
+
+            results[build.key] = {
+                **build.result,
+                "success"        : True,
+                "vector_store_id": build.vector_store_id,
+                "store_name"     : build.store_name,
+                "upload_report"  : report,
+            }
+        return results
 
-        except Exception as e:
-            logger.error(f"Vector Store作成エラー: {e}")
+    def create_vector_store_from_jsonl_files(self, jsonl_paths: List[Path], store_name: str, entry_count: int,
+                                             file_attributes: Optional[List[Dict[str, Any]]] = None) -> Optional[str]:
+        """書き出し済みの JSONL シャードから Vector Store を作成し、処理完了まで待つ
+
+        シャードごとのアップロード時間と "completed" までの時間は self.upload_reports[vector_store_id] に残す。
+        """
+        build = self.start_vector_store_from_jsonl_files(jsonl_paths, store_name, entry_count,
+                                                         file_attributes=file_attributes)
+        if build is None:
             return None
+        result = self.wait_for_builds([build])[build.key]
+        return result["vector_store_id"] if result["success"] else None
 
-        finally:
-            # 一時ファイルを削除
-            if temp_file_path and os.path.exists(temp_file_path):
-                os.unlink(temp_file_path)
-                logger.info("🗑️ 一時ファイルを削除しました")
+    def allocate_unified_budget(self, sizes: Dict[str, int], max_bytes: int, max_chunks: int) -> Dict[str, Dict[str, int]]:
+        """統合時の予算（バイト数・チャンク数）をデータセットの CSV サイズに比例して事前に配分する"""
+        total = sum(sizes.values()) or 1
+        return {
+            dataset_type: {
+                "max_bytes" : int(max_bytes * size / total),
+                "max_chunks": int(max_chunks * size / total),
+            }
+            for dataset_type, size in sizes.items()
+        }
 
     def process_unified_datasets(self, selected_datasets: List[str], output_dir: Path = None) -> Dict[str, Any]:
-        """複数データセットを統合してVector Storeを作成"""
+        """複数データセットを統合してVector Storeを作成
+
+        統合時の上限（100MB・チャンク数）を CSV サイズに比例してデータセットごとに事前配分し、
+        各データセットは配分された予算内で1回の書き出しで埋める（後半のデータセットが丸ごと落ちることはない）。
+        使い切らなかった予算は後続のデータセットへ繰り越す。
+        """
         if output_dir is None:
             output_dir = Path("OUTPUT")
         
         # 統合設定を取得
         unified_config = VectorStoreConfig.get_unified_config()
         
-        # 全データセット分のJSONLデータを集積
-        all_jsonl_data = []
         total_lines = 0
         processed_lines = 0
         dataset_stats = {}
@@ -500,7 +986,8 @@ class VectorStoreManager:
         
         logger.info(f"統合Vector Store作成開始: {len(selected_datasets)}データセット")
         
-        # 各データセットを処理
+        # 対象データセットの確認と予算の配分
+        sizes: Dict[str, int] = {}
         for dataset_type in selected_datasets:
             config = self.configs.get(dataset_type)
             if not config:
@@ -512,82 +999,87 @@ class VectorStoreManager:
                 logger.warning(f"ファイル不在: {filepath}")
                 all_warnings.append(f"⚠️ {config.description}のファイルが見つかりません")
                 continue
-            
-            try:
-                # CSVファイル読み込み
-                text_lines = self.processor.load_csv_file(filepath, config.csv_text_column)
-                
-                if not text_lines:
-                    logger.warning(f"有効なテキストなし: {filepath}")
-                    continue
-                
-                # 統合モード用にJSONL変換（source_datasetパラメータを渡す）
-                jsonl_data, stats = self.processor.text_to_jsonl_data(
-                    text_lines, 
-                    "unified_all",  # 統合設定を使用
-                    source_dataset=dataset_type  # 元のデータセット名を保持
-                )
-                
-                # 統計情報収集
-                dataset_stats[dataset_type] = {
-                    "original_lines": len(text_lines),
-                    "chunks": len(jsonl_data),
-                    "size_mb": stats.get("estimated_size_mb", 0)
-                }
-                
-                total_lines += len(text_lines)
-                processed_lines += stats.get("processed_lines", 0)
-                
-                # 警告収集
-                if stats.get("warnings"):
-                    all_warnings.extend([f"[{config.description}] {w}" for w in stats["warnings"]])
-                
-                # データを統合リストに追加
-                all_jsonl_data.extend(jsonl_data)
-                
-                logger.info(f"  {config.description}: {len(jsonl_data)}チャンク追加")
-                
-            except Exception as e:
-                logger.error(f"{dataset_type}処理エラー: {e}")
-                all_warnings.append(f"❌ {config.description}の処理中にエラー: {str(e)}")
-        
-        # 統合データが空の場合
-        if not all_jsonl_data:
-            return {
-                "success": False,
-                "error": "統合可能なデータが見つかりませんでした",
-                "warnings": all_warnings
-            }
-        
-        # 統合データのサイズチェック
-        total_size = sum(len(json.dumps(entry, ensure_ascii=False)) for entry in all_jsonl_data)
-        total_size_mb = total_size / (1024 * 1024)
+            sizes[dataset_type] = filepath.stat().st_size
         
-        logger.info(f"統合データ: 合計{len(all_jsonl_data)}チャンク, {total_size_mb:.1f}MB")
+        max_bytes = unified_config.max_file_size_mb * 1024 * 1024
+        budgets = self.allocate_unified_budget(sizes, max_bytes, unified_config.max_chunks_per_file)
         
-        # サイズ制限チェック（統合時は100MBまで許可）
-        if total_size_mb > unified_config.max_file_size_mb:
-            # データをトリミング
-            target_size_mb = unified_config.max_file_size_mb * 0.9  # 90%を目標
-            reduction_ratio = target_size_mb / total_size_mb
-            target_chunks = int(len(all_jsonl_data) * reduction_ratio)
+        # 全データセットのチャンクをJSONLへ直接書き出す（統合時は100MBまで許可）
+        # ファイル属性は1ファイル単位なので、シャードはデータセットごとに upload_shards 個ずつ割り当てる
+        per_dataset = self.upload_shards
+        writer = JsonlBudgetWriter(self.new_jsonl_path(), max_bytes=max_bytes,
+                                   max_chunks=unified_config.max_chunks_per_file,
+                                   shards=max(1, len(budgets) * per_dataset))
+        shard_attributes: List[Dict[str, Any]] = [{} for _ in writer.paths]
+        try:
+            with writer:
+                carry_bytes = 0
+                carry_chunks = 0
+                # 各データセットを処理
+                for i, (dataset_type, budget) in enumerate(budgets.items()):
+                    config = self.configs[dataset_type]
+                    filepath = output_dir / config.filename
+                    shards = range(i * per_dataset, (i + 1) * per_dataset)
+                    for j, shard in enumerate(shards):
+                        shard_attributes[shard] = {"domain": config.domain, "dataset": dataset_type,
+                                                   "shard_index": j}
+                    view = writer.sub_budget(budget["max_bytes"] + carry_bytes, budget["max_chunks"] + carry_chunks,
+                                             shards=shards)
+                    
+                    try:
+                        # 統合モード用にJSONLへ書き出し（source_datasetパラメータを渡す）
+                        stats = self.processor.text_to_jsonl_file(
+                            self.processor.iter_csv_file(filepath, config.csv_text_column),
+                            "unified_all",  # 統合設定を使用
+                            view,
+                            source_dataset=dataset_type  # 元のデータセット名を保持
+                        )
+                        
+                        # 統計情報収集
+                        dataset_stats[dataset_type] = {
+                            "original_lines": stats["original_lines"],
+                            "chunks": stats["total_chunks"],
+                            "size_mb": stats["estimated_size_mb"],
+                            "budget_mb": view.max_bytes / (1024 * 1024),
+                            "budget_used": view.bytes_written / view.max_bytes if view.max_bytes else 0.0,
+                            "budget_full": view.full_reason,
+                            "dedup_dropped": (stats.get("dedup") or {}).get("dropped", 0)
+                        }
+                        
+                        total_lines += stats["original_lines"]
+                        processed_lines += stats["processed_lines"]
+                        
+                        # 警告収集
+                        if stats.get("warnings"):
+                            all_warnings.extend([f"[{config.description}] {w}" for w in stats["warnings"]])
+                        
+                        logger.info(f"  {config.description}: {stats['total_chunks']}チャンク追加 "
+                                    f"(予算 {view.size_mb:.1f}/{view.max_bytes / (1024 * 1024):.1f}MB)")
+                        
+                    except Exception as e:
+                        logger.error(f"{dataset_type}処理エラー: {e}")
+                        all_warnings.append(f"❌ {config.description}の処理中にエラー: {str(e)}")
+                    
+                    # 使い切らなかった予算は後続のデータセットへ繰り越す
+                    carry_bytes = view.max_bytes - view.bytes_written
+                    carry_chunks = view.max_chunks - view.chunks
             
-            logger.warning(f"統合データサイズ超過: {total_size_mb:.1f}MB -> {target_size_mb:.1f}MB")
-            all_warnings.append(f"⚠️ データサイズ制限により{len(all_jsonl_data)}チャンクから{target_chunks}チャンクに削減")
+            # 統合データが空の場合
+            if writer.chunks == 0:
+                return {
+                    "success": False,
+                    "error": "統合可能なデータが見つかりませんでした",
+                    "warnings": all_warnings
+                }
             
-            # 各データセットから均等に削減
-            all_jsonl_data = all_jsonl_data[:target_chunks]
+            logger.info(f"統合データ: 合計{writer.chunks}チャンク, {writer.size_mb:.1f}MB")
             
-            # サイズ再計算
-            total_size = sum(len(json.dumps(entry, ensure_ascii=False)) for entry in all_jsonl_data)
-            total_size_mb = total_size / (1024 * 1024)
-        
-        # Vector Store作成
-        try:
+            # Vector Store作成
             store_name = unified_config.store_name
             logger.info(f"統合Vector Store作成開始: {store_name}")
             
-            vector_store_id = self.create_vector_store_from_jsonl_data(all_jsonl_data, store_name)
+            vector_store_id = self.create_vector_store_from_jsonl_files(writer.paths, store_name, writer.chunks,
+                                                                        file_attributes=shard_attributes)
             
             if vector_store_id:
                 self.created_stores["unified_all"] = vector_store_id
@@ -598,10 +1090,11 @@ class VectorStoreManager:
                     "store_name": store_name,
                     "processed_lines": processed_lines,
                     "total_lines": total_lines,
-                    "created_chunks": len(all_jsonl_data),
-                    "estimated_size_mb": total_size_mb,
+                    "created_chunks": writer.chunks,
+                    "estimated_size_mb": writer.size_mb,
                     "warnings": all_warnings,
                     "dataset_stats": dataset_stats,
+                    "upload_report": self.upload_reports.get(vector_store_id),
                     "config_used": {
                         "chunk_size": unified_config.chunk_size,
                         "overlap": unified_config.overlap,
@@ -622,134 +1115,227 @@ class VectorStoreManager:
                 "error": f"統合処理中にエラーが発生: {str(e)}",
                 "warnings": all_warnings
             }
+        
+        finally:
+            # 一時ファイルを削除
+            writer.remove()
+            logger.info("🗑️ 一時ファイルを削除しました")
     
-    def process_single_dataset(self, dataset_type: str, output_dir: Path = None) -> Dict[str, Any]:
-        """単一データセットの処理（完全修正版）"""
+    def start_single_dataset(self, dataset_type: str, output_dir: Path = None,
+                             sync: bool = False) -> Tuple[Optional[PendingBuild], Dict[str, Any]]:
+        """単一データセットを JSONL 化してアップロード・登録する（サーバ側の処理完了は待たない）
+
+        sync=True ならマニフェストに記録された既存の Vector Store に、変更のあったシャードだけを登録する
+
+        Returns:
+            (登録済みビルド, 待つ必要のない場合の結果)。失敗時・同期で変更が無い場合はビルドが None
+        """
         if output_dir is None:
             output_dir = Path("OUTPUT")
 
         config = self.configs.get(dataset_type)
         if not config:
-            return {"success": False, "error": f"未知のデータセットタイプ: {dataset_type}"}
+            return None, {"success": False, "error": f"未知のデータセットタイプ: {dataset_type}"}
 
         # ファイルパスの構築
         filepath = output_dir / config.filename
 
         if not filepath.exists():
-            return {"success": False, "error": f"ファイルが見つかりません: {filepath}"}
-
-        try:
-            # Step 1: CSVファイル読み込み
-            text_lines = self.processor.load_csv_file(filepath, config.csv_text_column)
-
-            if not text_lines:
-                return {"success": False, "error": f"有効なテキストが見つかりません: {filepath}"}
-
-            # Step 2: JSONL形式に変換（修正版）
-            try:
-                result = self.processor.text_to_jsonl_data(text_lines, dataset_type)
-
-                # タプルであることを確認
-                if not isinstance(result, tuple) or len(result) != 2:
-                    logger.error(f"text_to_jsonl_dataの戻り値が期待する形式ではありません: {type(result)}")
-                    return {"success": False, "error": "内部エラー: 変換処理の戻り値が不正"}
-
-                # タプルを分離
-                jsonl_data_list, stats_dict = result
+            return None, {"success": False, "error": f"ファイルが見つかりません: {filepath}"}
 
-                # 型チェック
-                if not isinstance(jsonl_data_list, list):
-                    logger.error(f"jsonl_dataがリストではありません: {type(jsonl_data_list)}")
-                    return {"success": False, "error": "内部エラー: JSONLデータがリスト型ではない"}
+        # 差分同期ではシャード数をマニフェストに合わせる（ハッシュ分割の振り分け先を変えない）
+        entry = self.synced_store(dataset_type) if sync else None
+        shards = (entry or {}).get("shard_count", self.sync_shards) if sync else self.upload_shards
 
-                if not isinstance(stats_dict, dict):
-                    logger.error(f"statsが辞書ではありません: {type(stats_dict)}")
-                    return {"success": False, "error": "内部エラー: 統計データが辞書型ではない"}
-
-                logger.info(f"✅ JSONL変換成功: {len(jsonl_data_list)}チャンク作成")
+        # Step 1-2: CSVを読みながらチャンク化し、上限（サイズ・チャンク数）内でJSONLシャードへ書き出す
+        max_size_mb = min(config.max_file_size_mb, SINGLE_STORE_MAX_FILE_MB)
+        writer = JsonlBudgetWriter(self.new_jsonl_path(), max_bytes=max_size_mb * 1024 * 1024,
+                                   max_chunks=config.max_chunks_per_file, shards=shards)
+        try:
+            with writer:
+                stats_dict = self.processor.text_to_jsonl_file(
+                    self.processor.iter_csv_file(filepath, config.csv_text_column), dataset_type, writer,
+                    stable_ids=sync)
 
-            except Exception as convert_error:
-                logger.error(f"JSONL変換でエラー: {convert_error}")
-                return {"success": False, "error": f"JSONL変換エラー: {str(convert_error)}"}
+            if writer.chunks == 0:
+                return None, {"success": False, "error": f"有効なテキストが見つかりません: {filepath}"}
 
-            if not jsonl_data_list:
-                return {"success": False, "error": f"JSONL変換に失敗: {dataset_type}"}
+            logger.info(f"✅ JSONL書き出し完了: {writer.chunks}チャンク, {writer.size_mb:.1f}MB")
 
             # サイズ制限警告のチェック
             if stats_dict.get("warnings"):
                 warning_msg = "; ".join(stats_dict["warnings"])
                 logger.warning(f"{dataset_type}: {warning_msg}")
 
-            # 事前ファイルサイズチェック
-            estimated_size_mb = stats_dict.get("estimated_size_mb", 0)
-            if estimated_size_mb > 25:  # 25MB制限に厳格化
-                logger.error(f"❌ ファイルサイズが大きすぎます: {estimated_size_mb:.1f}MB > 25MB")
-                return {
-                    "success": False,
-                    "error"  : f"ファイルサイズが制限を超えています: {estimated_size_mb:.1f}MB (制限: 25MB). チャンクサイズを大きくするか、データを分割してください。"
+            result = {
+                "processed_lines"  : stats_dict.get("processed_lines", 0),
+                "total_lines"      : stats_dict.get("original_lines", 0),
+                "created_chunks"   : writer.chunks,
+                "estimated_size_mb": writer.size_mb,
+                "warnings"         : stats_dict.get("warnings", []),
+                "dedup"            : stats_dict.get("dedup"),
+                "config_used"      : {
+                    "chunk_size": stats_dict.get("chunk_size_used", 0),
+                    "overlap"   : stats_dict.get("overlap_used", 0)
                 }
+            }
 
-            # 医療QA特有の追加制限
-            if dataset_type == "medical_qa":
-                if len(jsonl_data_list) > 5000:  # さらに厳格な制限
-                    logger.warning(f"医療QAデータのチャンク数制限適用: {len(jsonl_data_list):,} -> 5,000")
-                    jsonl_data_list = jsonl_data_list[:5000]
-                    stats_dict["warnings"].append("医療QAデータのチャンク数を5,000に制限しました")
-
-                # サイズ再計算
-                total_size_recalc = sum(len(json.dumps(entry, ensure_ascii=False)) for entry in jsonl_data_list)
-                estimated_size_mb_recalc = total_size_recalc / (1024 * 1024)
-
-                # 15MB制限でさらにチェック
-                if estimated_size_mb_recalc > 15:
-                    # さらに削減が必要
-                    target_chunks = int(len(jsonl_data_list) * 15 / estimated_size_mb_recalc)
-                    target_chunks = max(1000, target_chunks)  # 最低1000チャンクは保証
-                    logger.warning(
-                        f"医療QAデータのサイズ制限適用: {len(jsonl_data_list):,} -> {target_chunks:,}チャンク")
-                    jsonl_data_list = jsonl_data_list[:target_chunks]
-                    stats_dict["warnings"].append(
-                        f"医療QAデータを15MB以下にするため{target_chunks:,}チャンクに制限しました")
-
-                    # 最終サイズ再計算
-                    total_size_recalc = sum(len(json.dumps(entry, ensure_ascii=False)) for entry in jsonl_data_list)
-                    estimated_size_mb_recalc = total_size_recalc / (1024 * 1024)
-
-                stats_dict["estimated_size_mb"] = estimated_size_mb_recalc
-                stats_dict["total_chunks"] = len(jsonl_data_list)
-
-                logger.info(f"医療QA最適化後: {len(jsonl_data_list):,}チャンク, {estimated_size_mb_recalc:.1f}MB")
-
-            # Step 3: Vector Store作成（修正版 - jsonl_data_listを渡す）
+            # Step 3: Vector Store作成（書き出し済みファイルをそのままアップロード）
             store_name = config.store_name
-            logger.info(f"Vector Store作成開始: {store_name}")
+            # ファイル属性（file_search の filters で絞り込める）
+            attributes = {"domain": config.domain, "dataset": dataset_type}
+            if sync:
+                return self.start_sync(dataset_type, store_name, writer, entry, result, attributes=attributes)
 
-            # ここが重要：jsonl_data_listを渡す（タプルではなく）
-            vector_store_id = self.create_vector_store_from_jsonl_data(jsonl_data_list, store_name)
+            logger.info(f"Vector Store作成開始: {store_name}")
 
-            if vector_store_id:
-                self.created_stores[dataset_type] = vector_store_id
+            build = self.start_vector_store_from_jsonl_files(writer.written_paths(), store_name, writer.chunks,
+                                                             key=dataset_type, attributes=attributes)
+            if build is None:
+                return None, {"success": False, "error": f"Vector Store作成に失敗: {dataset_type}"}
 
-                return {
-                    "success"          : True,
-                    "vector_store_id"  : vector_store_id,
-                    "store_name"       : store_name,
-                    "processed_lines"  : stats_dict.get("processed_lines", 0),
-                    "total_lines"      : stats_dict.get("original_lines", 0),
-                    "created_chunks"   : len(jsonl_data_list),
-                    "estimated_size_mb": stats_dict.get("estimated_size_mb", 0),
-                    "warnings"         : stats_dict.get("warnings", []),
-                    "config_used"      : {
-                        "chunk_size": stats_dict.get("chunk_size_used", 0),
-                        "overlap"   : stats_dict.get("overlap_used", 0)
-                    }
-                }
-            else:
-                return {"success": False, "error": f"Vector Store作成に失敗: {dataset_type}"}
+            build.result = result
+            return build, {}
 
         except Exception as e:
             logger.error(f"{dataset_type} 処理エラー: {str(e)}")
-            return {"success": False, "error": f"処理中にエラーが発生: {str(e)}"}
+            return None, {"success": False, "error": f"処理中にエラーが発生: {str(e)}"}
+
+        finally:
+            # 一時ファイルを削除（アップロード済みなので完了待ちの前に消してよい）
+            writer.remove()
+            logger.info("🗑️ 一時ファイルを削除しました")
+
+    def synced_store(self, key: str) -> Optional[Dict[str, Any]]:
+        """マニフェストの記録を返す（記録された Vector Store が削除済みなら記録も消して None）"""
+        entry = self.manifest.get(key)
+        if not entry:
+            return None
+        try:
+            self.client.vector_stores.retrieve(entry["vector_store_id"])
+        except Exception as e:
+            logger.warning(f"⚠️ {key}: マニフェストのVector Store {entry['vector_store_id']} を取得できないため新規作成します: {e}")
+            self.manifest.remove(key)
+            return None
+        return entry
+
+    def start_sync(self, key: str, store_name: str, writer: JsonlBudgetWriter, entry: Optional[Dict[str, Any]],
+                   result: Dict[str, Any], attributes: Optional[Dict[str, Any]] = None
+                   ) -> Tuple[Optional[PendingBuild], Dict[str, Any]]:
+        """ハッシュ分割したシャードをマニフェストと比較し、変更のあったシャードだけを既存Storeへ登録する
+
+        旧版のファイルは新しいシャードの処理完了後に Vector Store から外して削除し、マニフェストを更新する。
+        """
+        old_shards: Dict[str, Dict[str, Any]] = (entry or {}).get("shards", {})
+        new_shards: Dict[str, Dict[str, Any]] = {}
+        changed: List[Tuple[str, Path, str, int]] = []
+        for i, (path, keys) in enumerate(zip(writer.paths, writer.shard_keys)):
+            if not keys:
+                continue
+            # シャードの内容はチャンクハッシュの集合で比較（行の並び替えでは変わらない）
+            digest = hashlib.sha256("\n".join(sorted(keys)).encode("utf-8")).hexdigest()
+            old = old_shards.get(str(i))
+            if old and old["digest"] == digest:
+                new_shards[str(i)] = old
+            else:
+                changed.append((str(i), path, digest, len(keys)))
+        stale_file_ids = [s["file_id"] for no, s in old_shards.items() if new_shards.get(no) is not s]
+        sync_info = {
+            "uploaded" : len(changed),
+            "unchanged": len(new_shards),
+            "deleted"  : len(stale_file_ids),
+        }
+        logger.info(f"♻️ {key}: 差分同期 追加/変更={sync_info['uploaded']} 変更なし={sync_info['unchanged']} "
+                    f"削除={sync_info['deleted']}シャード")
+
+        vector_store_id = entry["vector_store_id"] if entry else None
+        build = None
+        if changed:
+            build = self.start_vector_store_from_jsonl_files([path for _, path, _, _ in changed], store_name,
+                                                             writer.chunks, key=key, vector_store_id=vector_store_id,
+                                                             attributes=attributes)
+            if build is None:
+                return None, {"success": False, "error": f"Vector Store同期に失敗: {key}"}
+            vector_store_id = build.vector_store_id
+            for (no, _, digest, chunks), uploaded in zip(changed, build.shards):
+                new_shards[no] = {"digest": digest, "file_id": uploaded["file_id"], "chunks": chunks,
+                                  "bytes": uploaded["bytes"]}
+        elif vector_store_id is None:
+            return None, {"success": False, "error": f"同期するチャンクがありません: {key}"}
+
+        def finalize():
+            # 旧版・不要になったシャードのファイルを Vector Store から外して削除
+            for file_id in stale_file_ids:
+                try:
+                    self.client.vector_stores.files.delete(vector_store_id=vector_store_id, file_id=file_id)
+                    self.client.files.delete(file_id)
+                except Exception as e:
+                    logger.warning(f"⚠️ {key}: 旧ファイル {file_id} の削除に失敗: {e}")
+            self.manifest.set(key, {
+                "vector_store_id": vector_store_id,
+                "store_name"     : store_name,
+                "shard_count"    : len(writer.paths),
+                "shards"         : new_shards,
+                "chunk_files"    : {chunk_hash: new_shards[str(i)]["file_id"]
+                                    for i, keys in enumerate(writer.shard_keys) for chunk_hash in keys},
+            })
+            logger.info(f"♻️ {key}: マニフェスト更新 ({self.manifest.path})")
+
+        def rollback():
+            # 処理に失敗した新しいシャードを外して削除（旧版とマニフェストはそのまま残り、次回の同期で再登録する）
+            for shard in build.shards:
+                try:
+                    self.client.vector_stores.files.delete(vector_store_id=vector_store_id, file_id=shard["file_id"])
+                except Exception as e:
+                    logger.warning(f"⚠️ {key}: 新ファイル {shard['file_id']} をVector Storeから外せません: {e}")
+                try:
+                    self.client.files.delete(shard["file_id"])
+                except Exception as e:
+                    logger.warning(f"⚠️ {key}: 新ファイル {shard['file_id']} の削除に失敗: {e}")
+            logger.info(f"♻️ {key}: 同期失敗のため追加したシャード {len(build.shards)}件を取り消しました")
+
+        result = {**result, "sync": sync_info}
+        if build is None:
+            # 追加・変更なし（削除のみ、または完全一致）はポーリング不要
+            finalize()
+            self.created_stores[key] = vector_store_id
+            return None, {**result, "success": True, "vector_store_id": vector_store_id, "store_name": store_name,
+                          "upload_report": None}
+        build.result = result
+        build.finalize = finalize
+        build.rollback = rollback
+        return build, {}
+
+    def process_single_dataset(self, dataset_type: str, output_dir: Path = None, sync: bool = False) -> Dict[str, Any]:
+        """単一データセットの処理（CSV → JSONL 書き出し → Vector Store 作成 → 処理完了待ち）"""
+        return self.process_datasets([dataset_type], output_dir, sync=sync)[dataset_type]
+
+    def process_datasets(self, dataset_types: List[str], output_dir: Path = None,
+                         on_started: Optional[Callable[[str, Dict[str, Any]], None]] = None,
+                         on_progress: Optional[Callable[[PollTarget], None]] = None,
+                         sync: bool = False) -> Dict[str, Dict[str, Any]]:
+        """複数データセットを順にアップロード・登録し、サーバ側の処理完了はまとめて待つ
+
+        全ストアの完了までの時間は合計ではなく最も遅いストアの時間で決まる。
+
+        Args:
+            on_started: 登録（または失敗）したデータセットごとに (dataset_type, 途中結果) で呼ばれる
+            on_progress: ポーリングのたびに PollTarget（key は dataset_type）で呼ばれる
+            sync: 既存の Vector Store を差分同期する（start_sync）
+        """
+        results: Dict[str, Dict[str, Any]] = {}
+        builds: List[PendingBuild] = []
+        for dataset_type in dataset_types:
+            build, result = self.start_single_dataset(dataset_type, output_dir, sync=sync)
+            if build is None:
+                results[dataset_type] = result
+            else:
+                builds.append(build)
+            if on_started:
+                on_started(dataset_type, result if build is None else {"success": None, **build.result})
+        if builds:
+            results.update(self.wait_for_builds(builds, on_progress=on_progress))
+        return {dataset_type: results[dataset_type] for dataset_type in dataset_types}
 
     def list_vector_stores(self) -> List[Dict]:
         """既存のVector Storeを一覧表示"""
@@ -801,7 +1387,7 @@ class VectorStoreUI:
         st.caption("OpenAI Vector Storeの自動作成・管理システム")
         st.markdown("---")
 
-    def setup_sidebar(self) -> Tuple[str, bool]:
+    def setup_sidebar(self) -> Tuple[str, bool, int, bool, Dict[str, Any]]:
         """サイドバー設定"""
         st.sidebar.title("🔗 Vector Store作成")
         st.sidebar.markdown("---")
@@ -826,6 +1412,33 @@ class VectorStoreUI:
             help="5つのデータセットを一括でVector Store化"
         )
 
+        # アップロード分割数
+        upload_shards = st.sidebar.number_input(
+            "📦 アップロード分割数",
+            min_value=1,
+            max_value=32,
+            value=1,
+            help="JSONLをサイズの揃ったN個のファイルに分割し、並行アップロードしてfile batchで登録します"
+        )
+
+        # 差分同期
+        sync = st.sidebar.checkbox(
+            "♻️ 差分同期（既存Storeを更新）",
+            value=False,
+            help="前回作成したVector Storeを使い続け、変更のあったシャードだけをアップロードします"
+                 "（OUTPUT/vector_store_manifest.json）"
+        )
+
+        # 重複・近似重複の除去（既定値は config.yml の dedup.enabled）
+        dedup_cfg = load_dedup_config()
+        dedup_cfg["enabled"] = st.sidebar.checkbox(
+            "🧹 重複・近似重複を除去",
+            value=bool(dedup_cfg.get("enabled", False)),
+            disabled=not DEDUP_AVAILABLE,
+            help="埋め込み前に同一・表記ゆれ・近似重複のテキストを除去します"
+                 "（helper_dedup.py、numpy が必要。閾値は config.yml の dedup セクション）"
+        ) and DEDUP_AVAILABLE
+
         # APIキー確認
         with st.sidebar.expander("🔑 API設定確認", expanded=False):
             api_key_status = "✅ 設定済み" if os.getenv("OPENAI_API_KEY") else "❌ 未設定"
@@ -835,7 +1448,7 @@ class VectorStoreUI:
                 st.error("環境変数 OPENAI_API_KEY を設定してください")
                 st.code("export OPENAI_API_KEY='your-api-key-here'")
 
-        return selected_model, process_all
+        return selected_model, process_all, int(upload_shards), sync, dedup_cfg
 
     def display_dataset_selection(self) -> List[str]:
         """データセット選択UI"""
@@ -941,6 +1554,8 @@ class VectorStoreUI:
                     "処理行数"       : f"{result.get('processed_lines', 0):,} / {result.get('total_lines', 0):,}",
                     "チャンク数"     : f"{result['created_chunks']:,}",
                     "推定サイズ"     : f"{result.get('estimated_size_mb', 0):.1f} MB",
+                    "重複除去"       : f"{(result.get('dedup') or {}).get('dropped', 0):,} 行 "
+                                       f"({(result.get('dedup') or {}).get('tokens_saved', 0):,} tokens)",
                     "状態"           : f"完了{warning_text}"
                 })
 
@@ -958,7 +1573,7 @@ class VectorStoreUI:
                         # 設定情報も表示
                         config_used = result.get("config_used", {})
                         st.info(
-                            f"使用設定: チャンクサイズ={config_used.get('chunk_size', 'N/A')}, オーバーラップ={config_used.get('overlap', 'N/A')}")
+                            f"使用設定: チャンクサイズ={config_used.get('chunk_size', 'N/A')}トークン, オーバーラップ={config_used.get('overlap', 'N/A')}トークン")
 
         # 失敗結果の詳細
         if failed:
@@ -976,6 +1591,22 @@ class VectorStoreUI:
 
         return successful, failed
 
+    def display_upload_report(self, report: Optional[Dict[str, Any]]):
+        """シャードごとのアップロード時間・completed までの時間を表示"""
+        if not report:
+            return
+        st.caption(f"⏱️ アップロード {report['upload_s']:.1f}秒 / completed まで {report['total_s']:.1f}秒"
+                   f"（{len(report['shards'])}ファイル）")
+        if len(report["shards"]) > 1:
+            with st.expander("📦 シャード別の所要時間", expanded=False):
+                st.dataframe(pd.DataFrame([{
+                    "シャード"          : i,
+                    "File ID"           : shard["file_id"],
+                    "サイズ(MB)"        : f"{shard['bytes'] / (1024 * 1024):.1f}",
+                    "アップロード(秒)"  : f"{shard['upload_s']:.1f}",
+                    "completedまで(秒)" : f"{shard['completed_s']:.1f}",
+                } for i, shard in enumerate(report["shards"])]), use_container_width=True)
+
     def display_existing_stores(self, manager: VectorStoreManager):
         """既存Vector Store表示（修正版）"""
         st.subheader("📚 既存Vector Store一覧")
@@ -1056,11 +1687,11 @@ def main():
         return
 
     # サイドバー設定
-    selected_model, process_all = ui.setup_sidebar()
+    selected_model, process_all, upload_shards, sync, dedup_cfg = ui.setup_sidebar()
 
     # Vector Store Manager の初期化
     try:
-        manager = VectorStoreManager()
+        manager = VectorStoreManager(upload_shards=upload_shards, dedup_cfg=dedup_cfg)
         ui.manager = manager
     except Exception as e:
         st.error(f"Vector Store Manager の初期化に失敗: {e}")
@@ -1126,67 +1757,93 @@ def main():
                 overall_progress = st.progress(0)
                 overall_status = st.empty()
 
+                # データセットごとの表示枠（登録後はサーバ側の処理状況を並行して更新する）
+                widgets = {}
                 for idx, dataset_type in enumerate(selected_datasets):
                     config = ui.configs[dataset_type]
-
-                    # 個別データセットの進行状況
                     with st.container():
                         st.write(f"### 📋 {idx + 1}/{len(selected_datasets)}: {config.description}")
+                        widgets[dataset_type] = {
+                            "progress": st.progress(0),
+                            "status"  : st.empty(),
+                            "detail"  : st.container(),
+                        }
+                        widgets[dataset_type]["status"].text("⏳ 待機中...")
+                        st.markdown("---")
 
-                        # 個別進行状況バー
-                        dataset_progress = st.progress(0)
-                        dataset_status = st.empty()
-
-                        try:
-                            # Vector Store作成実行
-                            dataset_progress.progress(0.1)
-                            dataset_status.text("🔄 処理開始...")
-
-                            with st.spinner(f"🔄 {config.description} を処理中..."):
-                                result = manager.process_single_dataset(dataset_type)
-                                results[dataset_type] = result
-
-                            if result["success"]:
-                                dataset_progress.progress(1.0)
-                                dataset_status.success(f"✅ 完了 - Vector Store ID: `{result['vector_store_id']}`")
-
-                                # 詳細情報表示
-                                col1, col2, col3 = st.columns(3)
-                                with col1:
-                                    st.metric("処理行数",
-                                              f"{result.get('processed_lines', 0):,} / {result.get('total_lines', 0):,}")
-                                with col2:
-                                    st.metric("作成チャンク数", f"{result['created_chunks']:,}")
-                                with col3:
-                                    st.metric("推定サイズ", f"{result.get('estimated_size_mb', 0):.1f} MB")
-
-                                # 警告がある場合は表示
-                                if result.get("warnings"):
-                                    for warning in result["warnings"]:
-                                        st.warning(warning)
-
-                            else:
-                                dataset_progress.progress(0)
-                                dataset_status.error(f"❌ 失敗: {result['error']}")
-
-                                # エラー対処法の提案
-                                if "too large" in result['error'].lower():
-                                    st.info("💡 ファイルサイズが大きすぎます。設定を調整して再試行してください。")
-                                elif "not found" in result['error'].lower():
-                                    st.info("💡 必要なファイルがOUTPUTディレクトリに存在することを確認してください。")
-
-                        except Exception as e:
-                            error_msg = f"予期しないエラー: {str(e)}"
-                            results[dataset_type] = {"success": False, "error": error_msg}
-                            dataset_progress.progress(0)
-                            dataset_status.error(f"❌ {error_msg}")
-                            logger.error(f"{dataset_type} 処理中の例外: {e}")
+                started_count = 0
+
+                def on_started(dataset_type: str, partial: Dict[str, Any]):
+                    """アップロード・登録が終わったデータセットの表示を更新"""
+                    nonlocal started_count
+                    started_count += 1
+                    widget = widgets[dataset_type]
+                    if partial.get("success") is False:
+                        widget["progress"].progress(0)
+                        widget["status"].error(f"❌ 失敗: {partial['error']}")
+                    elif partial.get("success"):
+                        widget["progress"].progress(1.0)
+                        widget["status"].text("✅ 同期済み（追加・変更なし）")
+                    else:
+                        widget["progress"].progress(0.3)
+                        widget["status"].text("🔄 サーバ側で処理中...")
+                    overall_progress.progress(0.5 * started_count / len(selected_datasets))
+                    overall_status.text(f"アップロード: {started_count}/{len(selected_datasets)} 完了")
+
+                def on_progress(target: PollTarget):
+                    """ポーリング結果で処理状況を更新（全ストアを1つのループで監視）"""
+                    widget = widgets[target.key]
+                    ratio = target.completed / target.total if target.total else 0.0
+                    widget["progress"].progress(0.3 + 0.7 * ratio)
+                    widget["status"].text(f"🔄 {target.status}: {target.completed}/{target.total}ファイル "
+                                          f"({target.elapsed_s:.0f}秒, 次回確認まで{target.interval:.0f}秒)")
+
+                with st.spinner("🔄 Vector Storeを作成中..."):
+                    try:
+                        results = manager.process_datasets(selected_datasets, on_started=on_started,
+                                                           on_progress=on_progress, sync=sync)
+                    except Exception as e:
+                        error_msg = f"予期しないエラー: {str(e)}"
+                        logger.error(f"Vector Store作成中の例外: {e}")
+                        results = {dataset_type: results.get(dataset_type, {"success": False, "error": error_msg})
+                                   for dataset_type in selected_datasets}
+
+                for dataset_type, result in results.items():
+                    widget = widgets[dataset_type]
+                    with widget["detail"]:
+                        if result["success"]:
+                            widget["progress"].progress(1.0)
+                            widget["status"].success(f"✅ 完了 - Vector Store ID: `{result['vector_store_id']}`")
+
+                            # 詳細情報表示
+                            col1, col2, col3 = st.columns(3)
+                            with col1:
+                                st.metric("処理行数",
+                                          f"{result.get('processed_lines', 0):,} / {result.get('total_lines', 0):,}")
+                            with col2:
+                                st.metric("作成チャンク数", f"{result['created_chunks']:,}")
+                            with col3:
+                                st.metric("推定サイズ", f"{result.get('estimated_size_mb', 0):.1f} MB")
+                            ui.display_upload_report(result.get("upload_report"))
+                            if result.get("sync"):
+                                sync_info = result["sync"]
+                                st.caption(f"♻️ 差分同期: 追加/変更 {sync_info['uploaded']} / 変更なし "
+                                           f"{sync_info['unchanged']} / 削除 {sync_info['deleted']} シャード")
+
+                            # 警告がある場合は表示
+                            if result.get("warnings"):
+                                for warning in result["warnings"]:
+                                    st.warning(warning)
 
-                        st.markdown("---")
+                        else:
+                            widget["progress"].progress(0)
+                            widget["status"].error(f"❌ 失敗: {result['error']}")
 
-                        # 全体進行状況更新
-                        overall_progress.progress((idx + 1) / len(selected_datasets))
-                        overall_status.text(f"進行状況: {idx + 1}/{len(selected_datasets)} 完了")
+                            # エラー対処法の提案
+                            if "too large" in result['error'].lower():
+                                st.info("💡 ファイルサイズが大きすぎます。設定を調整して再試行してください。")
+                            elif "not found" in result['error'].lower():
+                                st.info("💡 必要なファイルがOUTPUTディレクトリに存在することを確認してください。")
 
                 # 全体完了
                 overall_progress.progress(1.0)
@@ -1242,8 +1899,8 @@ def main():
         with st.expander("⚙️ 統合設定", expanded=True):
             col1, col2, col3 = st.columns(3)
             with col1:
-                st.write("**チャンクサイズ**: ", unified_config.chunk_size)
-                st.write("**オーバーラップ**: ", unified_config.overlap)
+                st.write("**チャンクサイズ（トークン）**: ", unified_config.chunk_size)
+                st.write("**オーバーラップ（トークン）**: ", unified_config.overlap)
             with col2:
                 st.write("**最大ファイルサイズ**: ", f"{unified_config.max_file_size_mb} MB")
                 st.write("**最大チャンク数**: ", f"{unified_config.max_chunks_per_file:,}")
@@ -1346,6 +2003,7 @@ def main():
                             st.metric("最終サイズ", f"{result['estimated_size_mb']:.1f} MB")
                         with col4:
                             st.metric("含まれるデータセット", len(result['config_used']['datasets_included']))
+                        ui.display_upload_report(result.get("upload_report"))
                         
                         # データセット別統計
                         if result.get('dataset_stats'):
@@ -1356,7 +2014,11 @@ def main():
                                         "データセット": ui.configs[ds_type].description,
                                         "元の行数": f"{stats['original_lines']:,}",
                                         "チャンク数": f"{stats['chunks']:,}",
-                                        "サイズ(MB)": f"{stats['size_mb']:.1f}"
+                                        "サイズ(MB)": f"{stats['size_mb']:.1f}",
+                                        "予算(MB)": f"{stats.get('budget_mb', 0):.1f}",
+                                        "予算使用率": f"{stats.get('budget_used', 0):.0%}"
+                                                      + (" (上限)" if stats.get('budget_full') else ""),
+                                        "重複除去": f"{stats.get('dedup_dropped', 0):,}"
                                     })
                                 df_stats = pd.DataFrame(stats_data)
                                 st.dataframe(df_stats, use_container_width=True)
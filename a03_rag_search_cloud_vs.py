@@ -373,6 +373,14 @@ except ImportError as e:
     HELPER_AVAILABLE = False
     logger.warning(f"ヘルパーモジュールのインポートに失敗: {e}")
 
+# OpenAI API 呼び出しの共通レート制御（helper_api）
+try:
+    from helper_api import estimate_request_tokens, get_rate_limit_scheduler
+    RATE_LIMIT_AVAILABLE = True
+except ImportError as e:
+    RATE_LIMIT_AVAILABLE = False
+    logger.warning(f"レート制御スケジューラを利用できません（SDKの再試行のみ）: {e}")
+
 # テスト用質問（英語版 - RAGデータに最適化）
 test_questions_en = [
     "How do I create a new account?",
@@ -429,6 +437,30 @@ except Exception as e:
     st.stop()
 
 
+# ===================================================================
+# 統合Vector Storeのドメイン絞り込み（a02 がファイル属性 domain を付与）
+# ===================================================================
+UNIFIED_STORE_DISPLAY_NAME = "Unified Knowledge Base"
+
+DOMAIN_LABELS = {
+    "customer_support": "Customer Support FAQ",
+    "medical"         : "Medical Q&A",
+    "science"         : "Science & Technology Q&A",
+    "legal"           : "Legal Q&A",
+    "trivia"          : "Trivia Q&A",
+}
+
+
+def build_domain_filter(domains: List[str]) -> Optional[Dict[str, Any]]:
+    """file_search の filters（ファイル属性 domain の eq / or）を作成（未選択・全選択なら None）"""
+    domains = [d for d in DOMAIN_LABELS if d in (domains or [])]
+    if not domains or len(domains) == len(DOMAIN_LABELS):
+        return None
+    if len(domains) == 1:
+        return {"type": "eq", "key": "domain", "value": domains[0]}
+    return {"type": "or", "filters": [{"type": "eq", "key": "domain", "value": d} for d in domains]}
+
+
 class ModernRAGManager:
     """最新Responses API + file_search を使用したRAGマネージャー"""
 
@@ -464,12 +496,21 @@ class ModernRAGManager:
 
             # Responses API呼び出し（型安全な方法）
             # 選択されたモデルを使用
-            response = openai_client.responses.create(
-                model=selected_model,
-                input=query,
-                tools=[file_search_tool_dict],  # type: ignore[arg-type]
-                include=include_params if include_params else None
-            )
+            request_params: Dict[str, Any] = {
+                "model"  : selected_model,
+                "input"  : query,
+                "tools"  : [file_search_tool_dict],
+                "include": include_params if include_params else None,
+            }
+            if RATE_LIMIT_AVAILABLE:
+                # 429・一時エラーの再試行とレート制御は共通スケジューラで行う
+                api = openai_client.with_options(max_retries=0)
+                response = get_rate_limit_scheduler().call(
+                    lambda: api.responses.with_raw_response.create(**request_params),
+                    model=selected_model, tokens=estimate_request_tokens(query, selected_model)
+                )
+            else:
+                response = openai_client.responses.create(**request_params)
 
             # レスポンステキストの抽出
             response_text = self._extract_response_text(response)
@@ -485,6 +526,7 @@ class ModernRAGManager:
                 "timestamp" : datetime.now().isoformat(),
                 "model"     : selected_model,  # 選択されたモデルを記録
                 "method"    : "responses_api_file_search",
+                "filters"   : filters,
                 "citations" : citations,
                 "tool_calls": self._extract_tool_calls(response)
             }
@@ -526,12 +568,13 @@ class ModernRAGManager:
             }
             return error_msg, error_metadata
 
-    def search_with_agent_sdk(self, query: str, store_name: str, store_id: str) -> Tuple[str, Dict[str, Any]]:
+    def search_with_agent_sdk(self, query: str, store_name: str, store_id: str, **kwargs) -> Tuple[
+        str, Dict[str, Any]]:
         """Agent SDKを使用した検索（簡易版 - file_searchはResponses APIで実行）"""
         try:
             if not AGENT_SDK_AVAILABLE:
                 logger.info("Agent SDK利用不可、Responses APIにフォールバック")
-                return self.search_with_responses_api(query, store_name, store_id)
+                return self.search_with_responses_api(query, store_name, store_id, **kwargs)
 
             # 注意: Agent SDKでのfile_searchツール統合は複雑なため、
             # 現在は簡易版として通常のAgent実行のみ行い、
@@ -583,13 +626,14 @@ class ModernRAGManager:
             logger.error(error_msg)
             logger.warning("Agent SDKエラーによりResponses APIにフォールバック")
             # Agent SDKが失敗した場合はResponses APIにフォールバック
-            return self.search_with_responses_api(query, store_name, store_id)
+            return self.search_with_responses_api(query, store_name, store_id, **kwargs)
 
     def search(self, query: str, store_name: str, store_id: str, use_agent_sdk: bool = True, **kwargs) -> Tuple[
         str, Dict[str, Any]]:
         """統合検索メソッド"""
-        if use_agent_sdk and AGENT_SDK_AVAILABLE:
-            return self.search_with_agent_sdk(query, store_name, store_id)
+        # Agent SDK（簡易版）は file_search を使わないため、filters 指定時は Responses API で検索する
+        if use_agent_sdk and AGENT_SDK_AVAILABLE and kwargs.get('filters') is None:
+            return self.search_with_agent_sdk(query, store_name, store_id, **kwargs)
         else:
             return self.search_with_responses_api(query, store_name, store_id, **kwargs)
 
@@ -681,7 +725,8 @@ def initialize_session_state():
         st.session_state.search_options = {
             'max_results'    : 20,
             'include_results': True,
-            'show_citations' : True
+            'show_citations' : True,
+            'domains'        : []
         }
     if 'auto_refresh_stores' not in st.session_state:
         st.session_state.auto_refresh_stores = True
@@ -896,6 +941,17 @@ def display_search_options():
         )
         st.session_state.search_options['show_citations'] = show_citations
 
+        # 統合ナレッジベースのドメイン絞り込み（1回の検索で複数ドメインを対象にできる）
+        if st.session_state.get('selected_store') == UNIFIED_STORE_DISPLAY_NAME:
+            domains = st.multiselect(
+                "検索対象ドメイン",
+                options=list(DOMAIN_LABELS),
+                default=st.session_state.search_options.get('domains', []),
+                format_func=DOMAIN_LABELS.get,
+                help="未選択または全選択の場合は全ドメインを検索（ファイル属性 domain で絞り込み）"
+            )
+            st.session_state.search_options['domains'] = domains
+
         # Agent SDK使用設定
         if AGENT_SDK_AVAILABLE:
             use_agent_sdk = st.checkbox(
@@ -1258,6 +1314,9 @@ def main():
             else:
                 # 検索オプションの取得
                 search_options = st.session_state.search_options
+                filters = None
+                if selected_store == UNIFIED_STORE_DISPLAY_NAME:
+                    filters = build_domain_filter(search_options.get('domains', []))
 
                 # 検索実行（store_idと選択されたモデルを渡す）
                 final_result, final_metadata = rag_manager.search(
@@ -1267,6 +1326,7 @@ def main():
                     use_agent_sdk=st.session_state.use_agent_sdk,
                     max_results=search_options['max_results'],
                     include_results=search_options['include_results'],
+                    filters=filters,
                     selected_model=st.session_state.selected_model  # 選択されたモデルを渡す
                 )
 
@@ -22,6 +22,13 @@ except ImportError as e:
     st.error(f"OpenAI SDK が見つかりません: {e}")
     st.stop()
 
+# OpenAI API 呼び出しの共通レート制御（helper_api、無い場合は固定ウェイト）
+try:
+    from helper_api import get_rate_limit_scheduler
+    RATE_LIMIT_AVAILABLE = True
+except ImportError:
+    RATE_LIMIT_AVAILABLE = False
+
 # ===================================================================
 # ログ設定
 # ===================================================================
@@ -62,6 +69,15 @@ class OpenAIResourceManager:
         
         self.client = OpenAI(api_key=api_key)
         self.deletion_history = []
+
+    def _call(self, fn, endpoint: str):
+        """削除APIの呼び出し（429はスケジューラがバックオフ、固定ウェイトは不要）"""
+        if RATE_LIMIT_AVAILABLE:
+            api = self.client.with_options(max_retries=0)
+            return get_rate_limit_scheduler().call(lambda: fn(api), model=endpoint)
+        result = fn(self.client)
+        time.sleep(0.2)  # API rate limit対策
+        return result
     
     def list_vector_stores(self, limit: int = 100) -> List[Dict[str, Any]]:
         """Vector Store一覧を取得"""
@@ -148,11 +164,10 @@ class OpenAIResourceManager:
             for file_info in associated_files:
                 file_result = self.delete_file(file_info['id'], file_info['filename'])
                 file_deletion_results.append(file_result)
-                time.sleep(0.2)  # API rate limit対策
         
         # Vector Store本体を削除
         try:
-            self.client.vector_stores.delete(vector_store_id)
+            self._call(lambda api: api.vector_stores.with_raw_response.delete(vector_store_id), "vector_stores.delete")
             
             result = DeletionResult(
                 success=True,
@@ -190,7 +205,7 @@ class OpenAIResourceManager:
         """ファイルを削除"""
         try:
             # ファイルを削除
-            self.client.files.delete(file_id)
+            self._call(lambda api: api.files.with_raw_response.delete(file_id), "files.delete")
             
             result = DeletionResult(
                 success=True,
@@ -228,7 +243,6 @@ class OpenAIResourceManager:
             vs_result, file_results = self.delete_vector_store(store_id, store_name, delete_associated_files)
             vs_results.append(vs_result)
             all_file_results.extend(file_results)
-            time.sleep(0.5)  # API rate limit対策
         
         return vs_results, all_file_results
     
@@ -238,7 +252,6 @@ class OpenAIResourceManager:
         for file_id, filename in file_ids:
             result = self.delete_file(file_id, filename)
             results.append(result)
-            time.sleep(0.5)  # API rate limit対策
         return results
     
     def delete_all_vector_stores(self) -> List[DeletionResult]:
@@ -12,12 +12,15 @@ a30_qdrant_registration.py — helper群・config.yml連携版（単一コレク
 - answer を埋め込みに含める切替フラグ（--include-answer / YAML設定）
 - Named Vectors 対応（YAMLに複数ベクトル定義があれば自動有効）
 - helper_api.py / helper_rag.py が存在すれば活用（無ければ内蔵実装を利用）
+- ポイントIDは domain + question の UUIDv5（決定的）。台帳（行ハッシュ）により --incremental で差分のみ反映
 
 使い方：
   export OPENAI_API_KEY=sk-...
   docker run -p 6333:6333 -p 6334:6334 qdrant/qdrant
   python a30_qdrant_registration.py --recreate
   python a30_qdrant_registration.py --search "副作用はありますか？" --domain medical --using primary
+  python a30_qdrant_registration.py --recreate --write-artifacts     # 埋め込みを保存
+  python a30_qdrant_registration.py --recreate --from-artifacts      # 保存済み埋め込みから再登録（API呼び出しなし）
 
 初回登録（--recreate推奨）
      python a30_qdrant_registration.py --recreate --include-answer
@@ -27,22 +30,71 @@ a30_qdrant_registration.py — helper群・config.yml連携版（単一コレク
   --recreate           : コレクション削除→新規作成
   --collection         : コレクション名（既定は YAML の rag.collection または 'qa_corpus'）
   --qdrant-url         : 既定は http://localhost:6333
-  --batch-size         : Embeddings/Upsert バッチ（既定 128）
+  --batch-size         : 1リクエスト/upsert あたりの最大行数（既定 512）
   --limit              : データ件数上限（開発用、0=無制限）
   --include-answer     : 埋め込み入力に answer も結合（question + "\n" + answer）
   --using              : Named Vectors のキー名（検索時にどのベクトルで検索するか）
   --search             : クエリ指定で検索のみ実行
   --domain             : 検索対象を絞る（customer/medical/legal/sciq/trivia）
   --topk               : 上位件数（既定5）
+  --prefer-grpc        : Qdrant への通信に gRPC を使う（--grpc-port、既定 6334）
+  --upload-mode        : upsert（client.upsert）/ upload（client.upload_collection、既定 YAML qdrant.upload_mode）
+  --upload-parallel    : --upload-mode upload の並列数（既定 1）
+  --upload-window      : --upload-mode upload で upload_collection 1回に渡す行数（既定 50000、区間ごとにコミット）
+  --no-wait            : 書き込みの適用完了を待たずにパイプライン化（最後に1回だけ待機）
+  --embed-workers      : 埋め込みリクエストの並行数（既定 YAML ingest.embed_workers または 4）
+  --upsert-workers     : Qdrant upsert の並行数（既定 YAML ingest.upsert_workers または 2）
+  --queue-size         : upsert待ちバッチ数の上限（バックプレッシャー、既定 8）
+  --batch-max-tokens   : 1リクエストあたりの最大トークン数（tiktoken、既定 100000）
+  --overflow           : 入力上限（8191トークン）超過時の扱い truncate/split/error（既定 truncate）
+  --chunk-rows         : CSVを読み込むチャンク行数（既定 10000、メモリ使用量一定のストリーミング）
+  --quantization       : none/scalar/product/binary（既定 YAML quantization.type）
+  --on-disk-vectors    : 原本ベクトルをディスクに置く（量子化ベクトルはRAM）
+  --oversampling       : 検索時に limit×oversampling 件を量子化ベクトルで取得（既定 YAML）
+  --no-rescore         : 検索時に原本ベクトルで再スコアリングしない
+  --dims               : text-embedding-3 系の次元削減（'256' または 'primary=512'、--recreate と併用）
+  --storage-profile    : memory / on_disk（ベクトル mmap・payload と HNSW をディスク、既定 YAML storage.profile）
+  --warmup-queries     : on_disk 時のインジェスト後の暖機クエリ数（既定 32）
+  --bulk-load          : インジェスト中は HNSW 索引を作らず、完了後に一括作成して検索可能になるまで待機
+  --bulk-segments      : --bulk-load 中の default_segment_number（既定 4）
+  --incremental        : 差分インジェスト（新規・変更行のみ埋め込み/upsert、CSVから消えた行は削除）
+  --workers            : ドメインごとに N プロセスで並行インジェスト（各プロセスが Qdrant/OpenAI クライアントを持つ、既定 1）
+                         並列の単位はドメイン（1ドメインを複数プロセスに分割しないため、最大ドメインの処理時間が下限）
+  --trace-memory       : tracemalloc で Python オブジェクトのピーク使用量も計測（ピークRSSは常に表示）
+  --resume             : 中断したインジェストをドメインごとのチェックポイント（コミット済みの行位置）から再開
+  --no-embedding-cache : 埋め込みの永続キャッシュ（YAML embedding_cache）を使わない
+  --dedup / --no-dedup : 埋め込み前の重複・近似重複（NFKC正規化＋MinHash/LSH）の除去を行う/行わない（既定 YAML dedup.enabled = false）
+  --dedup-threshold    : 近似重複とみなす推定 Jaccard 類似度（既定 0.9）
+  --write-artifacts    : 埋め込みをドメインごとに .npy（memmap）+ Parquet サイドカーとして保存（YAML artifacts）
+  --artifacts-dir      : アーティファクトの保存先（既定 OUTPUT/artifacts）
+  --artifact-dtype     : 保存時の型 float32 / float16（既定 float32）
+  --from-artifacts     : 保存済みアーティファクトから埋め込みAPIを呼ばずに登録
 """
 import argparse
+import copy
+import hashlib
 import os
 import json
 import glob
+import itertools
+import multiprocessing
+import queue
+import resource
+import sqlite3
+import sys
+import threading
+import time
+import tracemalloc
+import uuid
+from collections import defaultdict
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed
+from dataclasses import dataclass, replace
 from datetime import datetime, timezone
-from typing import Dict, Iterable, List, Tuple, Optional, Any
+from operator import itemgetter
+from typing import Callable, Dict, Iterable, Iterator, List, Tuple, Optional, Any, Sequence
 from pathlib import Path
 
+import numpy as np
 import pandas as pd
 
 try:
@@ -60,10 +112,24 @@ try:
 except Exception:
     hrag = None
 
+try:
+    import helper_embedding as hemb
+except Exception:
+    hemb = None
+
+try:
+    import helper_dedup as hdedup
+except Exception:
+    hdedup = None
+
 from qdrant_client import QdrantClient
 from qdrant_client.http import models
 from openai import OpenAI
 
+from helper_qdrant import (QUANTIZATION_TYPES, DEFAULT_QUANTIZATION, STORAGE_PROFILES, DEFAULT_STORAGE,
+                           build_quantization_config, build_search_params, storage_profile_settings,
+                           warm_up_collection)
+
 # ------------------ デフォルト設定（YAMLが無い場合の後ろ盾） ------------------
 DEFAULTS = {
     "rag": {
@@ -73,6 +139,7 @@ DEFAULTS = {
     },
     "embeddings": {
         # named vectors: dict[name] = {model, dims}
+        # text-embedding-3 系で dims をモデル既定より小さくすると dimensions を指定して要求する（256/512/768 など）
         "primary": {"provider": "openai", "model": "text-embedding-3-small", "dims": 1536},
         # 2nd example for future expansion; commented by default
         # "bge": {"provider": "openai", "model": "text-embedding-3-large", "dims": 3072},
@@ -84,7 +151,55 @@ DEFAULTS = {
         "sciq":     "OUTPUT/preprocessed_sciq_qa.csv",
         "trivia":   "OUTPUT/preprocessed_trivia_qa.csv",
     },
-    "qdrant": {"url": "http://localhost:6333"},
+    "qdrant": {
+        "url": "http://localhost:6333",
+        # 書き込み経路：upsert（REST/gRPC の client.upsert）または upload（client.upload_collection の並列アップロード）
+        "upload_mode": "upsert",
+        "upload_parallel": 1,
+        # upload モードで upload_collection 1回に渡す行数（この区間ごとに台帳・チェックポイントへ記録）
+        "upload_window": 50000,
+        "prefer_grpc": False,
+        "grpc_port": 6334,
+        # False の場合は書き込みの適用を待たずに次のバッチを送り、最後にバリア（wait=True）で確定させる
+        "wait": True,
+    },
+    "ingest": {
+        # パイプライン（埋め込みワーカー → 有界upsertキュー → upsertワーカー）の並行度
+        "embed_workers": 4,
+        "upsert_workers": 2,
+        "queue_size": 8,
+        # --workers: ドメインごとのプロセス数（1 = 単一プロセス）
+        "workers": 1,
+        # 行コンテンツハッシュの台帳（--incremental で差分のみ埋め込み・upsert）
+        "manifest_path": "OUTPUT/cache/ingest_manifest.sqlite",
+        # CSVを読み込むチャンク行数（ピークメモリはこの値とキュー長で決まる）
+        "chunk_rows": 10000,
+        # 埋め込みリクエスト1回あたりの上限（行数・tiktokenトークン数）と長すぎる入力の扱い
+        "batch_size": 512,
+        # Named Vectors のモデルごとの同時実行数（0 = embed_workers、embeddings.<name>.max_concurrency で個別指定）
+        "model_concurrency": 0,
+        "batch_max_tokens": 100000,
+        "overflow": "truncate",  # truncate / split / error
+        # --bulk-load: インジェスト中のセグメント数と、索引作成完了までの待機上限（秒）
+        "bulk_segment_number": 4,
+        "bulk_index_timeout": 1800,
+    },
+    # 量子化（helper_qdrant.build_quantization_config / build_search_params）
+    "quantization": copy.deepcopy(DEFAULT_QUANTIZATION),
+    # ストレージプロファイル（memory / on_disk、helper_qdrant.storage_profile_settings）
+    "storage": copy.deepcopy(DEFAULT_STORAGE),
+    "artifacts": {
+        # 埋め込みアーティファクト（helper_embedding.EmbeddingArtifactWriter）：<dir>/<domain>.<vector>.npy + <domain>.parquet
+        "write": False,
+        "dir": "OUTPUT/artifacts",
+        "dtype": "float32",  # float32 / float16
+    },
+    "embedding_cache": {
+        # 埋め込みの永続キャッシュ（helper_embedding.EmbeddingCache）
+        "enabled": True,
+        "path": "OUTPUT/cache/embeddings.sqlite",
+        "max_size_mb": 2048,
+    },
 }
 
 # ------------------ 最新ファイルを動的に検索 ------------------
@@ -167,13 +282,13 @@ def load_config(path: str = "config.yml") -> Dict[str, Any]:
     if yaml and os.path.exists(path):
         with open(path, "r", encoding="utf-8") as f:
             cfg = yaml.safe_load(f) or {}
-    # マージ（浅いマージで十分。必要なら深いマージに差し替え）
+    # 深いマージ（YAML の値がデフォルトを上書きする）
     def merge(dst, src):
         for k, v in src.items():
             if isinstance(v, dict) and isinstance(dst.get(k), dict):
                 merge(dst[k], v)
             else:
-                dst.setdefault(k, v)
+                dst[k] = copy.deepcopy(v)
     full = {}
     merge(full, DEFAULTS)
     merge(full, cfg)
@@ -190,6 +305,22 @@ def batched(seq: Iterable, size: int):
     if buf:
         yield buf
 
+def peak_memory_mb() -> Dict[str, float]:
+    """プロセスのピークRSS（ru_maxrss）と tracemalloc のピーク（有効時のみ）をMB単位で返す"""
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux は KB、macOS はバイト
+    rss_mb = rss / (1024 * 1024) if sys.platform == "darwin" else rss / 1024
+    result = {"peak_rss_mb": rss_mb}
+    if tracemalloc.is_tracing():
+        result["peak_traced_mb"] = tracemalloc.get_traced_memory()[1] / (1024 * 1024)
+    return result
+
+def format_memory(mem: Dict[str, float]) -> str:
+    text = f"peak RSS={mem['peak_rss_mb']:.0f}MB"
+    if "peak_traced_mb" in mem:
+        text += f", peak Python allocations={mem['peak_traced_mb']:.0f}MB"
+    return text
+
 # ------------------ OpenAIクライアント ------------------
 def get_openai_client():
     if hapi and hasattr(hapi, "get_openai_client"):
@@ -197,19 +328,68 @@ def get_openai_client():
     return OpenAI()
 
 # ------------------ 埋め込み実装（helper優先） ------------------
-def embed_texts_openai(texts: List[str], model: str, client: Optional[OpenAI] = None) -> List[List[float]]:
+def embed_texts_openai(texts: List[str], model: str, client: Optional[OpenAI] = None,
+                       dims: Optional[int] = None, tokens: Optional[int] = None) -> np.ndarray:
     client = client or get_openai_client()
-    resp = client.embeddings.create(model=model, input=texts)
-    return [d.embedding for d in resp.data]
-
-def embed_texts(texts: List[str], model: str, batch_size: int = 128) -> List[List[float]]:
-    if hrag and hasattr(hrag, "embed_texts"):
-        return hrag.embed_texts(texts, model=model, batch_size=batch_size)
-    vecs: List[List[float]] = []
-    client = get_openai_client()
-    for chunk in batched(texts, batch_size):
-        vecs.extend(embed_texts_openai(chunk, model=model, client=client))
-    return vecs
+    # dims: text-embedding-3 系の次元削減（Matryoshka）。None はモデル既定の次元
+    params: Dict[str, Any] = {"model": model, "input": texts}
+    if dims:
+        params["dimensions"] = dims
+    if hemb and hasattr(hemb, "decode_embedding"):
+        # float32 のバイト列（base64）で受け取り np.frombuffer で復元（応答サイズ・パース時間の削減）
+        params["encoding_format"] = hemb.EMBEDDING_ENCODING_FORMAT
+    if hapi and hasattr(hapi, "get_rate_limit_scheduler"):
+        # RPM/TPM・429バックオフ・同時実行数はスケジューラに任せる（SDKの自動リトライは無効化）
+        # tokens: TPM 予約に使う入力トークン数（未指定なら tiktoken で数える。日本語は文字数より多い）
+        if tokens is None:
+            tokens = hapi.estimate_request_tokens(texts, model)
+        api = client.with_options(max_retries=0)
+        resp = hapi.get_rate_limit_scheduler().call(
+            lambda: api.embeddings.with_raw_response.create(**params),
+            model=model, tokens=tokens)
+    else:
+        resp = client.embeddings.create(**params)
+    # レスポンスから (n, dims) の float32 行列へ直接詰める（Python float のリストを残さない）
+    if hemb and hasattr(hemb, "embeddings_to_array"):
+        return hemb.embeddings_to_array(resp.data)
+    return np.asarray([d.embedding for d in resp.data], dtype=np.float32)
+
+def embed_texts(texts: List[str], model: str, batch_size: int = 128,
+                client: Optional[OpenAI] = None, cache: Optional[Any] = None,
+                packer: Optional[Any] = None, dims: Optional[int] = None,
+                segments: Optional[Dict[str, List[Tuple[str, int]]]] = None) -> np.ndarray:
+    """texts を埋め込み、(len(texts), dims) の float32 行列を返す"""
+    # dims: API に要求する次元数（request_dimensions 済み、None はモデル既定）
+    # segments: テキスト -> packer.segments の結果（ジョブ作成時のトークン化を再利用する）
+    def _embed(batch_texts: List[str]) -> np.ndarray:
+        if hrag and hasattr(hrag, "embed_texts") and not dims:
+            return np.asarray(hrag.embed_texts(batch_texts, model=model, batch_size=batch_size), dtype=np.float32)
+        api = client or get_openai_client()
+        # トークン予算でリクエストを詰める（helper_api.EmbeddingBatchPacker）
+        if packer is not None:
+            return np.asarray(packer.embed(
+                batch_texts,
+                lambda inputs, tokens: embed_texts_openai(inputs, model=model, client=api, dims=dims, tokens=tokens),
+                segments=[segments.get(t) for t in batch_texts] if segments else None,
+                with_tokens=True), dtype=np.float32)
+        out: Optional[np.ndarray] = None
+        for start in range(0, len(batch_texts), batch_size):
+            vecs = embed_texts_openai(batch_texts[start:start + batch_size], model=model, client=api, dims=dims)
+            if out is None:
+                out = np.empty((len(batch_texts), vecs.shape[1]), dtype=np.float32)
+            out[start:start + len(vecs)] = vecs
+        return out if out is not None else np.empty((0, dims or 0), dtype=np.float32)
+
+    # キャッシュがあれば未登録テキストだけを埋め込む（キーは要求した次元数を含む）
+    if hemb and cache is not None:
+        return hemb.embed_with_cache(texts, model, _embed, cache=cache, dims=dims, as_array=True)
+    return _embed(texts)
+
+def request_dimensions(model: str, dims: Optional[int]) -> Optional[int]:
+    """API に送る dimensions（helper_embedding.request_dimensions、無ければ text-embedding-3 系のみ指定）"""
+    if hemb and hasattr(hemb, "request_dimensions"):
+        return hemb.request_dimensions(model, dims)
+    return int(dims) if dims and model.startswith("text-embedding-3") else None
 
 # ------------------ 入力テキスト構築 ------------------
 def build_inputs(df: pd.DataFrame, include_answer: bool) -> List[str]:
@@ -218,99 +398,1111 @@ def build_inputs(df: pd.DataFrame, include_answer: bool) -> List[str]:
     return df["question"].astype(str).tolist()
 
 # ------------------ CSVロード ------------------
-def load_csv(path: str, required=("question", "answer"), limit: int = 0) -> pd.DataFrame:
+# 列名マッピング（例: 'Question'->'question'）
+COLUMN_MAPPINGS = {
+    'Question': 'question',
+    'Response': 'answer',
+    'Answer': 'answer',
+    'correct_answer': 'answer'
+}
+
+
+def row_digest(values: Sequence[Any]) -> bytes:
+    """重複判定用の行ダイジェスト（16バイト。全行の文字列を保持せずにチャンク間で重複排除する）"""
+    return hashlib.blake2b("\x1f".join(str(v) for v in values).encode("utf-8"), digest_size=16).digest()
+
+
+def iter_csv_chunks(path: str, required=("question", "answer"), limit: int = 0,
+                    chunk_rows: int = 10000) -> Iterator[pd.DataFrame]:
+    """CSVを chunk_rows 行ずつ読み込み、列名変換・欠損補完・重複排除して返す（メモリ使用量一定）
+
+    重複排除はチャンクをまたいで行ダイジェストの集合で行う（drop_duplicates と同じく先勝ち）
+    """
     if not os.path.exists(path):
         raise FileNotFoundError(f"CSV not found: {path}")
-    df = pd.read_csv(path)
-    # 列名マッピングが必要ならここで調整（例: 'Question'->'question'）
-    column_mappings = {
-        'Question': 'question',
-        'Response': 'answer',
-        'Answer': 'answer',
-        'correct_answer': 'answer'
-    }
-    df = df.rename(columns=column_mappings)
-    for col in required:
-        if col not in df.columns:
-            raise ValueError(f"{path} には '{col}' 列が必要です（列: {list(df.columns)}）")
-    df = df.fillna("").drop_duplicates(subset=list(required)).reset_index(drop=True)
-    if limit and limit > 0:
-        df = df.head(limit).copy()
-    return df
+    seen: set = set()
+    emitted = 0
+    for chunk in pd.read_csv(path, chunksize=max(1, chunk_rows)):
+        chunk = chunk.rename(columns=COLUMN_MAPPINGS)
+        for col in required:
+            if col not in chunk.columns:
+                raise ValueError(f"{path} には '{col}' 列が必要です（列: {list(chunk.columns)}）")
+        chunk = chunk.fillna("")
+        keep = []
+        for values in zip(*(chunk[col].astype(str) for col in required)):
+            digest = row_digest(values)
+            keep.append(digest not in seen)
+            seen.add(digest)
+        chunk = chunk[keep].reset_index(drop=True)
+        if limit and limit > 0:
+            chunk = chunk.head(limit - emitted)
+        if len(chunk):
+            emitted += len(chunk)
+            yield chunk
+        if limit and limit > 0 and emitted >= limit:
+            break
+
+
+def load_csv(path: str, required=("question", "answer"), limit: int = 0) -> pd.DataFrame:
+    chunks = list(iter_csv_chunks(path, required=required, limit=limit))
+    if not chunks:
+        return pd.DataFrame(columns=list(required))
+    return pd.concat(chunks, ignore_index=True)
 
 # ------------------ Qdrant: コレクション作成（Named Vectors対応） ------------------
 def create_or_recreate_collection(client: QdrantClient, name: str, recreate: bool,
-                                  embeddings_cfg: Dict[str, Dict[str, Any]]):
+                                  embeddings_cfg: Dict[str, Dict[str, Any]],
+                                  quantization_cfg: Optional[Dict[str, Any]] = None,
+                                  storage_profile: str = "memory"):
     # embeddings_cfg: dict[name] = {"model": "...", "dims": int}
+    # quantization_cfg: config.yml の quantization セクション（type=none なら量子化しない）
+    # storage_profile: memory / on_disk（ベクトル・payload・HNSW をディスクに置く）
+    quantization_cfg = quantization_cfg or {}
+    quantization_config = build_quantization_config(quantization_cfg)
+    storage = storage_profile_settings(storage_profile)
+    on_disk = bool(quantization_cfg.get("on_disk_vectors", False)) or storage["on_disk_vectors"]
+    create_params = dict(quantization_config=quantization_config, on_disk_payload=storage["on_disk_payload"],
+                         hnsw_config=storage["hnsw_config"])
     # Named Vectors：複数キーなら dict を、単一なら VectorParams を使う
     if len(embeddings_cfg) == 1:
         dims = list(embeddings_cfg.values())[0]["dims"]
-        vectors_config = models.VectorParams(size=dims, distance=models.Distance.COSINE)
+        vectors_config = models.VectorParams(size=dims, distance=models.Distance.COSINE, on_disk=on_disk)
     else:
         # Named vectors
         vectors_config = {
-            k: models.VectorParams(size=v["dims"], distance=models.Distance.COSINE)
+            k: models.VectorParams(size=v["dims"], distance=models.Distance.COSINE, on_disk=on_disk)
             for k, v in embeddings_cfg.items()
         }
     if recreate:
-        client.recreate_collection(collection_name=name, vectors_config=vectors_config)
+        client.recreate_collection(collection_name=name, vectors_config=vectors_config, **create_params)
     else:
         # 無ければ作成
         try:
-            client.get_collection(name)
+            info = client.get_collection(name)
         except Exception:
-            client.create_collection(collection_name=name, vectors_config=vectors_config)
+            client.create_collection(collection_name=name, vectors_config=vectors_config, **create_params)
+        else:
+            # 既存コレクションは量子化設定だけ更新（原本ベクトルの配置は作り直しが必要）
+            if quantization_config is not None and info.config.quantization_config != quantization_config:
+                client.update_collection(collection_name=name, quantization_config=quantization_config)
     # よく使うpayloadの索引（任意）
     try:
         client.create_payload_index(name, field_name="domain", field_type="keyword")
     except Exception:
         pass
 
+# ------------------ バルクロード（HNSW索引作成をインジェスト後にまとめて行う） ------------------
+DEFAULT_INDEXING_THRESHOLD = 20000  # Qdrant の既定値（KB）
+
+
+def begin_bulk_load(client: QdrantClient, name: str, segment_number: int = 4) -> int:
+    """インジェスト中の索引作成を止める（indexing_threshold=0）。元の indexing_threshold を返す"""
+    info = client.get_collection(name)
+    previous = getattr(info.config.optimizer_config, "indexing_threshold", None)
+    if not previous:
+        previous = DEFAULT_INDEXING_THRESHOLD
+    client.update_collection(
+        collection_name=name,
+        optimizer_config=models.OptimizersConfigDiff(indexing_threshold=0,
+                                                     default_segment_number=segment_number),
+    )
+    return previous
+
+
+def restore_indexing(client: QdrantClient, name: str, indexing_threshold: int) -> None:
+    """begin_bulk_load で止めた索引作成を再開する（完了は待たない）"""
+    client.update_collection(collection_name=name,
+                             optimizer_config=models.OptimizersConfigDiff(indexing_threshold=indexing_threshold))
+
+
+def finish_bulk_load(client: QdrantClient, name: str, indexing_threshold: int, num_vectors: int = 1,
+                     timeout: float = 1800, poll_interval: float = 2.0, settle: float = 30.0) -> float:
+    """索引作成を再開し、optimizer_status が ok かつ全ベクトルが索引済みになるまで待つ（待機秒を返す）
+
+    indexing_threshold 未満の小さいセグメントは索引化されないため、
+    status が green のまま索引数が変化しなくなった場合も完了とみなす。ただし optimizer が動き出す前に
+    抜けないよう、status が一度 green 以外になった後か、再開から settle 秒経った後に限る
+    """
+    started = time.time()
+    restore_indexing(client, name, indexing_threshold)
+    last_indexed = -1
+    stable = 0
+    optimizer_started = False
+    while True:
+        info = client.get_collection(name)
+        points = info.points_count or 0
+        indexed = info.indexed_vectors_count or 0
+        optimizer_ok = info.optimizer_status == models.OptimizersStatusOneOf.OK
+        green = info.status == models.CollectionStatus.GREEN
+        optimizer_started = optimizer_started or not green
+        if optimizer_ok and indexed >= points * num_vectors:
+            break
+        if optimizer_ok and green and (optimizer_started or time.time() - started >= settle):
+            stable = stable + 1 if indexed == last_indexed else 0
+            if stable >= 3:
+                print(f"[BulkLoad] {indexed}/{points * num_vectors} vectors indexed "
+                      f"(remaining segments are below indexing_threshold)")
+                break
+        if time.time() - started > timeout:
+            raise TimeoutError(f"Indexing did not finish within {timeout:.0f}s "
+                               f"(indexed={indexed}, points={points}, optimizer={info.optimizer_status})")
+        last_indexed = indexed
+        time.sleep(poll_interval)
+    return time.time() - started
+
+# ------------------ 決定的ポイントID・行ハッシュ ------------------
+# qa_corpus 用の固定名前空間（変更すると全ポイントのIDが変わるので注意）
+POINT_ID_NAMESPACE = uuid.UUID("6f1c7a52-3d0e-5b8a-9c61-2f4e8d0b7a13")
+
+
+def make_point_id(domain: str, question: str, occurrence: int = 0) -> str:
+    """domain + question から UUIDv5 を生成（プロセス・実行をまたいで不変）
+
+    同一ドメインに同じ質問が複数ある場合は出現順の番号 occurrence で区別する
+    """
+    name = f"{domain}\x1f{question}" if occurrence == 0 else f"{domain}\x1f{question}\x1f{occurrence}"
+    return str(uuid.uuid5(POINT_ID_NAMESPACE, name))
+
+
+def row_content_hash(question: str, answer: str, text: str, signature: str) -> str:
+    """行の内容ハッシュ（payload・埋め込み入力・埋め込み設定のいずれかが変われば変化する）"""
+    h = hashlib.sha256()
+    for part in (question, answer, text, signature):
+        h.update(str(part).encode("utf-8"))
+        h.update(b"\x1f")
+    return h.hexdigest()
+
+
+def embedding_signature(embeddings_cfg: Dict[str, Dict[str, Any]], include_answer: bool) -> str:
+    """埋め込み設定の署名（モデル変更時に全行を再埋め込みさせるため行ハッシュに含める）"""
+    parts = [f"{name}={vcfg.get('model')}/{vcfg.get('dims')}" for name, vcfg in sorted(embeddings_cfg.items())]
+    return ";".join(parts) + f";include_answer={bool(include_answer)}"
+
+
+class IngestManifest:
+    """コレクションに書き込んだ行の台帳（point_id → 行ハッシュ, SQLite）
+
+    - lookup: 既存行ハッシュの取得（変更の無い行をスキップ）
+    - touch : 今回の実行で存在を確認した行に run_id を記録
+    - record: upsert 完了後に行ハッシュを記録
+    - vanished: 今回の実行で一度も現れなかった行（＝CSVから消えた行）
+    """
+
+    _SQL_CHUNK = 500
+
+    def __init__(self, path: str, collection: str):
+        Path(path).parent.mkdir(parents=True, exist_ok=True)
+        self.collection = collection
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, timeout=30)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            """CREATE TABLE IF NOT EXISTS rows (
+                   collection TEXT NOT NULL,
+                   domain     TEXT NOT NULL,
+                   point_id   TEXT NOT NULL,
+                   row_hash   TEXT NOT NULL,
+                   run_id     TEXT NOT NULL,
+                   PRIMARY KEY (collection, point_id)
+               )"""
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_rows_domain ON rows(collection, domain, run_id)")
+        self._conn.commit()
+
+    def count(self) -> int:
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM rows WHERE collection = ?",
+                                      (self.collection,)).fetchone()[0]
+
+    def reset(self):
+        """コレクションの台帳を空にする（--recreate 時）"""
+        with self._lock:
+            self._conn.execute("DELETE FROM rows WHERE collection = ?", (self.collection,))
+            self._conn.commit()
+
+    def lookup(self, point_ids: Sequence[str]) -> Dict[str, str]:
+        found: Dict[str, str] = {}
+        with self._lock:
+            for i in range(0, len(point_ids), self._SQL_CHUNK):
+                part = list(point_ids[i:i + self._SQL_CHUNK])
+                placeholders = ",".join("?" * len(part))
+                for pid, row_hash in self._conn.execute(
+                        f"SELECT point_id, row_hash FROM rows WHERE collection = ? AND point_id IN ({placeholders})",
+                        [self.collection] + part):
+                    found[pid] = row_hash
+        return found
+
+    def touch(self, point_ids: Sequence[str], run_id: str):
+        with self._lock:
+            self._conn.executemany("UPDATE rows SET run_id = ? WHERE collection = ? AND point_id = ?",
+                                   [(run_id, self.collection, pid) for pid in point_ids])
+            self._conn.commit()
+
+    def record(self, domain: str, point_ids: Sequence[str], row_hashes: Sequence[str], run_id: str):
+        with self._lock:
+            self._conn.executemany("INSERT OR REPLACE INTO rows VALUES (?, ?, ?, ?, ?)",
+                                   [(self.collection, domain, pid, h, run_id)
+                                    for pid, h in zip(point_ids, row_hashes)])
+            self._conn.commit()
+
+    def vanished(self, domain: str, run_id: str, batch_size: int = 1000) -> Iterator[List[str]]:
+        """今回の実行で現れなかった行の point_id をバッチで返す"""
+        with self._lock:
+            pids = [r[0] for r in self._conn.execute(
+                "SELECT point_id FROM rows WHERE collection = ? AND domain = ? AND run_id != ?",
+                (self.collection, domain, run_id))]
+        for i in range(0, len(pids), batch_size):
+            yield pids[i:i + batch_size]
+
+    def forget(self, point_ids: Sequence[str]):
+        with self._lock:
+            self._conn.executemany("DELETE FROM rows WHERE collection = ? AND point_id = ?",
+                                   [(self.collection, pid) for pid in point_ids])
+            self._conn.commit()
+
+
+def delete_vanished(client: QdrantClient, collection: str, manifest: IngestManifest, domain: str,
+                    run_id: str) -> int:
+    """CSVから消えた行をQdrantと台帳から削除"""
+    deleted = 0
+    for pids in manifest.vanished(domain, run_id):
+        client.delete(collection_name=collection, points_selector=models.PointIdsList(points=pids))
+        manifest.forget(pids)
+        deleted += len(pids)
+    return deleted
+
+
+def source_fingerprint(path: str) -> str:
+    """入力CSVの指紋（パス・サイズ・更新時刻）。変わっていればチェックポイントは使わない"""
+    st = os.stat(path)
+    return f"{os.path.abspath(path)}:{st.st_size}:{st.st_mtime_ns}"
+
+
+class IngestCheckpoints:
+    """ドメインごとのインジェスト進捗（台帳と同じ SQLite の checkpoints テーブル）
+
+    CSV はチャンク（chunk_rows 行）単位でジョブに分かれ、ジョブはパイプライン内で順不同に完了する。
+    先頭から連続して全ジョブがコミット済みになったチャンクの終端行を watermark として永続化し、
+    --resume 時は watermark までのチャンクを読み飛ばす（埋め込み・upsert しない）。
+    watermark より後でコミット済みの行は台帳（IngestManifest）の行ハッシュで判定して飛ばす。
+    """
+
+    def __init__(self, path: str, collection: str):
+        Path(path).parent.mkdir(parents=True, exist_ok=True)
+        self.collection = collection
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, timeout=30)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            """CREATE TABLE IF NOT EXISTS checkpoints (
+                   collection     TEXT NOT NULL,
+                   domain         TEXT NOT NULL,
+                   fingerprint    TEXT NOT NULL,
+                   settings       TEXT NOT NULL,
+                   run_id         TEXT NOT NULL,
+                   watermark      INTEGER NOT NULL,
+                   committed_rows INTEGER NOT NULL,
+                   status         TEXT NOT NULL,
+                   updated_at     TEXT NOT NULL,
+                   PRIMARY KEY (collection, domain)
+               )"""
+        )
+        self._conn.commit()
+        # domain -> {"chunks": [[start, end, 未完了ジョブ数], ...], "watermark", "committed", "exhausted"}
+        self._state: Dict[str, Dict[str, Any]] = {}
+
+    def load(self, domain: str) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT fingerprint, settings, run_id, watermark, committed_rows, status FROM checkpoints "
+                "WHERE collection = ? AND domain = ?", (self.collection, domain)).fetchone()
+        if row is None:
+            return None
+        keys = ("fingerprint", "settings", "run_id", "watermark", "committed_rows", "status")
+        return dict(zip(keys, row))
+
+    def reset(self):
+        """コレクションのチェックポイントを消す（--recreate 時）"""
+        with self._lock:
+            self._conn.execute("DELETE FROM checkpoints WHERE collection = ?", (self.collection,))
+            self._conn.commit()
+
+    def begin(self, domain: str, fingerprint: str, settings: str, run_id: str, watermark: int = 0,
+              committed_rows: int = 0):
+        with self._lock:
+            self._state[domain] = {"chunks": [], "watermark": watermark, "committed": committed_rows,
+                                   "exhausted": False}
+            self._conn.execute("INSERT OR REPLACE INTO checkpoints VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                               (self.collection, domain, fingerprint, settings, run_id, watermark,
+                                committed_rows, "running", datetime.now(timezone.utc).isoformat()))
+            self._conn.commit()
+
+    def add_chunk(self, domain: str, start: int, end: int, num_jobs: int):
+        """チャンク [start, end) のジョブ数を登録（ジョブを投入する前に呼ぶ）"""
+        with self._lock:
+            self._state[domain]["chunks"].append([start, end, num_jobs])
+            self._advance(domain)
+
+    def complete(self, domain: str, offset: int, rows: int):
+        """offset から始まるチャンクのジョブ1件がコミットされた"""
+        with self._lock:
+            state = self._state[domain]
+            for chunk in state["chunks"]:
+                if chunk[0] == offset:
+                    chunk[2] -= 1
+                    break
+            state["committed"] += rows
+            self._advance(domain)
+
+    def finish(self, domain: str):
+        """ドメインの全チャンクを登録し終えた"""
+        with self._lock:
+            self._state[domain]["exhausted"] = True
+            self._advance(domain)
+
+    def _advance(self, domain: str):
+        state = self._state[domain]
+        chunks = state["chunks"]
+        while chunks and chunks[0][2] <= 0:
+            state["watermark"] = chunks.pop(0)[1]
+        status = "done" if state["exhausted"] and not chunks else "running"
+        self._conn.execute(
+            "UPDATE checkpoints SET watermark = ?, committed_rows = ?, status = ?, updated_at = ? "
+            "WHERE collection = ? AND domain = ?",
+            (state["watermark"], state["committed"], status, datetime.now(timezone.utc).isoformat(),
+             self.collection, domain))
+        self._conn.commit()
+
 # ------------------ ポイント構築（Named Vectors対応） ------------------
-def build_points(df: pd.DataFrame, vectors_by_name: Dict[str, List[List[float]]], domain: str, source_file: str
-                 ) -> List[models.PointStruct]:
-    # vectors_by_name: name -> list[vec]
+@dataclass
+class PointColumns:
+    """列指向のポイント列（ベクトルは float32 行列のまま保持し、送信直前まで Python のリストにしない）"""
+    ids: List[Any]
+    vectors: Any  # np.ndarray (n, dims) または name -> np.ndarray
+    payloads: List[Dict[str, Any]]
+
+    def to_batch(self) -> models.Batch:
+        """client.upsert 用の models.Batch（この時点で1リクエスト分だけリストに変換）"""
+        if isinstance(self.vectors, dict):
+            vectors: Any = {name: np.asarray(v).tolist() for name, v in self.vectors.items()}
+        else:
+            vectors = np.asarray(self.vectors).tolist()
+        return models.Batch(ids=list(self.ids), vectors=vectors, payloads=self.payloads)
+
+
+def build_batch(df: pd.DataFrame, vectors_by_name: Dict[str, np.ndarray], domain: str, source_file: str,
+                ids: Sequence[str]) -> PointColumns:
+    """列指向で PointColumns を組み立てる（行ごとの PointStruct を作らない）"""
+    # ids: 行ごとの決定的なポイントID（make_point_id）
+    # vectors_by_name: name -> (n, dims) float32 行列
     n = len(df)
+    if len(ids) != n:
+        raise ValueError(f"ids length mismatch: df={n}, ids={len(ids)}")
     for name, vecs in vectors_by_name.items():
         if len(vecs) != n:
             raise ValueError(f"vectors length mismatch for '{name}': df={n}, vecs={len(vecs)}")
     now_iso = datetime.now(timezone.utc).isoformat()
-    points: List[models.PointStruct] = []
-    for i, row in enumerate(df.itertuples(index=False)):
-        payload = {
-            "domain": domain,
-            "question": getattr(row, "question"),
-            "answer": getattr(row, "answer"),
-            "source": os.path.basename(source_file),
-            "created_at": now_iso,
-            "schema": "qa:v1",
-        }
-        # Qdrant requires point IDs to be UUID or unsigned integer
-        pid = hash(f"{domain}-{i}") & 0x7FFFFFFF  # Convert to positive 32-bit integer
-        if len(vectors_by_name) == 1:
-            # 単一ベクトル
-            vec = list(vectors_by_name.values())[0][i]
-            points.append(models.PointStruct(id=pid, vector=vec, payload=payload))
+    source = os.path.basename(source_file)
+    payloads = [
+        {"domain": domain, "question": q, "answer": a, "source": source, "created_at": now_iso, "schema": "qa:v1"}
+        for q, a in zip(df["question"].tolist(), df["answer"].tolist())
+    ]
+    if len(vectors_by_name) == 1:
+        # 単一ベクトル
+        vectors: Any = list(vectors_by_name.values())[0]
+    else:
+        # Named Vectors（name -> 列）
+        vectors = dict(vectors_by_name)
+    return PointColumns(ids=list(ids), vectors=vectors, payloads=payloads)
+
+def batch_size_of(batch: PointColumns) -> int:
+    return len(batch.ids)
+
+def slice_batch(batch: PointColumns, start: int, end: int) -> PointColumns:
+    """行範囲の切り出し（ベクトルは行列のビューなのでコピーしない）"""
+    vectors = batch.vectors
+    if isinstance(vectors, dict):
+        vectors = {name: vecs[start:end] for name, vecs in vectors.items()}
+    else:
+        vectors = vectors[start:end]
+    return PointColumns(ids=batch.ids[start:end], vectors=vectors, payloads=batch.payloads[start:end])
+
+def iter_point_rows(batches: Iterable[PointColumns]) -> Iterator[Tuple[Any, Any, Dict[str, Any]]]:
+    """列指向バッチの列を1行ずつ (id, vector, payload) で返す（送信する行だけリストに変換）"""
+    for batch in batches:
+        vectors = batch.vectors
+        for i, pid in enumerate(batch.ids):
+            if isinstance(vectors, dict):
+                vector: Any = {name: np.asarray(vecs[i]).tolist() for name, vecs in vectors.items()}
+            else:
+                vector = np.asarray(vectors[i]).tolist()
+            yield pid, vector, batch.payloads[i]
+
+def upload_batches(client: QdrantClient, collection: str, batches: Iterable[PointColumns], batch_size: int = 128,
+                   parallel: int = 1, wait: bool = True) -> int:
+    """バッチ列を1本のストリームにして client.upload_collection を1回だけ呼び、書き込み件数を返す
+
+    upload_collection が batch_size 行ずつ切り出して parallel プロセスへ配る（batches は必要な分だけ読まれる）
+    """
+    written = 0
+
+    def rows() -> Iterator[Tuple[Any, Any, Dict[str, Any]]]:
+        nonlocal written
+        for row in iter_point_rows(batches):
+            written += 1
+            yield row
+
+    # ids / vectors / payload は upload_collection が同じ歩調で読むため tee のバッファは batch_size 行程度
+    ids, vectors, payloads = (map(itemgetter(k), it) for k, it in enumerate(itertools.tee(rows(), 3)))
+    client.upload_collection(collection_name=collection, ids=ids, vectors=vectors, payload=payloads,
+                             batch_size=max(1, batch_size), parallel=max(1, parallel), wait=wait)
+    return written
+
+def iter_upload_windows(batches: Iterable[PointColumns], window_rows: int) -> Iterator[Iterator[PointColumns]]:
+    """バッチ列を約 window_rows 行ずつの区間に分ける（upload_batches を区間ごとに呼び、その都度コミットする）
+
+    window_rows <= 0 は全体で1区間。各区間は次の区間を取り出す前に読み切ること
+    """
+    it = iter(batches)
+    for first in it:
+        def window(first: PointColumns = first) -> Iterator[PointColumns]:
+            rows = batch_size_of(first)
+            yield first
+            while window_rows <= 0 or rows < window_rows:
+                batch = next(it, None)
+                if batch is None:
+                    return
+                rows += batch_size_of(batch)
+                yield batch
+
+        yield window()
+
+def upsert_points(client: QdrantClient, collection: str, batch: PointColumns, batch_size: int = 128,
+                  mode: str = "upsert", parallel: int = 1, wait: bool = True) -> int:
+    """列指向バッチを書き込み件数を返す
+
+    mode="upsert": batch_size ごとに client.upsert（送信する分だけリストに変換）
+    mode="upload": client.upload_collection（batch_size 行ずつ parallel プロセスで分割送信、内部で再試行）
+      複数バッチを書き込む場合は upload_batches でまとめて1回だけ呼ぶこと
+    wait=False の場合は適用完了を待たない（呼び出し側で最後に wait_barrier を呼ぶ）
+    """
+    n = batch_size_of(batch)
+    if mode == "upload":
+        upload_batches(client, collection, [batch], batch_size=batch_size, parallel=parallel, wait=wait)
+        return n
+    for start in range(0, n, batch_size):
+        client.upsert(collection_name=collection,
+                      points=slice_batch(batch, start, min(n, start + batch_size)).to_batch(), wait=wait)
+    return n
+
+def batch_vectors_by_name(batch: PointColumns, names: Sequence[str]) -> Dict[str, Any]:
+    """Batch のベクトル列を name -> 列 で返す（単一ベクトルは names[0] の名前を付ける）"""
+    if isinstance(batch.vectors, dict):
+        return dict(batch.vectors)
+    return {names[0]: batch.vectors}
+
+def wait_barrier(client: QdrantClient, collection: str, batch: Optional[PointColumns]) -> None:
+    """wait=False で送った書き込みの適用完了を待つ
+
+    更新はシャードごとに受付順で適用されるため、最後に送ったバッチを wait=True で再送すると
+    それ以前の書き込みもすべて適用済みになる（決定的IDなので再送は冪等）
+    """
+    if batch is not None and batch_size_of(batch):
+        client.upsert(collection_name=collection, points=batch.to_batch(), wait=True)
+
+# ------------------ パイプライン・インジェスト（埋め込み→upsert の並行化） ------------------
+@dataclass
+class IngestJob:
+    """パイプラインの処理単位（1ドメイン内の1バッチ）"""
+    domain: str
+    source_file: str
+    df: pd.DataFrame
+    texts: List[str]
+    ids: List[str]
+    hashes: List[str]
+    offset: int = 0  # ジョブが属するチャンクの先頭行（ドメイン内の通し番号、チェックポイント用）
+    # packer.segments の結果（texts と同順）と、それを作った packer のモデル（同じモデルの埋め込みで再利用）
+    segments: Optional[List[List[Tuple[str, int]]]] = None
+    segment_model: str = ""
+
+
+def iter_domain_jobs(domain: str, path: str, include_answer: bool, batch_size: int,
+                     limit: int = 0, signature: str = "", manifest: Optional[IngestManifest] = None,
+                     run_id: str = "", incremental: bool = False, chunk_rows: int = 10000,
+                     packer: Optional[Any] = None, dedup: Optional[Any] = None,
+                     checkpoints: Optional[IngestCheckpoints] = None, resume_from: Optional[int] = None
+                     ) -> Iterator[IngestJob]:
+    """1ドメインのCSVをチャンク単位で読み込み、埋め込みリクエスト単位の IngestJob を生成する（遅延評価）
+
+    dedup（helper_dedup.NearDuplicateFilter）があれば、表記ゆれ・近似重複の行は埋め込み・upsertしない
+    incremental=True の場合、台帳の行ハッシュと一致する（変更の無い）行は埋め込み・upsertしない
+    resume_from を指定すると（--resume）その行までのチャンクを読み飛ばし、以降も台帳にある行は飛ばす。
+    ポイントIDの出現番号と重複除去の状態を前回と揃えるため、読み飛ばすチャンクも読み込みはする
+    """
+    print(f"[INFO] Processing {domain}: {os.path.basename(path)}")
+    occurrences: Dict[bytes, int] = defaultdict(int)  # 質問ダイジェスト → 出現回数（ID重複回避）
+    total_rows = 0
+    skipped = 0
+    resumed = 0
+    for df in iter_csv_chunks(path, limit=limit, chunk_rows=chunk_rows):
+        start = total_rows
+        total_rows += len(df)
+        texts = build_inputs(df, include_answer=include_answer)
+        questions = df["question"].astype(str).tolist()
+        answers = df["answer"].astype(str).tolist()
+
+        ids: List[str] = []
+        for q in questions:
+            qd = row_digest((q,))
+            ids.append(make_point_id(domain, q, occurrences[qd]))
+            occurrences[qd] += 1
+        hashes = [row_content_hash(q, a, t, signature) for q, a, t in zip(questions, answers, texts)]
+
+        rows = list(range(len(df)))
+        if dedup is not None:
+            keep = dedup.keep_mask(texts)
+            if incremental and manifest is not None:
+                # 重複除去で落とした行は CSV から消えたわけではないので、登録済みなら削除対象にしない
+                manifest.touch([ids[i] for i in rows if not keep[i]], run_id)
+            rows = [i for i in rows if keep[i]]
+        if resume_from is not None and total_rows <= resume_from:
+            resumed += len(df)
+            continue
+        if (incremental or resume_from is not None) and manifest is not None:
+            known = manifest.lookup(ids)
+            unchanged = [i for i in rows if known.get(ids[i]) == hashes[i]]
+            if unchanged:
+                if incremental:
+                    manifest.touch([ids[i] for i in unchanged], run_id)
+                skipped += len(unchanged)
+                unchanged_set = set(unchanged)
+                rows = [i for i in rows if i not in unchanged_set]
+
+        # 1ジョブ = 1埋め込みリクエスト（packer があればトークン予算、無ければ batch_size 行）
+        segments: Dict[int, List[Tuple[str, int]]] = {}
+        if packer is not None:
+            # トークン化はここで1回だけ行い、セグメントはジョブに載せて埋め込み時に再利用する
+            row_segments = packer.segments([texts[i] for i in rows])
+            segments = dict(zip(rows, row_segments))
+            groups = [[rows[j] for j in group] for group in packer.pack([texts[i] for i in rows], row_segments)]
         else:
-            # Named Vectors（dict渡し）
-            vecs_dict = {name: vecs[i] for name, vecs in vectors_by_name.items()}
-            points.append(models.PointStruct(id=pid, vector=vecs_dict, payload=payload))
-    return points
-
-def upsert_points(client: QdrantClient, collection: str, points: List[models.PointStruct], batch_size: int = 128) -> int:
-    count = 0
-    for chunk in batched(points, batch_size):
-        client.upsert(collection_name=collection, points=chunk)
-        count += len(chunk)
-    return count
+            groups = [rows[j:j + batch_size] for j in range(0, len(rows), batch_size)]
+        if checkpoints is not None:
+            checkpoints.add_chunk(domain, start, total_rows, len(groups))
+        for group in groups:
+            yield IngestJob(domain=domain, source_file=path, df=df.iloc[group],
+                            texts=[texts[i] for i in group], ids=[ids[i] for i in group],
+                            hashes=[hashes[i] for i in group], offset=start,
+                            segments=[segments[i] for i in group] if segments else None,
+                            segment_model=packer.model if segments else "")
+    if checkpoints is not None:
+        checkpoints.finish(domain)
+    print(f"[INFO] {domain}: read {total_rows} rows"
+          + (f", {resumed} rows before checkpoint skipped" if resume_from is not None else "")
+          + (f", {skipped} unchanged rows skipped" if incremental
+             else f", {skipped} committed rows skipped" if resume_from is not None else ""))
+
+
+def interleave(iterables: Iterable[Iterable[Any]]) -> Iterator[Any]:
+    """各ドメインのジョブをラウンドロビンで取り出す（全ドメインを同時に進行させる）"""
+    iterators = [iter(it) for it in iterables]
+    while iterators:
+        alive = []
+        for it in iterators:
+            try:
+                yield next(it)
+            except StopIteration:
+                continue
+            alive.append(it)
+        iterators = alive
+
+
+class IngestPipeline:
+    """埋め込みワーカー（有界プール）→ 有界upsertキュー → upsertワーカー のパイプライン
+
+    - embed_workers 個のスレッドが OpenAI Embeddings を並行に呼び出す
+      Named Vectors が複数ある場合は、重複排除したテキストをモデルごとに並行して埋め込む（モデル別の同時実行枠）
+    - 埋め込み済みバッチは maxsize=queue_size のキューを経由して upsert_workers 個のスレッドが Qdrant に書き込む
+    - キューが満杯になると埋め込みワーカーが待機し、ジョブ投入側もセマフォで待機する（バックプレッシャー）
+    """
+
+    _SENTINEL = object()
+
+    def __init__(self, client: QdrantClient, collection: str, embeddings_cfg: Dict[str, Dict[str, Any]],
+                 embed_workers: int = 4, upsert_workers: int = 2, queue_size: int = 8,
+                 openai_client: Optional[OpenAI] = None, cache: Optional[Any] = None,
+                 on_commit: Optional[Callable[[IngestJob], None]] = None,
+                 packers: Optional[Dict[str, Any]] = None,
+                 upload_mode: str = "upsert", upload_parallel: int = 1, wait: bool = True,
+                 model_concurrency: int = 0, artifact_writers: Optional[Dict[str, Any]] = None,
+                 upload_batch_size: int = 128, upload_window: int = 50000):
+        self.client = client
+        self.collection = collection
+        self.embeddings_cfg = embeddings_cfg
+        self.embed_workers = max(1, embed_workers)
+        self.upsert_workers = max(1, upsert_workers)
+        self.openai_client = openai_client or get_openai_client()
+        self.cache = cache
+        self.packers = packers or {}
+        self.upload_mode = upload_mode
+        self.upload_parallel = max(1, upload_parallel)
+        self.upload_batch_size = max(1, upload_batch_size)
+        # upload モードで upload_collection 1回に渡す行数（区間ごとに台帳・チェックポイントへ記録、0 = 全体で1回）
+        self.upload_window = max(0, upload_window)
+        self.wait = wait
+        self._last_batch: Optional[PointColumns] = None
+        # upsert 完了（コミット）時のコールバック（台帳への記録など）
+        self.on_commit = on_commit
+        # ドメイン -> EmbeddingArtifactWriter（upsert 済みのベクトルを .npy に追記）
+        self.artifact_writers = artifact_writers or {}
+        self._queue: "queue.Queue[Any]" = queue.Queue(maxsize=max(1, queue_size))
+        # 埋め込み待ち＋埋め込み中のジョブ数の上限（ThreadPoolExecutor の内部キューを無制限にしない）
+        self._slots = threading.BoundedSemaphore(self.embed_workers * 2)
+        self._lock = threading.Lock()
+        self._error: Optional[BaseException] = None
+        self.counts: Dict[str, int] = defaultdict(int)
+        self.embed_calls = 0
+        # Named Vectors：モデルごとの同時実行枠（embeddings.<name>.max_concurrency、既定 model_concurrency）
+        default_quota = max(1, model_concurrency or self.embed_workers)
+        self._model_slots = {name: threading.BoundedSemaphore(max(1, int(vcfg.get("max_concurrency", default_quota))))
+                             for name, vcfg in embeddings_cfg.items()}
+        self.model_seconds: Dict[str, float] = defaultdict(float)
+        self._model_pool: Optional[ThreadPoolExecutor] = None
+        if len(embeddings_cfg) > 1:
+            self._model_pool = ThreadPoolExecutor(max_workers=self.embed_workers * len(embeddings_cfg),
+                                                  thread_name_prefix="embed-model")
+
+    # ---- 内部処理 ----
+    def _fail(self, exc: BaseException):
+        with self._lock:
+            if self._error is None:
+                self._error = exc
+
+    def _acquire_slot(self) -> bool:
+        """埋め込みスロットが空くまで待機（エラー発生時は False）"""
+        while not self._slots.acquire(timeout=0.5):
+            if self._error is not None:
+                return False
+        return self._error is None
+
+    def _put(self, item: Any) -> bool:
+        """キューが空くまで待機（エラー発生時は中断）"""
+        while self._error is None:
+            try:
+                self._queue.put(item, timeout=0.5)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def _embed_stage(self, job: IngestJob):
+        try:
+            if self._error is not None:
+                return
+            # 全モデル共通でテキストを重複排除し、各モデルは一意なテキストだけを埋め込む
+            unique_texts = list(dict.fromkeys(job.texts))
+            position = {t: i for i, t in enumerate(unique_texts)}
+            inverse = np.fromiter((position[t] for t in job.texts), dtype=np.intp, count=len(job.texts))
+            segments = dict(zip(job.texts, job.segments)) if job.segments else None
+            if self._model_pool is None:
+                results = {name: self._embed_model(name, vcfg, unique_texts, job.segment_model, segments)
+                           for name, vcfg in self.embeddings_cfg.items()}
+            else:
+                # Named Vectors はモデルごとに並行して埋め込む
+                futures = {name: self._model_pool.submit(self._embed_model, name, vcfg, unique_texts,
+                                                         job.segment_model, segments)
+                           for name, vcfg in self.embeddings_cfg.items()}
+                results = {name: f.result() for name, f in futures.items()}
+            # 重複の無いジョブは埋め込み結果の行列をそのまま使う（コピーしない）
+            vectors_by_name = {name: vecs if len(unique_texts) == len(job.texts) else vecs[inverse]
+                               for name, vecs in results.items()}
+            with self._lock:
+                self.embed_calls += len(self.embeddings_cfg)
+            batch = build_batch(job.df, vectors_by_name, domain=job.domain,
+                                source_file=job.source_file, ids=job.ids)
+            self._put((job, batch))
+        except BaseException as e:
+            self._fail(e)
+        finally:
+            self._slots.release()
+
+    def _embed_model(self, name: str, vcfg: Dict[str, Any], texts: List[str], segment_model: str = "",
+                     segments: Optional[Dict[str, List[Tuple[str, int]]]] = None) -> np.ndarray:
+        """1モデル分の埋め込み（モデルごとの同時実行枠内で実行）
+
+        ジョブのセグメントは同じモデル（= 同じエンコーディング・設定）の packer の場合だけ再利用する
+        """
+        packer = self.packers.get(name)
+        if packer is None or packer.model != segment_model:
+            segments = None
+        with self._model_slots[name]:
+            started = time.time()
+            vecs = embed_texts(texts, model=vcfg["model"], batch_size=max(1, len(texts)),
+                               client=self.openai_client, cache=self.cache, packer=packer,
+                               dims=request_dimensions(vcfg["model"], vcfg.get("dims")), segments=segments)
+            with self._lock:
+                self.model_seconds[name] += time.time() - started
+        return vecs
+
+    def _upsert_loop(self):
+        while True:
+            try:
+                item = self._queue.get(timeout=0.5)
+            except queue.Empty:
+                if self._error is not None:
+                    return
+                continue
+            if item is self._SENTINEL:
+                return
+            job, batch = item
+            try:
+                n = upsert_points(self.client, self.collection, batch, batch_size=max(1, batch_size_of(batch)),
+                                  mode=self.upload_mode, parallel=self.upload_parallel, wait=self.wait)
+                if not self.wait:
+                    with self._lock:
+                        self._last_batch = batch
+                writer = self.artifact_writers.get(job.domain)
+                if writer is not None:
+                    writer.append(batch.ids, job.texts, batch.payloads,
+                                  batch_vectors_by_name(batch, list(self.embeddings_cfg.keys())),
+                                  row_hashes=job.hashes)
+                if self.on_commit is not None:
+                    self.on_commit(job)
+                with self._lock:
+                    self.counts[job.domain] += n
+            except BaseException as e:
+                self._fail(e)
+                return
+
+    def _upload_loop(self):
+        """upload モード：キューのバッチを upload_window 行ずつのストリームにして client.upload_collection を呼ぶ
+
+        送信済みの行は upload_collection の内部でしか分からないため、台帳・チェックポイントへの記録は
+        区間ごとに upload_collection が戻った後にまとめて行う（保持するのは ID とハッシュだけ）。
+        中断後の --resume は最後に記録した区間の続きから再開する
+        """
+        pending: List[IngestJob] = []
+
+        def batches() -> Iterator[PointColumns]:
+            while True:
+                try:
+                    item = self._queue.get(timeout=0.5)
+                except queue.Empty:
+                    if self._error is not None:
+                        return
+                    continue
+                if item is self._SENTINEL:
+                    return
+                job, batch = item
+                writer = self.artifact_writers.get(job.domain)
+                if writer is not None:
+                    writer.append(batch.ids, job.texts, batch.payloads,
+                                  batch_vectors_by_name(batch, list(self.embeddings_cfg.keys())),
+                                  row_hashes=job.hashes)
+                pending.append(replace(job, df=job.df.iloc[:0], texts=[], segments=None))
+                if not self.wait:
+                    with self._lock:
+                        self._last_batch = batch
+                yield batch
+
+        try:
+            for window in iter_upload_windows(batches(), self.upload_window):
+                upload_batches(self.client, self.collection, window, batch_size=self.upload_batch_size,
+                               parallel=self.upload_parallel, wait=self.wait)
+                if self._error is not None:
+                    return
+                for job in pending:
+                    if self.on_commit is not None:
+                        self.on_commit(job)
+                    with self._lock:
+                        self.counts[job.domain] += len(job.ids)
+                pending.clear()
+        except BaseException as e:
+            self._fail(e)
+
+    # ---- 実行 ----
+    def run(self, jobs: Iterable[IngestJob]) -> Dict[str, int]:
+        """ジョブ列を処理し、ドメイン別のupsert件数を返す"""
+        started = time.time()
+        if self.upload_mode == "upload":
+            # upload_collection 自体が parallel プロセスで分割送信するため、呼び出しは1スレッドから1回だけ
+            upserters = [threading.Thread(target=self._upload_loop, name="upload", daemon=True)]
+        else:
+            upserters = [threading.Thread(target=self._upsert_loop, name=f"upsert-{i}", daemon=True)
+                         for i in range(self.upsert_workers)]
+        for t in upserters:
+            t.start()
+
+        with ThreadPoolExecutor(max_workers=self.embed_workers, thread_name_prefix="embed") as pool:
+            for job in jobs:
+                if not self._acquire_slot():
+                    break
+                pool.submit(self._embed_stage, job)
+
+        for _ in upserters:
+            if not self._put(self._SENTINEL):
+                break
+        for t in upserters:
+            t.join()
+        if self._model_pool is not None:
+            self._model_pool.shutdown(wait=True)
+        if self._error is not None:
+            raise self._error
+        if not self.wait:
+            wait_barrier(self.client, self.collection, self._last_batch)
+
+        elapsed = time.time() - started
+        total = sum(self.counts.values())
+        rate = total / elapsed if elapsed > 0 else 0.0
+        print(f"[Pipeline] {total} points in {elapsed:.1f}s ({rate:.1f} points/s, "
+              f"embed_calls={self.embed_calls}, embed_workers={self.embed_workers}, "
+              f"upsert_workers={self.upsert_workers}, mode={self.upload_mode}, "
+              f"parallel={self.upload_parallel}, wait={self.wait})")
+        if len(self.embeddings_cfg) > 1:
+            busy = ", ".join(f"{name}={sec:.1f}s" for name, sec in self.model_seconds.items())
+            print(f"[Pipeline] embedding time per model (concurrent): {busy}")
+        print(f"[Memory] {format_memory(peak_memory_mb())}")
+        return dict(self.counts)
+
+# ------------------ プロセス並列インジェスト（--workers） ------------------
+def build_packers(embeddings_cfg: Dict[str, Dict[str, Any]], batch_size: int, batch_max_tokens: int,
+                  overflow: str) -> Dict[str, Any]:
+    """トークン予算によるバッチ詰め（helper_api が無い場合は空 = --batch-size 行の固定バッチ）"""
+    if not (hapi and hasattr(hapi, "EmbeddingBatchPacker")):
+        return {}
+    return {name: hapi.EmbeddingBatchPacker(vcfg["model"], max_batch_tokens=batch_max_tokens,
+                                            max_batch_items=batch_size, overflow=overflow)
+            for name, vcfg in embeddings_cfg.items()}
+
+
+def ingest_domain_worker(task: Dict[str, Any], progress: Any = None) -> Dict[str, Any]:
+    """1ドメインを子プロセスで取り込み、件数と統計を返す
+
+    Qdrant / OpenAI クライアント、台帳・チェックポイント・キャッシュの SQLite 接続、packer、
+    重複除去フィルタはすべてプロセス内で作る（親から受け取るのは pickle 可能な設定のみ）。
+    progress（Manager().Queue）にはコミットごとに (domain, 件数) を送る
+    """
+    domain = task["domain"]
+    if task.get("trace_memory"):
+        tracemalloc.start()
+    client = QdrantClient(url=task["qdrant_url"], prefer_grpc=task["prefer_grpc"], grpc_port=task["grpc_port"],
+                          timeout=300)
+    cache = hemb.get_embedding_cache(task["cache_cfg"]) if hemb and task["cache_cfg"] is not None else None
+    manifest = IngestManifest(task["manifest_path"], task["collection"])
+    checkpoints = IngestCheckpoints(task["manifest_path"], task["collection"])
+    checkpoints.begin(domain, task["fingerprint"], task["checkpoint_settings"], task["run_id"],
+                      watermark=task["resume_from"] or 0, committed_rows=task["committed_rows"])
+    embeddings_cfg = task["embeddings_cfg"]
+    packers = build_packers(embeddings_cfg, task["batch_size"], task["batch_max_tokens"], task["overflow"])
+    dedup = None
+    if hdedup and task["dedup_cfg"] is not None:
+        dedup = hdedup.NearDuplicateFilter.from_config(task["dedup_cfg"])
+    writers: Dict[str, Any] = {}
+    if task["artifacts_dir"]:
+        vector_specs = {name: {"model": v["model"], "dims": v["dims"]} for name, v in embeddings_cfg.items()}
+        writers[domain] = hemb.EmbeddingArtifactWriter(os.path.join(task["artifacts_dir"], domain), vector_specs,
+                                                       dtype=task["artifact_dtype"])
+
+    def commit(job: IngestJob):
+        manifest.record(job.domain, job.ids, job.hashes, task["run_id"])
+        checkpoints.complete(job.domain, job.offset, len(job.ids))
+        if progress is not None:
+            progress.put((job.domain, len(job.ids)))
+
+    pipeline = IngestPipeline(client, task["collection"], embeddings_cfg, cache=cache, on_commit=commit,
+                              packers=packers, artifact_writers=writers, **task["pipeline"])
+    jobs = iter_domain_jobs(domain, task["path"], include_answer=task["include_answer"],
+                            batch_size=task["batch_size"], limit=task["limit"], signature=task["signature"],
+                            manifest=manifest, run_id=task["run_id"], incremental=task["incremental"],
+                            chunk_rows=task["chunk_rows"], packer=packers.get(task["using_default"]),
+                            dedup=dedup, checkpoints=checkpoints, resume_from=task["resume_from"])
+    started = time.time()
+    completed = False
+    try:
+        counts = pipeline.run(jobs)
+        completed = True
+    finally:
+        # 失敗時は書きかけのアーティファクトを破棄する（既存のファイルは残す）
+        for writer in writers.values():
+            writer.close(commit=completed)
+    return {
+        "domain"    : domain,
+        "counts"    : counts,
+        "elapsed"   : time.time() - started,
+        "packers"   : {name: packer.report() for name, packer in packers.items()},
+        "rate_limit": hapi.get_rate_limit_scheduler().stats() if hapi and hasattr(hapi, "get_rate_limit_scheduler") else None,
+        "cache"     : cache.stats() if cache is not None else None,
+        "dedup"     : dedup.report() if dedup is not None else None,
+        "memory"    : peak_memory_mb(),
+    }
+
+
+def merge_worker_results(results: List[Dict[str, Any]]) -> Dict[str, Any]:
+    """子プロセスの統計を合算（requests/sec はプロセスが並行に動くため合計）"""
+    merged: Dict[str, Any] = {"counts": defaultdict(int), "packers": {}, "rate_limit": None, "cache": None,
+                              "dedup": {}}
+    for res in results:
+        for domain, n in res["counts"].items():
+            merged["counts"][domain] += n
+        for name, rep in res["packers"].items():
+            acc = merged["packers"].setdefault(name, defaultdict(float))
+            for key in ("requests", "items", "tokens", "requests_per_sec", "truncated_inputs", "split_inputs"):
+                acc[key] += rep[key]
+        if res["rate_limit"]:
+            acc = merged["rate_limit"] = merged["rate_limit"] or defaultdict(float)
+            for key in ("requests", "retries", "throttled", "concurrency", "wait_seconds"):
+                acc[key] += res["rate_limit"][key]
+        if res["cache"]:
+            acc = merged["cache"] = merged["cache"] or defaultdict(float)
+            for key in ("hits", "misses", "evictions"):
+                acc[key] += res["cache"][key]
+            # 同じ SQLite を共有するため件数・サイズは最大値
+            acc["entries"] = max(acc["entries"], res["cache"]["entries"])
+            acc["size_mb"] = max(acc["size_mb"], res["cache"]["size_mb"])
+        if res["dedup"]:
+            merged["dedup"][res["domain"]] = res["dedup"]
+    for acc in merged["packers"].values():
+        acc["tokens_per_request"] = acc["tokens"] / acc["requests"] if acc["requests"] else 0.0
+        acc["items_per_request"] = acc["items"] / acc["requests"] if acc["requests"] else 0.0
+    if merged["cache"]:
+        lookups = merged["cache"]["hits"] + merged["cache"]["misses"]
+        merged["cache"]["hit_rate"] = merged["cache"]["hits"] / lookups if lookups else 0.0
+    merged["counts"] = dict(merged["counts"])
+    return merged
+
+
+def run_domain_workers(tasks: List[Dict[str, Any]], workers: int) -> Dict[str, Any]:
+    """ドメインごとのタスクをプロセスプールで並行実行し、進捗を表示して統計を合算する"""
+    started = time.time()
+    expected = len(tasks)
+    with multiprocessing.Manager() as manager:
+        progress = manager.Queue()
+        done = threading.Event()
+
+        def report_progress():
+            totals: Dict[str, int] = defaultdict(int)
+            last_print = 0.0
+            while not done.is_set() or not progress.empty():
+                try:
+                    domain, n = progress.get(timeout=0.5)
+                except queue.Empty:
+                    continue
+                totals[domain] += n
+                if time.time() - last_print >= 5.0:
+                    last_print = time.time()
+                    elapsed = last_print - started
+                    total = sum(totals.values())
+                    print(f"[Workers] {total} points ({total / elapsed if elapsed > 0 else 0.0:.1f} points/s) "
+                          + ", ".join(f"{d}={c}" for d, c in sorted(totals.items())))
+
+        reporter = threading.Thread(target=report_progress, name="worker-progress", daemon=True)
+        reporter.start()
+        results = []
+        try:
+            with ProcessPoolExecutor(max_workers=max(1, workers)) as pool:
+                futures = {pool.submit(ingest_domain_worker, task, progress): task["domain"] for task in tasks}
+                for future in as_completed(futures):
+                    res = future.result()
+                    total = sum(res["counts"].values())
+                    print(f"[Workers] {res['domain']}: {total} points in {res['elapsed']:.1f}s "
+                          f"({format_memory(res['memory'])})")
+                    results.append(res)
+        finally:
+            done.set()
+            reporter.join()
+    merged = merge_worker_results(results)
+    elapsed = time.time() - started
+    total = sum(merged["counts"].values())
+    print(f"[Workers] {total} points in {elapsed:.1f}s ({total / elapsed if elapsed > 0 else 0.0:.1f} points/s, "
+          f"processes={min(workers, expected)}, domains={expected})")
+    return merged
+
+# ------------------ 埋め込みアーティファクトからのインジェスト ------------------
+def ingest_from_artifacts(client: QdrantClient, collection: str, directory: str,
+                          embeddings_cfg: Dict[str, Dict[str, Any]], batch_size: int = 512,
+                          mode: str = "upsert", parallel: int = 1, wait: bool = True,
+                          on_commit: Optional[Callable[[str, List[Any], List[str]], None]] = None,
+                          upload_window: int = 50000) -> Dict[str, int]:
+    """保存済みの埋め込み（memmap）を OpenAI API を呼ばずに Qdrant へ書き込み、ドメイン別件数を返す
+
+    アーティファクトのベクトル名・モデル・次元が embeddings 設定と一致しない場合は書き込み前にエラー
+    """
+    found = hemb.list_artifacts(directory)
+    if not found:
+        raise FileNotFoundError(f"No embedding artifacts (*.parquet) in {directory}")
+    artifacts = {domain: hemb.EmbeddingArtifact(prefix) for domain, prefix in found.items()}
+    expected = {name: {"model": v["model"], "dims": int(v["dims"])} for name, v in embeddings_cfg.items()}
+    for domain, art in artifacts.items():
+        if art.vectors != expected:
+            raise ValueError(f"Artifact '{found[domain]}' has vectors {art.vectors} but embeddings config "
+                             f"requests {expected}. Re-run ingest with --write-artifacts.")
+
+    started = time.time()
+    names = list(embeddings_cfg.keys())
+    counts: Dict[str, int] = defaultdict(int)
+    last_batch: Optional[PointColumns] = None
+
+    def iter_artifact_batches() -> Iterator[Tuple[str, PointColumns, List[str]]]:
+        for domain, art in artifacts.items():
+            print(f"[INFO] Loading {domain}: {art.rows} vectors ({art.dtype}) from {found[domain]}")
+            for ids, payloads, arrays, row_hashes in art.iter_batches(batch_size):
+                vectors: Any = arrays[names[0]] if len(names) == 1 else {name: arrays[name] for name in names}
+                yield domain, PointColumns(ids=ids, vectors=vectors, payloads=payloads), row_hashes
+
+    if mode == "upload":
+        # 全ドメインを1本のストリームにして upload_window 行ごとに upload_collection を呼ぶ（記録は区間の書き込み後）
+        pending: List[Tuple[str, List[Any], List[str]]] = []
+
+        def stream() -> Iterator[PointColumns]:
+            nonlocal last_batch
+            for domain, batch, row_hashes in iter_artifact_batches():
+                pending.append((domain, batch.ids, row_hashes))
+                last_batch = batch
+                yield batch
+
+        for window in iter_upload_windows(stream(), upload_window):
+            upload_batches(client, collection, window, batch_size=batch_size, parallel=parallel, wait=wait)
+            for domain, ids, row_hashes in pending:
+                counts[domain] += len(ids)
+                if on_commit is not None:
+                    on_commit(domain, ids, row_hashes)
+            pending.clear()
+    else:
+        for domain, batch, row_hashes in iter_artifact_batches():
+            counts[domain] += upsert_points(client, collection, batch, batch_size=max(1, batch_size_of(batch)),
+                                            wait=wait)
+            last_batch = batch
+            if on_commit is not None:
+                on_commit(domain, batch.ids, row_hashes)
+    if not wait:
+        wait_barrier(client, collection, last_batch)
+    elapsed = time.time() - started
+    total = sum(counts.values())
+    print(f"[Artifacts] {total} points in {elapsed:.1f}s ({total / elapsed if elapsed > 0 else 0.0:.1f} points/s, "
+          f"no embedding API calls, mode={mode}, wait={wait})")
+    return dict(counts)
 
 # ------------------ 検索（Named Vectors対応） ------------------
-def embed_one(text: str, model: str) -> List[float]:
-    return embed_texts([text], model=model, batch_size=1)[0]
+def embed_one(text: str, model: str, cache: Optional[Any] = None, dims: Optional[int] = None) -> List[float]:
+    return embed_texts([text], model=model, batch_size=1, cache=cache, dims=dims)[0].tolist()
+
+def collection_vector_size(client: QdrantClient, collection: str, using_vec: Optional[str]) -> Optional[int]:
+    """コレクションのスキーマから（Named Vector の）次元数を取得"""
+    try:
+        vectors = client.get_collection(collection).config.params.vectors
+    except Exception:
+        return None
+    if isinstance(vectors, dict):
+        vp = vectors.get(using_vec) if using_vec else next(iter(vectors.values()), None)
+        return vp.size if vp else None
+    return vectors.size
 
 def search(client: QdrantClient, collection: str, query: str, using_vec: str, model_for_using: str,
-           topk: int = 5, domain: Optional[str] = None):
-    qvec = embed_one(query, model=model_for_using)
+           topk: int = 5, domain: Optional[str] = None, cache: Optional[Any] = None,
+           search_params: Optional[models.SearchParams] = None):
+    # クエリの次元はコレクションのスキーマに合わせる（次元削減して登録したコレクション対応）
+    qvec = embed_one(query, model=model_for_using, cache=cache,
+                     dims=request_dimensions(model_for_using, collection_vector_size(client, collection, using_vec)))
     qfilter = None
     if domain:
         qfilter = models.Filter(must=[models.FieldCondition(key="domain", match=models.MatchValue(value=domain))])
@@ -326,35 +1518,69 @@ def search(client: QdrantClient, collection: str, query: str, using_vec: str, mo
             # Named Vectorsの場合、using引数を試す
             try:
                 hits = client.search(collection_name=collection, query_vector=qvec, limit=topk,
-                                   query_filter=qfilter, using=using_vec)
+                                   query_filter=qfilter, using=using_vec,
+                                   search_params=search_params)
             except (TypeError, Exception):
                 # using引数がサポートされていない、または他のエラーの場合
                 hits = client.search(collection_name=collection, query_vector=qvec, limit=topk,
-                                   query_filter=qfilter)
+                                   query_filter=qfilter, search_params=search_params)
         else:
             # 単一ベクトルの場合、using引数なしで検索
             hits = client.search(collection_name=collection, query_vector=qvec, limit=topk,
-                               query_filter=qfilter)
+                               query_filter=qfilter, search_params=search_params)
     except Exception:
         # コレクション情報が取得できない場合、using引数なしで検索
         hits = client.search(collection_name=collection, query_vector=qvec, limit=topk,
-                           query_filter=qfilter)
+                           query_filter=qfilter, search_params=search_params)
     
     return hits
 
+def apply_dims_override(embeddings_cfg: Dict[str, Dict[str, Any]], spec: str) -> Dict[str, Dict[str, Any]]:
+    """--dims の指定（'256' または 'name=256,name2=512'）を embeddings 設定に反映した複製を返す"""
+    result = copy.deepcopy(embeddings_cfg)
+    for part in [p.strip() for p in spec.split(",") if p.strip()]:
+        if "=" in part:
+            name, value = part.split("=", 1)
+            if name not in result:
+                raise ValueError(f"--dims: unknown vector '{name}'. Available: {list(result.keys())}")
+            targets = [name]
+        else:
+            value = part
+            targets = list(result.keys())
+        for name in targets:
+            result[name]["dims"] = int(value)
+            request_dimensions(result[name]["model"], result[name]["dims"])  # 非対応モデルはここでエラー
+    return result
+
 # ------------------ メイン ------------------
 def main():
     cfg = load_config("config.yml")
     rag_cfg = cfg.get("rag", {})
     embeddings_cfg: Dict[str, Dict[str, Any]] = cfg.get("embeddings", {})
     paths_cfg: Dict[str, str] = cfg.get("paths", {})
-    qdrant_url = (cfg.get("qdrant", {}) or {}).get("url", "http://localhost:6333")
+    qdrant_cfg = cfg.get("qdrant", {}) or {}
+    qdrant_url = qdrant_cfg.get("url", "http://localhost:6333")
+    ingest_cfg = cfg.get("ingest", {}) or {}
 
     ap = argparse.ArgumentParser(description="Ingest 4 QA datasets into single Qdrant collection (domain filter, Named Vectors).")
     ap.add_argument("--recreate", action="store_true", help="Drop & create collection before upsert.")
     ap.add_argument("--collection", default=rag_cfg.get("collection", "qa_corpus"))
     ap.add_argument("--qdrant-url", default=qdrant_url)
-    ap.add_argument("--batch-size", type=int, default=32)
+    ap.add_argument("--prefer-grpc", action="store_true", default=qdrant_cfg.get("prefer_grpc", False),
+                    help="Use gRPC (port --grpc-port) instead of REST for Qdrant requests.")
+    ap.add_argument("--grpc-port", type=int, default=qdrant_cfg.get("grpc_port", 6334))
+    ap.add_argument("--upload-mode", choices=["upsert", "upload"], default=qdrant_cfg.get("upload_mode", "upsert"),
+                    help="'upsert': client.upsert per batch / 'upload': client.upload_collection with --upload-parallel.")
+    ap.add_argument("--upload-parallel", type=int, default=qdrant_cfg.get("upload_parallel", 1),
+                    help="Parallel processes for --upload-mode upload.")
+    ap.add_argument("--upload-window", type=int, default=qdrant_cfg.get("upload_window", 50000),
+                    help="Rows per upload_collection call in --upload-mode upload. Rows are committed to the "
+                         "manifest/checkpoint only after their window finishes, so --resume restarts from the "
+                         "last finished window (0 = one call for the whole run; --resume then starts over).")
+    ap.add_argument("--no-wait", action="store_true", default=not qdrant_cfg.get("wait", True),
+                    help="Do not wait for each write to be applied (a final barrier waits once at the end).")
+    ap.add_argument("--batch-size", type=int, default=ingest_cfg.get("batch_size", 512),
+                    help="Max rows per embeddings request / upsert batch.")
     ap.add_argument("--limit", type=int, default=0, help="Row limit per CSV for development (0=all)")
     ap.add_argument("--include-answer", action="store_true",
                     default=rag_cfg.get("include_answer_in_embedding", False),
@@ -363,18 +1589,93 @@ def main():
     ap.add_argument("--domain", default=None, choices=[None, "customer", "medical", "legal", "sciq", "trivia"])
     ap.add_argument("--topk", type=int, default=5)
     ap.add_argument("--using", default=None, help="Named Vector name to use for search (e.g., 'primary').")
+    ap.add_argument("--embed-workers", type=int, default=ingest_cfg.get("embed_workers", 4),
+                    help="Concurrent embedding requests (pipeline workers).")
+    ap.add_argument("--upsert-workers", type=int, default=ingest_cfg.get("upsert_workers", 2),
+                    help="Concurrent Qdrant upsert workers.")
+    ap.add_argument("--queue-size", type=int, default=ingest_cfg.get("queue_size", 8),
+                    help="Max embedded batches waiting for upsert (backpressure).")
+    ap.add_argument("--batch-max-tokens", type=int, default=ingest_cfg.get("batch_max_tokens", 100000),
+                    help="Max tiktoken tokens per embeddings request.")
+    ap.add_argument("--overflow", choices=["truncate", "split", "error"], default=ingest_cfg.get("overflow", "truncate"),
+                    help="Policy for single inputs longer than the model's input token limit.")
+    ap.add_argument("--chunk-rows", type=int, default=ingest_cfg.get("chunk_rows", 10000),
+                    help="Rows read from each CSV at a time (bounded-memory streaming).")
+    quant_cfg = cfg.get("quantization", {}) or {}
+    ap.add_argument("--quantization", choices=list(QUANTIZATION_TYPES), default=quant_cfg.get("type", "none"),
+                    help="Quantization applied when creating the collection (int8 scalar / product / binary).")
+    ap.add_argument("--on-disk-vectors", action="store_true", default=quant_cfg.get("on_disk_vectors", False),
+                    help="Keep original float32 vectors on disk (quantized vectors stay in RAM).")
+    ap.add_argument("--oversampling", type=float, default=None,
+                    help="Search: fetch limit*oversampling candidates with quantized vectors (default YAML).")
+    ap.add_argument("--no-rescore", action="store_true", help="Search: do not rescore with original vectors.")
+    storage_cfg = cfg.get("storage", {}) or {}
+    ap.add_argument("--storage-profile", choices=list(STORAGE_PROFILES), default=storage_cfg.get("profile", "memory"),
+                    help="'on_disk': memory-mapped vectors, on-disk payload and HNSW (for corpora larger than RAM).")
+    ap.add_argument("--warmup-queries", type=int, default=storage_cfg.get("warmup_queries", 32),
+                    help="Warm-up searches after ingest with --storage-profile on_disk (0=off).")
+    ap.add_argument("--dims", default=None,
+                    help="Reduced embedding dims for text-embedding-3 models: '256' for all vectors "
+                         "or 'primary=512,large=768' per named vector (requires --recreate).")
+    ap.add_argument("--bulk-load", action="store_true",
+                    help="Disable HNSW indexing during ingest, then rebuild once and wait until queryable.")
+    ap.add_argument("--bulk-segments", type=int, default=ingest_cfg.get("bulk_segment_number", 4),
+                    help="default_segment_number while --bulk-load is active.")
+    ap.add_argument("--incremental", action="store_true",
+                    help="Embed/upsert only new or changed rows and delete rows removed from the CSVs.")
+    ap.add_argument("--workers", type=int, default=ingest_cfg.get("workers", 1),
+                    help="Ingest domains in N worker processes, each with its own Qdrant/OpenAI clients (1=off). "
+                         "The unit of work is a whole domain: at most one process per domain, so a single "
+                         "large domain is not split across processes (raise --embed-workers for that).")
+    ap.add_argument("--trace-memory", action="store_true",
+                    help="Track peak Python allocations with tracemalloc (slower) in addition to peak RSS.")
+    ap.add_argument("--resume", action="store_true",
+                    help="Continue an interrupted ingest from each domain's last checkpoint.")
+    ap.add_argument("--no-embedding-cache", action="store_true",
+                    help="Disable the persistent embedding cache (always call the API).")
+    dedup_cfg = cfg.get("dedup", {}) or {}
+    ap.add_argument("--no-dedup", action="store_true", default=not dedup_cfg.get("enabled", False),
+                    help="Do not drop normalized/near-duplicate rows before embedding.")
+    ap.add_argument("--dedup", dest="no_dedup", action="store_false",
+                    help="Drop normalized/near-duplicate rows before embedding (overrides YAML dedup.enabled).")
+    ap.add_argument("--dedup-threshold", type=float, default=dedup_cfg.get("threshold", 0.9),
+                    help="Estimated Jaccard similarity (MinHash) above which rows are near-duplicates.")
+    artifacts_cfg = {**DEFAULTS["artifacts"], **(cfg.get("artifacts", {}) or {})}
+    ap.add_argument("--write-artifacts", action="store_true", default=artifacts_cfg.get("write", False),
+                    help="Save embeddings per domain as .npy memmaps + Parquet sidecar under --artifacts-dir.")
+    ap.add_argument("--artifacts-dir", default=artifacts_cfg.get("dir", "OUTPUT/artifacts"))
+    ap.add_argument("--artifact-dtype", choices=["float32", "float16"], default=artifacts_cfg.get("dtype", "float32"),
+                    help="Storage dtype of the saved embeddings.")
+    ap.add_argument("--from-artifacts", action="store_true",
+                    help="Ingest vectors from --artifacts-dir without calling the embeddings API.")
     args = ap.parse_args()
+    if args.trace_memory:
+        tracemalloc.start()
 
     # どのベクトル定義があるか判定（1つなら単一、2つ以上ならNamed Vectors）
     if not embeddings_cfg:
         embeddings_cfg = DEFAULTS["embeddings"]
+    # 次元削減（Matryoshka）：--dims で Named Vector ごとの次元を上書き
+    if args.dims:
+        embeddings_cfg = apply_dims_override(embeddings_cfg, args.dims)
     # using の既定値（単一路ならその名前、複数なら 'primary' 優先）
     using_default = list(embeddings_cfg.keys())[0]
     using_vec = args.using or using_default
 
+    # 埋め込みキャッシュ（変更の無いテキストはAPIを呼ばない）
+    cache = None
+    if hemb and not args.no_embedding_cache:
+        cache = hemb.get_embedding_cache(cfg.get("embedding_cache"))
+
     # Qdrant with timeout configuration
-    client = QdrantClient(url=args.qdrant_url, timeout=300)
-    create_or_recreate_collection(client, args.collection, recreate=args.recreate, embeddings_cfg=embeddings_cfg)
+    # 量子化設定（YAML quantization を CLI で上書き）
+    quant_cfg = {**quant_cfg, "type": args.quantization, "on_disk_vectors": args.on_disk_vectors}
+    search_params = build_search_params(quant_cfg, oversampling=args.oversampling,
+                                        rescore=False if args.no_rescore else None)
+
+    client = QdrantClient(url=args.qdrant_url, prefer_grpc=args.prefer_grpc, grpc_port=args.grpc_port, timeout=300)
+    create_or_recreate_collection(client, args.collection, recreate=args.recreate, embeddings_cfg=embeddings_cfg,
+                                  quantization_cfg=quant_cfg, storage_profile=args.storage_profile)
 
     # 検索のみ
     if args.search:
@@ -383,13 +1684,20 @@ def main():
             raise ValueError(f"--using '{using_vec}' is not in embeddings config: {list(embeddings_cfg.keys())}")
         model_for_using = embeddings_cfg[using_vec]["model"]
         hits = search(client, args.collection, args.search, using_vec, model_for_using,
-                      topk=args.topk, domain=args.domain)
+                      topk=args.topk, domain=args.domain, cache=cache, search_params=search_params)
         print(f"[Search] collection={args.collection} using={using_vec} domain={args.domain or 'ALL'} query={args.search!r}")
         for h in hits:
             print(f"score={h.score:.4f}  domain={h.payload.get('domain')}  Q: {h.payload.get('question')}  A: {h.payload.get('answer')[:80]}...")
         return
 
     # インジェスト
+    # 既存コレクションの次元と埋め込み設定が食い違う場合は書き込み前に止める
+    for name, vcfg in embeddings_cfg.items():
+        size = collection_vector_size(client, args.collection, name if len(embeddings_cfg) > 1 else None)
+        if size is not None and size != vcfg["dims"]:
+            raise ValueError(f"Collection '{args.collection}' vector '{name}' has {size} dims but embeddings "
+                             f"config requests {vcfg['dims']}. Use --recreate (or a different --collection).")
+
     # vector_stores.jsonから最新ファイルパスマッピングを動的に取得
     print("[INFO] Searching for latest data files in OUTPUT folder...")
     vector_mapping = load_vector_stores_mapping()
@@ -425,27 +1733,230 @@ def main():
             print(f"  - {domain}: NOT FOUND")
     print()
     
-    total = 0
+    # 台帳（決定的ポイントID → 行ハッシュ）
+    manifest = IngestManifest(ingest_cfg.get("manifest_path", DEFAULTS["ingest"]["manifest_path"]), args.collection)
+    if args.recreate:
+        manifest.reset()
+    elif args.incremental and manifest.count() and not (client.get_collection(args.collection).points_count or 0):
+        # コレクションが外部で作り直された場合、台帳は信用できない
+        print("[WARN] Collection is empty but manifest has rows. Resetting manifest (full ingest).")
+        manifest.reset()
+    run_id = datetime.now(timezone.utc).strftime("%Y%m%dT%H%M%S%f")
+    signature = embedding_signature(embeddings_cfg, args.include_answer)
+
+    # チェックポイント（台帳と同じDB）。--recreate と --resume は両立しない
+    if args.resume and args.recreate:
+        raise ValueError("--resume cannot be combined with --recreate.")
+    checkpoints = IngestCheckpoints(ingest_cfg.get("manifest_path", DEFAULTS["ingest"]["manifest_path"]),
+                                    args.collection)
+    if args.recreate or not manifest.count():
+        checkpoints.reset()
+    # 読み飛ばすチャンクの境界・ポイントID・重複除去の結果が前回と同じになる設定のときだけ再開できる
+    checkpoint_settings = json.dumps({"signature": signature, "chunk_rows": args.chunk_rows, "limit": args.limit,
+                                      "dedup": None if args.no_dedup else args.dedup_threshold}, sort_keys=True)
+    run_ids: Dict[str, str] = {domain: run_id for domain in domain_paths}
+
+    # トークン予算によるバッチ詰め（helper_api が無い場合は --batch-size 行の固定バッチ）
+    packers = build_packers(embeddings_cfg, args.batch_size, args.batch_max_tokens, args.overflow)
+    job_packer = packers.get(using_default)
+
+    # 埋め込み前の重複除去（ドメインごと。別ドメインの同一テキストは domain フィルタのため残す）
+    domain_dedup_cfg = {**dedup_cfg, "enabled": True, "threshold": args.dedup_threshold}
+    dedup_filters: Dict[str, Any] = {}
+    if hdedup and not args.no_dedup:
+        dedup_filters = {domain: hdedup.NearDuplicateFilter.from_config(domain_dedup_cfg) for domain in domain_paths}
+
+    # 埋め込みアーティファクト（差分インジェスト・再開では一部の行しか埋め込まないため書き出さない）
+    if (args.write_artifacts or args.from_artifacts) and not (hemb and hasattr(hemb, "EmbeddingArtifactWriter")):
+        raise RuntimeError("helper_embedding (numpy, pyarrow) is required for --write-artifacts / --from-artifacts")
+    write_artifacts = args.write_artifacts
+    if args.write_artifacts and args.from_artifacts:
+        print("[WARN] --from-artifacts reads existing artifacts; --write-artifacts is ignored.")
+        write_artifacts = False
+    elif args.write_artifacts and args.incremental:
+        print("[WARN] --incremental embeds only changed rows; --write-artifacts is ignored.")
+        write_artifacts = False
+    elif args.write_artifacts and args.resume:
+        print("[WARN] --resume embeds only rows after the checkpoint; --write-artifacts is ignored.")
+        write_artifacts = False
+
+    # --workers: ドメインごとに子プロセスで取り込む（プロセスごとにクライアント・接続を持つ）
+    use_workers = args.workers > 1 and not args.from_artifacts
+    pipeline_kwargs = dict(embed_workers=args.embed_workers, upsert_workers=args.upsert_workers,
+                           queue_size=args.queue_size, upload_mode=args.upload_mode,
+                           upload_parallel=args.upload_parallel, upload_batch_size=args.batch_size,
+                           upload_window=args.upload_window,
+                           wait=not args.no_wait,
+                           model_concurrency=ingest_cfg.get("model_concurrency", 0))
+    tasks: List[Dict[str, Any]] = []
+
+    # パイプライン：全ドメインのジョブをラウンドロビンで投入し、埋め込みとupsertを並行実行
+    jobs = []
+    job_domains: List[str] = []
     for domain, path in domain_paths.items():
         if not path or not os.path.exists(path):
             print(f"[WARN] File not found for domain '{domain}': {path or 'No path specified'} (skipping)")
             continue
-        
-        print(f"\n[INFO] Processing {domain}: {os.path.basename(path)}")
-        df = load_csv(path, limit=args.limit)
-        texts = build_inputs(df, include_answer=args.include_answer)
+        if args.from_artifacts:
+            continue
+        fingerprint = source_fingerprint(path)
+        resume_from: Optional[int] = None
+        committed_rows = 0
+        if args.resume:
+            cp = checkpoints.load(domain)
+            if cp and cp["fingerprint"] == fingerprint and cp["settings"] == checkpoint_settings:
+                # 中断した実行の run_id を引き継ぐ（--incremental の消えた行の判定を前回と揃える）
+                run_ids[domain] = cp["run_id"]
+                if cp["status"] == "done":
+                    print(f"[Resume] {domain}: already completed ({cp['committed_rows']} rows), skipping")
+                    continue
+                resume_from = cp["watermark"]
+                committed_rows = cp["committed_rows"]
+                print(f"[Resume] {domain}: continuing after row {resume_from} "
+                      f"({committed_rows} rows committed previously)")
+            else:
+                if cp:
+                    print(f"[WARN] {domain}: source file or settings changed since the checkpoint; starting over.")
+                resume_from = 0
+        if use_workers:
+            tasks.append({
+                "domain": domain, "path": path, "collection": args.collection,
+                "qdrant_url": args.qdrant_url, "prefer_grpc": args.prefer_grpc, "grpc_port": args.grpc_port,
+                "cache_cfg": cfg.get("embedding_cache") if cache is not None else None,
+                "manifest_path": ingest_cfg.get("manifest_path", DEFAULTS["ingest"]["manifest_path"]),
+                "fingerprint": fingerprint, "checkpoint_settings": checkpoint_settings,
+                "run_id": run_ids[domain], "resume_from": resume_from, "committed_rows": committed_rows,
+                "embeddings_cfg": embeddings_cfg, "using_default": using_default,
+                "batch_size": args.batch_size, "batch_max_tokens": args.batch_max_tokens, "overflow": args.overflow,
+                "dedup_cfg": domain_dedup_cfg if hdedup and not args.no_dedup else None,
+                "artifacts_dir": args.artifacts_dir if write_artifacts else None,
+                "artifact_dtype": args.artifact_dtype,
+                "include_answer": args.include_answer, "limit": args.limit, "signature": signature,
+                "incremental": args.incremental, "chunk_rows": args.chunk_rows,
+                "pipeline": pipeline_kwargs, "trace_memory": args.trace_memory,
+            })
+            continue
+        checkpoints.begin(domain, fingerprint, checkpoint_settings, run_ids[domain],
+                          watermark=resume_from or 0, committed_rows=committed_rows)
+        jobs.append(iter_domain_jobs(domain, path, include_answer=args.include_answer,
+                                     batch_size=args.batch_size, limit=args.limit, signature=signature,
+                                     manifest=manifest, run_id=run_ids[domain], incremental=args.incremental,
+                                     chunk_rows=args.chunk_rows, packer=job_packer,
+                                     dedup=dedup_filters.get(domain), checkpoints=checkpoints,
+                                     resume_from=resume_from))
+        job_domains.append(domain)
+
+    def commit(job: IngestJob):
+        manifest.record(job.domain, job.ids, job.hashes, run_ids[job.domain])
+        checkpoints.complete(job.domain, job.offset, len(job.ids))
+
+    def commit_artifact(domain: str, ids: List[Any], row_hashes: List[str]):
+        # 同じ埋め込み設定で書いたアーティファクトの行ハッシュは台帳にそのまま使える
+        manifest.record(domain, ids, row_hashes, run_id)
+
+    artifact_writers: Dict[str, Any] = {}
+    if write_artifacts and not use_workers:
+        vector_specs = {name: {"model": vcfg["model"], "dims": vcfg["dims"]} for name, vcfg in embeddings_cfg.items()}
+        artifact_writers = {domain: hemb.EmbeddingArtifactWriter(os.path.join(args.artifacts_dir, domain),
+                                                                  vector_specs, dtype=args.artifact_dtype)
+                            for domain in job_domains}
 
-        # 埋め込み（Named Vectors: 各ベクトル名ごとに生成）
-        vectors_by_name: Dict[str, List[List[float]]] = {}
-        for name, vcfg in embeddings_cfg.items():
-            vectors_by_name[name] = embed_texts(texts, model=vcfg["model"], batch_size=args.batch_size)
+    pipeline = IngestPipeline(client, args.collection, embeddings_cfg,
+                              cache=cache,
+                              on_commit=commit,
+                              packers=packers,
+                              artifact_writers=artifact_writers,
+                              **pipeline_kwargs)
+    worker_stats: Optional[Dict[str, Any]] = None
+    bulk_started = time.time()
+    indexing_threshold = begin_bulk_load(client, args.collection, args.bulk_segments) if args.bulk_load else 0
+    ingested = False
+    try:
+        if args.from_artifacts:
+            counts = ingest_from_artifacts(client, args.collection, args.artifacts_dir, embeddings_cfg,
+                                           batch_size=args.batch_size, mode=args.upload_mode,
+                                           parallel=args.upload_parallel, wait=not args.no_wait,
+                                           upload_window=args.upload_window,
+                                           on_commit=commit_artifact)
+        elif use_workers:
+            if args.workers > len(tasks):
+                print(f"[WARN] --workers {args.workers} > {len(tasks)} domains; each domain runs in a single "
+                      f"process, so only {len(tasks)} processes are used.")
+            worker_stats = run_domain_workers(tasks, args.workers)
+            counts = worker_stats["counts"]
+        else:
+            counts = pipeline.run(interleave(jobs))
+        ingested = True
+    finally:
+        # 失敗時は書きかけのアーティファクトを破棄する（既存のファイルは残す）
+        for writer in artifact_writers.values():
+            writer.close(commit=ingested)
+        if args.bulk_load and not ingested:
+            # 失敗時は索引作成の再開だけ行い、optimizer は待たない（元の例外をそのまま伝える）
+            print(f"[BulkLoad] Ingest failed; restoring indexing (indexing_threshold={indexing_threshold}) "
+                  f"without waiting for optimizer")
+            try:
+                restore_indexing(client, args.collection, indexing_threshold)
+            except Exception as e:
+                print(f"[WARN] Failed to restore indexing_threshold: {e}")
+    if args.bulk_load:
+        ingest_elapsed = time.time() - bulk_started
+        print(f"[BulkLoad] Restoring indexing (indexing_threshold={indexing_threshold}) and waiting for optimizer...")
+        index_elapsed = finish_bulk_load(client, args.collection, indexing_threshold,
+                                         num_vectors=len(embeddings_cfg),
+                                         timeout=ingest_cfg.get("bulk_index_timeout", 1800))
+        print(f"[BulkLoad] ingest {ingest_elapsed:.1f}s + indexing {index_elapsed:.1f}s = "
+              f"{ingest_elapsed + index_elapsed:.1f}s to queryable")
+    for domain, n in counts.items():
+        source = args.artifacts_dir if args.from_artifacts else os.path.basename(domain_paths[domain])
+        print(f"[{domain}] Successfully upserted {n} points from {source}")
+    total = sum(counts.values())
 
-        points = build_points(df, vectors_by_name, domain=domain, source_file=path)
-        n = upsert_points(client, args.collection, points, batch_size=args.batch_size)
-        print(f"[{domain}] Successfully upserted {n} points from {os.path.basename(path)}")
-        total += n
+    # CSVから消えた行を削除（--limit 指定時は対象外の行を誤って消すためスキップ）
+    if args.incremental and not args.from_artifacts:
+        if args.limit:
+            print("[WARN] --limit is set; skipping deletion of vanished rows.")
+        else:
+            for domain, path in domain_paths.items():
+                if not path or not os.path.exists(path):
+                    continue
+                deleted = delete_vanished(client, args.collection, manifest, domain, run_ids[domain])
+                if deleted:
+                    print(f"[{domain}] Deleted {deleted} vanished points")
 
     print(f"Done. Total upserted: {total}")
+    # 統計（--workers の場合は子プロセスの合算）
+    if worker_stats is not None:
+        dedup_reports = worker_stats["dedup"]
+        packer_reports = worker_stats["packers"]
+        rstats = worker_stats["rate_limit"]
+        cstats = worker_stats["cache"]
+    else:
+        dedup_reports = {domain: dedup.report() for domain, dedup in dedup_filters.items() if dedup.rows}
+        packer_reports = {name: packer.report() for name, packer in packers.items()}
+        rstats = hapi.get_rate_limit_scheduler().stats() if hapi and hasattr(hapi, "get_rate_limit_scheduler") else None
+        cstats = cache.stats() if cache is not None else None
+    for domain, rep in dedup_reports.items():
+        print(hdedup.format_dedup_report(domain, rep))
+    for name, rep in packer_reports.items():
+        print(f"[Embeddings:{name}] requests={rep['requests']:.0f} tokens={rep['tokens']:.0f} "
+              f"tokens/request={rep['tokens_per_request']:.0f} items/request={rep['items_per_request']:.1f} "
+              f"requests/sec={rep['requests_per_sec']:.2f} truncated={rep['truncated_inputs']:.0f} "
+              f"split={rep['split_inputs']:.0f}")
+    if rstats:
+        print(f"[RateLimit] requests={rstats['requests']:.0f} retries={rstats['retries']:.0f} "
+              f"throttled={rstats['throttled']:.0f} concurrency={rstats['concurrency']:.0f} "
+              f"waited={rstats['wait_seconds']:.1f}s")
+    if cstats:
+        print(f"[Cache] hits={cstats['hits']:.0f} misses={cstats['misses']:.0f} hit_rate={cstats['hit_rate']:.1%} "
+              f"entries={cstats['entries']:.0f} size={cstats['size_mb']:.1f}MB evictions={cstats['evictions']:.0f}")
+
+    # on_disk プロファイルではよく使うセグメントを先にページキャッシュへ載せる
+    if args.storage_profile == "on_disk" and args.warmup_queries > 0:
+        warm_elapsed = warm_up_collection(client, args.collection,
+                                          using=using_vec if len(embeddings_cfg) > 1 else None,
+                                          queries=args.warmup_queries)
+        print(f"[Storage] Warm-up: {args.warmup_queries} queries in {warm_elapsed:.1f}s")
 
     # 動作確認のミニ検索（エラーを回避しながら実行）
     print(f"\n[INFO] Running verification searches...")
@@ -454,7 +1965,8 @@ def main():
     
     for q, d in sample:
         try:
-            hits = search(client, args.collection, q, using_vec, model_for_using, topk=3, domain=d)
+            hits = search(client, args.collection, q, using_vec, model_for_using, topk=3, domain=d, cache=cache,
+                          search_params=search_params)
             if hits:
                 print(f"\n[Search] domain={d} query={q}")
                 for h in hits[:2]:  # 最初の2件のみ表示
@@ -8,7 +8,7 @@ a40_show_qdrant_data.py - Qdrantデータ表示ツール
 【主要機能】
 ✅ Qdrantサーバーの接続状態チェック
 ✅ コレクション一覧の表示
-✅ コレクション詳細情報の表示
+✅ コレクション詳細情報の表示（常駐RAM / ディスク使用量の見積もり）
 ✅ ポイントデータの表示とエクスポート（CSV, JSON）
 """
 
@@ -35,6 +35,13 @@ except ImportError:
     QDRANT_AVAILABLE = False
     logger.warning("Qdrant client not available. Install with: pip install qdrant-client")
 
+# 常駐(RAM)/ディスク使用量の見積もり（helper_qdrant）
+try:
+    from helper_qdrant import collection_footprint
+    FOOTPRINT_AVAILABLE = True
+except ImportError:
+    FOOTPRINT_AVAILABLE = False
+
 # ===================================================================
 # サーバー設定
 # ===================================================================
@@ -206,6 +213,13 @@ class QdrantDataFetcher:
                 vector_size = 'N/A'
                 distance = 'N/A'
             
+            footprint = None
+            if FOOTPRINT_AVAILABLE:
+                try:
+                    footprint = collection_footprint(collection_info)
+                except Exception as e:
+                    logger.warning(f"フットプリント見積もりエラー: {e}")
+
             return {
                 "vectors_count": collection_info.vectors_count,
                 "points_count": collection_info.points_count,
@@ -214,7 +228,8 @@ class QdrantDataFetcher:
                 "config": {
                     "vector_size": vector_size,
                     "distance": distance,
-                }
+                },
+                "footprint": footprint
             }
         except Exception as e:
             return {"error": str(e)}
@@ -384,6 +399,19 @@ def main():
                             st.write("**ベクトル設定:**")
                             st.write(f"  • ベクトル次元: {info['config']['vector_size']}")
                             st.write(f"  • 距離計算: {info['config']['distance']}")
+
+                            # 常駐(RAM)とディスクの使用量（ホストのサイジング用の見積もり、payload は含まない）
+                            footprint = info.get("footprint")
+                            if footprint:
+                                st.write("**ストレージ（見積もり）:**")
+                                fcol1, fcol2, fcol3 = st.columns(3)
+                                with fcol1:
+                                    st.metric("常駐 (RAM)", f"{footprint['resident_bytes'] / 2 ** 20:,.1f} MB")
+                                with fcol2:
+                                    st.metric("ディスク (mmap)", f"{footprint['on_disk_bytes'] / 2 ** 20:,.1f} MB")
+                                with fcol3:
+                                    st.metric("payload", "ディスク" if footprint["on_disk_payload"] else "RAM")
+                                st.dataframe(pd.DataFrame(footprint["vectors"]), use_container_width=True)
                         else:
                             st.error(f"エラー: {info['error']}")
                 
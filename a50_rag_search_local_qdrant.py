@@ -12,6 +12,7 @@ a50_rag_search_local_qdrant.py — Streamlit UI（ドメイン絞り・横断・
 
 起動: streamlit run a50_rag_search_local_qdrant.py --server.port=8504
 """
+import copy
 import os
 from typing import Dict, Any, List, Optional
 
@@ -27,6 +28,11 @@ from qdrant_client import QdrantClient
 from qdrant_client.http import models
 from openai import OpenAI
 
+from helper_api import estimate_request_tokens, get_rate_limit_scheduler
+from helper_embedding import (EMBEDDING_ENCODING_FORMAT, EmbeddingCache, embed_with_cache, embeddings_to_array,
+                              get_embedding_cache, request_dimensions)
+from helper_qdrant import DEFAULT_QUANTIZATION, build_search_params
+
 # 設定ロード（a30_qdrant_registration.py と同等の最小版）
 DEFAULTS = {
     "rag": {"collection": "product_embeddings"},  # Changed default to product_embeddings
@@ -36,6 +42,8 @@ DEFAULTS = {
         "3-small": {"provider": "openai", "model": "text-embedding-3-small", "dims": 1536},
     },
     "qdrant": {"url": "http://localhost:6333"},
+    "embedding_cache": {"enabled": True, "path": "OUTPUT/cache/embeddings.sqlite", "max_size_mb": 2048},
+    "quantization": dict(DEFAULT_QUANTIZATION),
 }
 
 # Collection-specific embedding configurations
@@ -50,7 +58,7 @@ def load_config(path="config.yml") -> Dict[str, Any]:
     if yaml and os.path.exists(path):
         with open(path, "r", encoding="utf-8") as f:
             cfg = yaml.safe_load(f) or {}
-    full = DEFAULTS.copy()
+    full = copy.deepcopy(DEFAULTS)  # DEFAULTS（helper_qdrant.DEFAULT_QUANTIZATION を含む）を書き換えない
     # 浅いマージ
     for k, v in (cfg or {}).items():
         if isinstance(v, dict) and isinstance(full.get(k), dict):
@@ -59,13 +67,40 @@ def load_config(path="config.yml") -> Dict[str, Any]:
             full[k] = v
     return full
 
-def embed_query(text: str, model: str, dims: Optional[int] = None) -> List[float]:
-    client = OpenAI()
-    # Use dimensions parameter if model supports it (text-embedding-3-* models)
-    if dims and "text-embedding-3" in model:
-        return client.embeddings.create(model=model, input=[text], dimensions=dims).data[0].embedding
-    else:
-        return client.embeddings.create(model=model, input=[text]).data[0].embedding
+def collection_vector_size(client: QdrantClient, collection: str, vec_name: Optional[str] = None) -> Optional[int]:
+    """コレクションのスキーマから次元数を取得（Named Vectors なら vec_name、無ければ先頭）"""
+    try:
+        vectors = client.get_collection(collection).config.params.vectors
+    except Exception:
+        return None
+    if isinstance(vectors, dict):
+        vp = vectors.get(vec_name) or next(iter(vectors.values()), None)
+        return vp.size if vp else None
+    return vectors.size
+
+def embed_query(text: str, model: str, dims: Optional[int] = None,
+                cache: Optional[EmbeddingCache] = None) -> List[float]:
+    client = OpenAI(max_retries=0)  # 再試行は共通スケジューラで行う
+    # Use dimensions parameter if model supports it (text-embedding-3-* models, reduced dims only)
+    req_dims = request_dimensions(model, dims)
+
+    def _embed(texts: List[str]):
+        # base64（float32 バイト列）で受け取り np.frombuffer で復元
+        params: Dict[str, Any] = {"model": model, "input": texts, "encoding_format": EMBEDDING_ENCODING_FORMAT}
+        if req_dims:
+            params["dimensions"] = req_dims
+        resp = get_rate_limit_scheduler().call(lambda: client.embeddings.with_raw_response.create(**params),
+                                               model=model, tokens=estimate_request_tokens(texts, model))
+        return embeddings_to_array(resp.data)
+
+    # 同じクエリの再検索では埋め込みAPIを呼ばない
+    return embed_with_cache([text], model, _embed, cache=cache, dims=req_dims)[0]
+
+
+@st.cache_resource
+def get_query_embedding_cache(cache_cfg_items: tuple) -> Optional[EmbeddingCache]:
+    """Streamlitの再実行間で共有する埋め込みキャッシュ"""
+    return get_embedding_cache(dict(cache_cfg_items))
 
 st.set_page_config(page_title="Qdrant RAG UI", page_icon="🔎", layout="wide")
 st.title("🔎 Qdrant RAG UI (domain filter / named vectors)")
@@ -149,6 +184,13 @@ with st.sidebar:
         domain = "ALL"
     
     topk = st.slider("TopK", min_value=1, max_value=20, value=5, step=1)
+
+    # 量子化コレクションの検索パラメータ（量子化なしのコレクションでは無視される）
+    quant_search_cfg = {**DEFAULT_QUANTIZATION["search"], **((cfg.get("quantization") or {}).get("search") or {})}
+    with st.expander("Quantization search", expanded=False):
+        q_rescore = st.checkbox("Rescore with original vectors", value=bool(quant_search_cfg.get("rescore", True)))
+        q_oversampling = st.slider("Oversampling", min_value=1.0, max_value=8.0,
+                                   value=float(quant_search_cfg.get("oversampling", 2.0)), step=0.5)
     qdrant_url_input = st.text_input("Qdrant URL", value=qdrant_url)
     debug_mode = st.checkbox("🐛 Debug Mode", value=False)
     
@@ -224,7 +266,8 @@ if do_search and query.strip():
         # Get the correct embedding configuration for the selected collection
         collection_config = COLLECTION_EMBEDDINGS.get(collection, {"model": model_for_using, "dims": None})
         embedding_model = collection_config["model"]
-        embedding_dims = collection_config.get("dims")
+        # クエリの次元は登録時の次元（コレクションのスキーマ）に合わせる
+        embedding_dims = collection_vector_size(client, collection, vec_name) or collection_config.get("dims")
         
         # Debug: Show embedding configuration
         if debug_mode:
@@ -232,9 +275,14 @@ if do_search and query.strip():
         
         # Generate embeddings with the correct dimensions
         try:
-            qvec = embed_query(query, embedding_model, embedding_dims)
+            query_cache = get_query_embedding_cache(tuple(sorted((cfg.get("embedding_cache") or {}).items())))
+            qvec = embed_query(query, embedding_model, embedding_dims, cache=query_cache)
             if debug_mode:
                 st.success(f"✅ Generated embedding with {len(qvec)} dimensions")
+                if query_cache is not None:
+                    cache_stats = query_cache.stats()
+                    st.info(f"🗄️ Embedding cache: hits={cache_stats['hits']} misses={cache_stats['misses']} "
+                            f"entries={cache_stats['entries']}")
         except Exception as embed_err:
             st.error(f"❌ Embedding generation failed: {str(embed_err)}")
             st.error(f"Model: {embedding_model}, Requested dims: {embedding_dims}")
@@ -252,7 +300,9 @@ if do_search and query.strip():
                 collection_name=collection,
                 query_vector=qvec,
                 limit=topk,
-                query_filter=qfilter
+                query_filter=qfilter,
+                search_params=build_search_params(cfg.get("quantization"), oversampling=q_oversampling,
+                                                  rescore=q_rescore)
             )
         rows = []
         for h in hits:
@@ -311,11 +361,13 @@ if do_search and query.strip():
                 st.code(qa_prompt_jp)
 
                 with st.spinner("OpenAIに問い合わせ中..."):
-                    oai_client = OpenAI()
-                    oai_resp = oai_client.responses.create(
-                        model="gpt-4o-mini",
-                        input=qa_prompt_jp
-                    )
+                    oai_client = OpenAI(max_retries=0)
+                    oai_resp = get_rate_limit_scheduler().call(
+                        lambda: oai_client.responses.with_raw_response.create(
+                            model="gpt-4o-mini",
+                            input=qa_prompt_jp
+                        ),
+                        model="gpt-4o-mini", tokens=estimate_request_tokens(qa_prompt_jp, "gpt-4o-mini"))
                     generated_answer = getattr(oai_resp, "output_text", None) or ""
 
                 st.markdown("**回答（日本語）**")
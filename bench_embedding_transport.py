@@ -0,0 +1,158 @@
+# bench_embedding_transport.py
+"""
+bench_embedding_transport.py — Embeddings API の encoding_format（float / base64）の転送量とデコード時間の比較
+-----------------------------------------------------------------------------
+ローカルのモック埋め込みサーバ（/v1/embeddings 互換）を起動し、OpenAI SDK から
+同じ入力を float（JSON の数値配列）と base64（float32 バイト列）で要求して
+応答サイズ・リクエスト時間・デコード時間を比較する。OpenAI API は呼ばない。
+
+  - float       : encoding_format="float"。応答の数値配列を JSON パースし、np.asarray で float32 行列にする
+  - sdk-default : encoding_format 未指定。SDK が base64 を要求し、np.frombuffer(...).tolist() で float のリストに戻す
+  - base64      : encoding_format="base64"。helper_embedding.embeddings_to_array で np.frombuffer から直接 float32 行列にする
+
+使い方：
+  python bench_embedding_transport.py
+  python bench_embedding_transport.py --rows 512 --dims 1536 --requests 20
+  python bench_embedding_transport.py --dims 256,1536,3072
+
+主要引数：
+  --rows     : 1リクエストあたりの入力件数（既定 256）
+  --dims     : 埋め込み次元（カンマ区切りで複数、既定 1536）
+  --requests : 方式ごとのリクエスト回数（既定 10）
+"""
+import argparse
+import base64
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Dict, List, Tuple
+
+import numpy as np
+from openai import OpenAI
+
+from helper_embedding import embeddings_to_array
+
+MODES = ("float", "sdk-default", "base64")
+
+
+class MockEmbeddingsHandler(BaseHTTPRequestHandler):
+    """/v1/embeddings を模したハンドラ（encoding_format に応じて float 配列か base64 を返す）"""
+
+    server: "MockEmbeddingsServer"
+
+    def do_POST(self):
+        length = int(self.headers.get("Content-Length", 0))
+        request = json.loads(self.rfile.read(length) or b"{}")
+        inputs = request.get("input") or []
+        if isinstance(inputs, str):
+            inputs = [inputs]
+        dims = int(request.get("dimensions") or self.server.dims)
+        vectors = self.server.vectors(len(inputs), dims)
+        if request.get("encoding_format") == "base64":
+            data = [{"object": "embedding", "index": i, "embedding": base64.b64encode(v.tobytes()).decode("ascii")}
+                    for i, v in enumerate(vectors)]
+        else:
+            data = [{"object": "embedding", "index": i, "embedding": v.tolist()} for i, v in enumerate(vectors)]
+        body = json.dumps({"object": "list", "data": data, "model": request.get("model", "mock"),
+                           "usage": {"prompt_tokens": len(inputs), "total_tokens": len(inputs)}}).encode("utf-8")
+        self.server.bytes_sent += len(body)
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):  # noqa: A002 - BaseHTTPRequestHandler の引数名
+        pass
+
+
+class MockEmbeddingsServer(ThreadingHTTPServer):
+    def __init__(self, dims: int):
+        super().__init__(("127.0.0.1", 0), MockEmbeddingsHandler)
+        self.dims = dims
+        self.bytes_sent = 0
+        self._rng = np.random.default_rng(0)
+        self._cache: Dict[Tuple[int, int], np.ndarray] = {}
+
+    def vectors(self, n: int, dims: int) -> np.ndarray:
+        """正規化済みの乱数ベクトル（同じ形は使い回してサーバ側の生成時間を計測から外す）"""
+        if (n, dims) not in self._cache:
+            v = self._rng.standard_normal((n, dims)).astype(np.float32)
+            self._cache[(n, dims)] = v / np.linalg.norm(v, axis=1, keepdims=True)
+        return self._cache[(n, dims)]
+
+
+def run_mode(client: OpenAI, server: MockEmbeddingsServer, mode: str, texts: List[str], dims: int,
+             requests: int) -> Dict[str, Any]:
+    """1方式を requests 回実行し、平均の応答サイズ・リクエスト時間・デコード時間を返す"""
+    params: Dict[str, Any] = {"model": "text-embedding-3-small", "input": texts, "dimensions": dims}
+    if mode == "float":
+        params["encoding_format"] = "float"
+    elif mode == "base64":
+        params["encoding_format"] = "base64"
+    server.bytes_sent = 0
+    request_seconds = 0.0
+    decode_seconds = 0.0
+    result = None
+    for _ in range(requests):
+        started = time.perf_counter()
+        raw = client.embeddings.with_raw_response.create(**params)
+        resp = raw.parse()  # SDK の JSON パース（sdk-default はここで base64 → float のリスト）
+        parsed = time.perf_counter()
+        if mode == "base64":
+            result = embeddings_to_array(resp.data)
+        else:
+            result = np.asarray([d.embedding for d in resp.data], dtype=np.float32)
+        finished = time.perf_counter()
+        request_seconds += finished - started
+        decode_seconds += finished - parsed
+    return {
+        "bytes"     : server.bytes_sent / requests,
+        "request_ms": request_seconds * 1000 / requests,
+        "decode_ms" : decode_seconds * 1000 / requests,
+        "result"    : result,
+    }
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Compare float vs base64 embedding transport against a local mock server.")
+    ap.add_argument("--rows", type=int, default=256)
+    ap.add_argument("--dims", default="1536", help="Comma-separated embedding dims.")
+    ap.add_argument("--requests", type=int, default=10)
+    args = ap.parse_args()
+
+    texts = [f"sample text {i}" for i in range(args.rows)]
+    rows = []
+    for dims in [int(d) for d in args.dims.split(",") if d.strip()]:
+        server = MockEmbeddingsServer(dims)
+        thread = threading.Thread(target=server.serve_forever, daemon=True)
+        thread.start()
+        try:
+            client = OpenAI(api_key="mock", base_url=f"http://127.0.0.1:{server.server_address[1]}/v1",
+                            max_retries=0)
+            run_mode(client, server, "base64", texts[:1], dims, 1)  # 接続の暖機
+            results = {mode: run_mode(client, server, mode, texts, dims, args.requests) for mode in MODES}
+        finally:
+            server.shutdown()
+            server.server_close()
+        # 方式間でベクトルが一致することを確認（float32 の往復で誤差は出ない）
+        reference = results["float"]["result"]
+        for mode in MODES:
+            if not np.array_equal(results[mode]["result"], reference):
+                raise AssertionError(f"{mode}: decoded vectors differ from the float response")
+        for mode in MODES:
+            rows.append((dims, mode, results[mode], results["float"]))
+
+    print(f"\n=== embeddings transport: {args.rows} rows/request, {args.requests} requests per mode ===")
+    header = f"{'dims':>5} {'mode':<12} {'KB/resp':>9} {'vs float':>8} {'req ms':>8} {'decode ms':>10} {'speedup':>8}"
+    print(header)
+    print("-" * len(header))
+    for dims, mode, res, base in rows:
+        print(f"{dims:>5} {mode:<12} {res['bytes'] / 1024:>9.1f} {res['bytes'] / base['bytes']:>8.2f} "
+              f"{res['request_ms']:>8.1f} {res['decode_ms']:>10.2f} {base['request_ms'] / res['request_ms']:>7.2f}x")
+    print("\nreq ms includes HTTP transfer and SDK JSON parsing; decode ms is the conversion into a float32 matrix.")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,206 @@
+# bench_qdrant_quantization.py
+"""
+bench_qdrant_quantization.py — 量子化方式・埋め込み次元ごとのメモリ見積もりと recall@k の比較
+-----------------------------------------------------------------------------
+登録済みコレクション（既定 qa_corpus）のベクトルを取り出し、(次元, 量子化方式) ごとの
+一時コレクションに投入して、元コレクション（全次元）の厳密検索（exact）に対する recall@k を
+ドメイン別に測定する。
+クエリにはコレクション内のベクトルを使うため OpenAI API は呼ばない。
+次元削減は先頭 dims 次元への切り詰め＋L2正規化で再現する（text-embedding-3 の dimensions 指定と同等）。
+
+使い方：
+  python bench_qdrant_quantization.py
+  python bench_qdrant_quantization.py --variants none,scalar,binary --oversampling 1,2,4 --topk 10
+  python bench_qdrant_quantization.py --max-points 5000 --queries-per-domain 20 --keep
+  python bench_qdrant_quantization.py --dims 1536,768,512,256 --variants none,scalar
+
+主要引数：
+  --collection         : 元コレクション（既定 YAML の rag.collection または 'qa_corpus'）
+  --using              : Named Vectors のキー名（既定は embeddings の先頭）
+  --variants           : 比較する量子化方式（none/scalar/product/binary、カンマ区切り）
+  --oversampling       : 量子化検索の oversampling（カンマ区切りで複数）
+  --dims               : 比較する埋め込み次元（カンマ区切り、既定は元コレクションの次元のみ）
+  --topk               : recall@k の k（既定 10）
+  --max-points         : 取り出す最大ポイント数（既定 20000）
+  --queries-per-domain : ドメインごとのクエリ数（既定 50）
+  --keep               : 一時コレクションを削除しない
+"""
+import argparse
+import random
+import time
+from collections import defaultdict
+from typing import Any, Dict, List, Optional, Tuple
+
+from qdrant_client import QdrantClient
+from qdrant_client.http import models
+
+from a30_qdrant_registration import load_config
+from helper_embedding import truncate_embedding
+from helper_qdrant import QUANTIZATION_TYPES, build_quantization_config, build_search_params, estimate_memory
+
+
+def fetch_points(client: QdrantClient, collection: str, using: Optional[str],
+                 max_points: int) -> List[Tuple[Any, List[float], str]]:
+    """(id, ベクトル, domain) を最大 max_points 件取り出す"""
+    points: List[Tuple[Any, List[float], str]] = []
+    offset = None
+    while len(points) < max_points:
+        records, offset = client.scroll(collection_name=collection, limit=min(1000, max_points - len(points)),
+                                        offset=offset, with_payload=["domain"],
+                                        with_vectors=[using] if using else True)
+        for r in records:
+            vec = r.vector.get(using) if isinstance(r.vector, dict) else r.vector
+            if vec is not None:
+                points.append((r.id, vec, (r.payload or {}).get("domain", "unknown")))
+        if offset is None:
+            break
+    return points
+
+
+def wait_until_indexed(client: QdrantClient, collection: str, timeout: float = 600) -> None:
+    started = time.time()
+    while time.time() - started < timeout:
+        info = client.get_collection(collection)
+        if info.status == models.CollectionStatus.GREEN:
+            return
+        time.sleep(1.0)
+    print(f"[WARN] {collection}: optimizer did not finish within {timeout:.0f}s")
+
+
+def build_bench_collection(client: QdrantClient, name: str, dims: int, qtype: str,
+                           points: List[Tuple[Any, List[float], str]], qcfg: Dict[str, Any]) -> None:
+    client.recreate_collection(
+        collection_name=name,
+        # 量子化ありは原本をディスク、量子化ベクトルをRAMに置く（メモリ見積もりと同じ構成）
+        vectors_config=models.VectorParams(size=dims, distance=models.Distance.COSINE, on_disk=qtype != "none"),
+        quantization_config=build_quantization_config({**qcfg, "type": qtype}),
+    )
+    client.upload_points(
+        collection_name=name,
+        points=[models.PointStruct(id=pid, vector=vec, payload={"domain": domain}) for pid, vec, domain in points],
+        batch_size=256,
+        wait=True,
+    )
+    wait_until_indexed(client, name)
+
+
+def truncate_points(points: List[Tuple[Any, List[float], str]], dims: int) -> List[Tuple[Any, List[float], str]]:
+    """先頭 dims 次元に切り詰めて正規化したポイント列"""
+    if dims >= len(points[0][1]):
+        return points
+    return [(pid, truncate_embedding(vec, dims).tolist(), domain) for pid, vec, domain in points]
+
+
+def run_queries(client: QdrantClient, name: str, queries: List[Tuple[Any, List[float], str]], topk: int,
+                params: models.SearchParams, using: Optional[str] = None) -> Tuple[Dict[Any, List[Any]], float]:
+    """クエリごとの上位IDと平均レイテンシ（ms）。クエリ自身は結果から除く"""
+    results: Dict[Any, List[Any]] = {}
+    started = time.time()
+    for pid, vec, _ in queries:
+        hits = client.search(collection_name=name, query_vector=(using, vec) if using else vec,
+                             limit=topk, search_params=params,
+                             query_filter=models.Filter(must_not=[models.HasIdCondition(has_id=[pid])]))
+        results[pid] = [h.id for h in hits]
+    latency_ms = (time.time() - started) * 1000 / max(1, len(queries))
+    return results, latency_ms
+
+
+def main():
+    cfg = load_config("config.yml")
+    rag_cfg = cfg.get("rag", {})
+    qdrant_cfg = cfg.get("qdrant", {}) or {}
+    qcfg = cfg.get("quantization", {}) or {}
+
+    ap = argparse.ArgumentParser(description="Benchmark memory vs recall@k for Qdrant quantization settings.")
+    ap.add_argument("--collection", default=rag_cfg.get("collection", "qa_corpus"))
+    ap.add_argument("--qdrant-url", default=qdrant_cfg.get("url", "http://localhost:6333"))
+    ap.add_argument("--using", default=None)
+    ap.add_argument("--variants", default="none,scalar,product,binary")
+    ap.add_argument("--oversampling", default="1,2,4")
+    ap.add_argument("--dims", default=None, help="Comma-separated reduced dims to compare (default: source dims).")
+    ap.add_argument("--topk", type=int, default=10)
+    ap.add_argument("--max-points", type=int, default=20000)
+    ap.add_argument("--queries-per-domain", type=int, default=50)
+    ap.add_argument("--seed", type=int, default=42)
+    ap.add_argument("--keep", action="store_true", help="Keep the temporary benchmark collections.")
+    args = ap.parse_args()
+
+    variants = [v.strip() for v in args.variants.split(",") if v.strip()]
+    for v in variants:
+        if v not in QUANTIZATION_TYPES:
+            raise ValueError(f"Unknown variant '{v}'. Must be one of {QUANTIZATION_TYPES}")
+    oversamplings = [float(x) for x in args.oversampling.split(",") if x.strip()]
+
+    client = QdrantClient(url=args.qdrant_url, timeout=300)
+    info = client.get_collection(args.collection)
+    vectors = info.config.params.vectors
+    using = args.using
+    if isinstance(vectors, dict):
+        using = using or next(iter(vectors))
+        dims = vectors[using].size
+    else:
+        using = None
+        dims = vectors.size
+
+    print(f"[INFO] Fetching up to {args.max_points} vectors from {args.collection} (using={using or 'default'})...")
+    points = fetch_points(client, args.collection, using, args.max_points)
+    if not points:
+        print("[ERROR] No vectors found.")
+        return
+    by_domain: Dict[str, List[Tuple[Any, List[float], str]]] = defaultdict(list)
+    for p in points:
+        by_domain[p[2]].append(p)
+    rng = random.Random(args.seed)
+    queries = {d: rng.sample(ps, min(args.queries_per_domain, len(ps))) for d, ps in sorted(by_domain.items())}
+    print(f"[INFO] {len(points)} points, dims={dims}, domains={', '.join(f'{d}:{len(ps)}' for d, ps in sorted(by_domain.items()))}")
+
+    # 正解：元コレクション（全次元）の厳密検索
+    exact = build_search_params(exact=True)
+    truth = {d: run_queries(client, args.collection, qs, args.topk, exact, using=using)[0] for d, qs in queries.items()}
+
+    dims_list = [int(x) for x in args.dims.split(",")] if args.dims else [dims]
+    for d in dims_list:
+        if d > dims:
+            raise ValueError(f"--dims {d} exceeds source dims {dims}")
+    rows = []
+    for bench_dims in dims_list:
+        bench_points = truncate_points(points, bench_dims)
+        bench_queries = {d: truncate_points(qs, bench_dims) for d, qs in queries.items()}
+        for variant in variants:
+            name = f"{args.collection}_bench_{bench_dims}_{variant}"
+            print(f"\n[Bench] dims={bench_dims} {variant}: building {name} ...")
+            build_bench_collection(client, name, bench_dims, variant, bench_points, qcfg)
+            mem = estimate_memory(len(points), bench_dims, variant, qcfg.get("product_compression", "x16"),
+                                  on_disk_vectors=variant != "none", always_ram=True)
+            settings = [(None, None)] if variant == "none" else [(o, True) for o in oversamplings] + [(1.0, False)]
+            for oversampling, rescore in settings:
+                params = build_search_params({**qcfg, "type": variant}, oversampling=oversampling, rescore=rescore)
+                recalls = {}
+                latencies = []
+                for d, qs in bench_queries.items():
+                    approx, latency_ms = run_queries(client, name, qs, args.topk, params)
+                    latencies.append(latency_ms)
+                    hit = sum(len(set(approx[pid]) & set(truth[d][pid])) for pid, _, _ in qs)
+                    total = sum(len(truth[d][pid]) for pid, _, _ in qs)
+                    recalls[d] = hit / total if total else 0.0
+                rows.append((bench_dims, variant, oversampling, rescore, mem, recalls,
+                             sum(latencies) / len(latencies)))
+            if not args.keep:
+                client.delete_collection(name)
+
+    print(f"\n=== recall@{args.topk} (vs exact {dims}-dim search) vs latency vs memory ({len(points)} points) ===")
+    domains = list(queries.keys())
+    header = f"{'dims':>5} {'variant':<8} {'overs.':>6} {'rescore':>7} {'RAM MB':>8} {'disk MB':>8} {'ms/q':>6} " + \
+             " ".join(f"{d[:8]:>8}" for d in domains) + f" {'mean':>6}"
+    print(header)
+    print("-" * len(header))
+    for bench_dims, variant, oversampling, rescore, mem, recalls, latency in rows:
+        mean = sum(recalls.values()) / len(recalls) if recalls else 0.0
+        print(f"{bench_dims:>5} {variant:<8} {oversampling or '-':>6} {('-' if rescore is None else str(rescore)):>7} "
+              f"{mem['ram_bytes'] / 2 ** 20:>8.1f} {mem['disk_bytes'] / 2 ** 20:>8.1f} {latency:>6.1f} "
+              + " ".join(f"{recalls[d]:>8.3f}" for d in domains) + f" {mean:>6.3f}")
+    print("\nRAM/disk are estimates for the quantized variants with on_disk originals "
+          "(helper_qdrant.estimate_memory); 'none' keeps float32 vectors in RAM.")
+
+if __name__ == "__main__":
+    main()
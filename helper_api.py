@@ -5,21 +5,24 @@ import re
 import time
 import json
 import logging
+import threading
 import logging.handlers
 from logging import Logger
 
 import yaml
 import os
-from typing import List, Dict, Any, Optional, Union, Tuple, Literal, Callable
+from typing import List, Dict, Any, Optional, Union, Tuple, Literal, Callable, Iterator, Sequence
 from pathlib import Path
 from dataclasses import dataclass
 from functools import wraps
 from datetime import datetime
 from abc import ABC, abstractmethod
 import hashlib
+import random
 
+import numpy as np
 import tiktoken
-from openai import OpenAI
+from openai import OpenAI, APIConnectionError, APIStatusError
 
 # -----------------------------------------------------
 # OpenAI API型定義
@@ -536,6 +539,9 @@ class TokenManager:
         "o3-mini"                  : "cl100k_base",
         "o4"                       : "cl100k_base",
         "o4-mini"                  : "cl100k_base",
+        "text-embedding-3-small"   : "cl100k_base",
+        "text-embedding-3-large"   : "cl100k_base",
+        "text-embedding-ada-002"   : "cl100k_base",
     }
 
     @classmethod
@@ -606,6 +612,449 @@ class TokenManager:
         return limits.get(model, {"max_tokens": 128000, "max_output": 4096})
 
 
+# ==================================================
+# 埋め込みリクエストのバッチ詰め（トークン予算）
+# ==================================================
+class EmbeddingBatchPacker:
+    """tiktoken のトークン数で Embeddings リクエストを詰めるバッチャー（TokenManager のエンコーディング表を利用）
+
+    - 1リクエストが max_batch_tokens / max_batch_items を超えない範囲で入力をまとめる
+    - 1入力が max_input_tokens を超える場合は overflow ポリシーに従う
+        truncate: 先頭 max_input_tokens トークンに切り詰め
+        split   : max_input_tokens ごとに分割して埋め込み、トークン数加重平均で1ベクトルに合成
+        error   : ValueError
+    - requests / items / tokens を集計し report() で requests/sec, tokens/request を返す
+    - segments() の結果を pack() / embed() に渡すと、各テキストのトークン化は1回で済む
+    """
+
+    # OpenAI Embeddings API の上限
+    MAX_INPUT_TOKENS = 8191
+    MAX_BATCH_ITEMS = 2048
+    MAX_BATCH_TOKENS = 300000
+
+    OVERFLOW_POLICIES = ("truncate", "split", "error")
+
+    def __init__(self, model: str, max_batch_tokens: int = 100000, max_batch_items: int = 512,
+                 max_input_tokens: int = MAX_INPUT_TOKENS, overflow: str = "truncate"):
+        if overflow not in self.OVERFLOW_POLICIES:
+            raise ValueError(f"Invalid overflow policy: {overflow}. Must be one of {self.OVERFLOW_POLICIES}")
+        self.model = model
+        self.max_batch_tokens = max(1, min(max_batch_tokens, self.MAX_BATCH_TOKENS))
+        self.max_batch_items = max(1, min(max_batch_items, self.MAX_BATCH_ITEMS))
+        self.max_input_tokens = max(1, min(max_input_tokens, self.MAX_INPUT_TOKENS, self.max_batch_tokens))
+        self.overflow = overflow
+        self.encoding = tiktoken.get_encoding(TokenManager.MODEL_ENCODINGS.get(model, "cl100k_base"))
+        self._lock = threading.Lock()
+        self.requests = 0
+        self.items = 0
+        self.tokens = 0
+        self.truncated = 0
+        self.split = 0
+        self._first_request: Optional[float] = None
+        self._last_response: Optional[float] = None
+
+    def prepare(self, text: str) -> List[Tuple[str, int]]:
+        """1入力を (送信テキスト, トークン数) のセグメント列に変換（overflow ポリシー適用）"""
+        return self._segments(text)[0]
+
+    def segments(self, texts: Sequence[str]) -> List[List[Tuple[str, int]]]:
+        """各入力のセグメント列（pack / embed の segments に渡して再トークン化を避ける）"""
+        return [self.prepare(text) for text in texts]
+
+    def _segments(self, text: str) -> Tuple[List[Tuple[str, int]], bool]:
+        tokens = self.encoding.encode(text, disallowed_special=())
+        n = len(tokens)
+        if n <= self.max_input_tokens:
+            return [(text, max(1, n))], False
+        if self.overflow == "error":
+            raise ValueError(f"Input exceeds {self.max_input_tokens} tokens ({n} tokens)")
+        if self.overflow == "truncate":
+            return [(self.encoding.decode(tokens[:self.max_input_tokens]), self.max_input_tokens)], True
+        step = self.max_input_tokens
+        return [(self.encoding.decode(tokens[i:i + step]), len(tokens[i:i + step])) for i in range(0, n, step)], True
+
+    def pack(self, texts: Sequence[str],
+             segments: Optional[Sequence[List[Tuple[str, int]]]] = None) -> Iterator[List[int]]:
+        """texts のインデックスを、1リクエストの予算に収まるグループに分けて順に返す
+
+        segments: segments(texts) の結果（省略時はここでトークン化する）
+        """
+        if segments is None:
+            segments = self.segments(texts)
+        group: List[int] = []
+        group_tokens = 0
+        group_items = 0
+        for i, text_segments in enumerate(segments):
+            tokens = sum(n for _, n in text_segments)
+            items = len(text_segments)
+            if group and (group_tokens + tokens > self.max_batch_tokens or group_items + items > self.max_batch_items):
+                yield group
+                group, group_tokens, group_items = [], 0, 0
+            group.append(i)
+            group_tokens += tokens
+            group_items += items
+        if group:
+            yield group
+
+    def embed(self, texts: Sequence[str], embed_fn: Callable[..., Sequence[Sequence[float]]],
+              segments: Optional[Sequence[Optional[List[Tuple[str, int]]]]] = None,
+              with_tokens: bool = False) -> Any:
+        """texts を予算内のリクエストに分けて embed_fn で埋め込み、入力順のベクトル列を返す
+
+        embed_fn が np.ndarray を返す場合は (len(texts), dims) の float32 行列に直接書き込んで返す
+        segments: texts と同順のセグメント列（None の要素・省略時はここでトークン化する）
+        with_tokens=True の場合は embed_fn(inputs, tokens) でリクエストのトークン数も渡す（TPM 予約用）
+        """
+        if segments is None:
+            segments = [None] * len(texts)
+        segments = [segs if segs is not None else self.prepare(text) for text, segs in zip(texts, segments)]
+        results: List[Optional[List[float]]] = [None] * len(texts)
+        out: Optional[np.ndarray] = None
+        for group in self.pack(texts, segments):
+            owners: List[int] = []
+            weights: List[int] = []
+            inputs: List[str] = []
+            overflowed = 0
+            for i in group:
+                # 2つ以上に分割された、または切り詰められた入力
+                overflowed += len(segments[i]) > 1 or segments[i][0][0] != texts[i]
+                for segment, n in segments[i]:
+                    owners.append(i)
+                    weights.append(n)
+                    inputs.append(segment)
+
+            with self._lock:
+                if self._first_request is None:
+                    self._first_request = time.time()
+            vectors = embed_fn(inputs, sum(weights)) if with_tokens else embed_fn(inputs)
+            with self._lock:
+                self._last_response = time.time()
+                self.requests += 1
+                self.items += len(inputs)
+                self.tokens += sum(weights)
+                if self.overflow == "truncate":
+                    self.truncated += overflowed
+                else:
+                    self.split += overflowed
+
+            if isinstance(vectors, np.ndarray):
+                if out is None:
+                    out = np.empty((len(texts), vectors.shape[1]), dtype=np.float32)
+                if len(inputs) == len(group):
+                    out[group] = vectors
+                    continue
+                # 分割された入力はトークン数加重平均で合成（L2正規化）
+                owner_idx = np.asarray(owners)
+                weight_arr = np.asarray(weights, dtype=np.float32)[:, None]
+                for owner in group:
+                    rows = owner_idx == owner
+                    merged = (vectors[rows] * weight_arr[rows]).sum(axis=0) / weight_arr[rows].sum()
+                    out[owner] = merged / (np.linalg.norm(merged) or 1.0)
+                continue
+
+            # 分割された入力はトークン数加重平均で合成（L2正規化）
+            pending: Dict[int, List[Tuple[Sequence[float], int]]] = {}
+            for owner, weight, vec in zip(owners, weights, vectors):
+                pending.setdefault(owner, []).append((vec, weight))
+            for owner, parts in pending.items():
+                if len(parts) == 1:
+                    results[owner] = list(parts[0][0])
+                    continue
+                total = sum(w for _, w in parts)
+                merged = [sum(v[d] * w for v, w in parts) / total for d in range(len(parts[0][0]))]
+                norm = sum(x * x for x in merged) ** 0.5 or 1.0
+                results[owner] = [x / norm for x in merged]
+        if out is not None:
+            return out
+        return results  # type: ignore[return-value]
+
+    def report(self) -> Dict[str, Any]:
+        """送信統計（リクエスト数・トークン数・requests/sec・tokens/request）"""
+        with self._lock:
+            elapsed = (self._last_response - self._first_request) if self._first_request and self._last_response else 0.0
+            return {
+                "requests"          : self.requests,
+                "items"             : self.items,
+                "tokens"            : self.tokens,
+                "tokens_per_request": self.tokens / self.requests if self.requests else 0.0,
+                "items_per_request" : self.items / self.requests if self.requests else 0.0,
+                "requests_per_sec"  : self.requests / elapsed if elapsed > 0 else 0.0,
+                "truncated_inputs"  : self.truncated,
+                "split_inputs"      : self.split,
+            }
+
+
+# ==================================================
+# レート制限スケジューラ（RPM/TPM・AIMD並行数制御）
+# ==================================================
+def _parse_reset_seconds(value: Optional[str]) -> Optional[float]:
+    """x-ratelimit-reset-* ヘッダ（例: '1s', '6m0s', '20ms'）を秒に変換"""
+    if not value:
+        return None
+    units = {"ms": 0.001, "s": 1.0, "m": 60.0, "h": 3600.0}
+    parts = re.findall(r"(\d+(?:\.\d+)?)(ms|s|m|h)", value)
+    if not parts:
+        try:
+            return float(value)
+        except ValueError:
+            return None
+    return sum(float(num) * units[unit] for num, unit in parts)
+
+
+class _RateBucket:
+    """1分あたりの上限（RPM または TPM）を表すトークンバケット
+
+    上限はレスポンスヘッダ（x-ratelimit-limit-*）を観測するまで未知（= 制限しない）
+    """
+
+    def __init__(self):
+        self.limit: Optional[float] = None
+        self.available = 0.0
+        self.updated = time.monotonic()
+
+    def _refill(self, now: float) -> None:
+        if self.limit:
+            self.available = min(self.limit, self.available + (now - self.updated) * self.limit / 60.0)
+        self.updated = now
+
+    def wait_time(self, amount: float, now: float) -> float:
+        """amount を消費できるまでの待ち時間（秒）"""
+        if not self.limit:
+            return 0.0
+        self._refill(now)
+        amount = min(amount, self.limit)
+        if self.available >= amount:
+            return 0.0
+        return (amount - self.available) * 60.0 / self.limit
+
+    def consume(self, amount: float) -> None:
+        if self.limit:
+            self.available -= min(amount, self.limit)
+
+    def sync(self, limit: Optional[str], remaining: Optional[str], now: float) -> None:
+        """レスポンスヘッダの上限・残量でバケットを補正"""
+        try:
+            limit_value = float(limit) if limit else None
+            remaining_value = float(remaining) if remaining else None
+        except ValueError:
+            return
+        if limit_value:
+            if not self.limit:
+                self.available = limit_value
+            self._refill(now)
+            self.limit = limit_value
+        if remaining_value is not None and self.limit:
+            self.available = min(self.available, remaining_value)
+
+
+class RateLimitScheduler:
+    """OpenAI API 呼び出しの共通スケジューラ
+
+    - モデルごとに RPM / TPM のトークンバケットを持ち、x-ratelimit-* ヘッダで上限と残量を補正
+    - 429 / 5xx / 接続エラーは指数バックオフ＋ジッタで再試行（retry-after を優先）
+      429 の場合は同じモデルの他スレッドも retry-after まで待機させる
+    - 同時実行数は AIMD で調整（成功ごとに +1/limit、429・レイテンシ悪化で乗算的に減少）
+
+    呼び出し側は SDK の自動リトライを無効化したクライアントを使い、
+    raw レスポンス（with_raw_response）を返す関数を渡すとヘッダを読み取れる:
+
+        scheduler.call(lambda: client.with_options(max_retries=0).embeddings.with_raw_response.create(...),
+                       model="text-embedding-3-small", tokens=estimate)
+    """
+
+    RETRYABLE_STATUS = (408, 409, 429, 500, 502, 503, 504)
+
+    def __init__(self, initial_concurrency: int = 4, min_concurrency: int = 1, max_concurrency: int = 32,
+                 max_retries: int = 6, base_delay: float = 0.5, max_delay: float = 60.0,
+                 latency_factor: float = 2.0, decrease_factor: float = 0.5):
+        self.min_concurrency = max(1, min_concurrency)
+        self.max_concurrency = max(self.min_concurrency, max_concurrency)
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.latency_factor = latency_factor
+        self.decrease_factor = decrease_factor
+        self._limit = float(min(max(initial_concurrency, self.min_concurrency), self.max_concurrency))
+        self._in_flight = 0
+        self._cond = threading.Condition()
+        self._buckets: Dict[str, Tuple[_RateBucket, _RateBucket]] = {}
+        self._paused_until: Dict[str, float] = {}
+        self._latency: Dict[str, Tuple[float, float]] = {}  # model -> (最小レイテンシ, EWMA)
+        self._last_decrease = 0.0
+        self.requests = 0
+        self.retries = 0
+        self.throttled = 0
+        self.wait_seconds = 0.0
+
+    @property
+    def concurrency(self) -> int:
+        return int(self._limit)
+
+    def _acquire(self, model: str, tokens: float) -> None:
+        """並行数枠と RPM/TPM 予算を確保するまで待機"""
+        start = time.monotonic()
+        with self._cond:
+            rpm, tpm = self._buckets.setdefault(model, (_RateBucket(), _RateBucket()))
+            while True:
+                now = time.monotonic()
+                wait = 0.0
+                if self._in_flight < int(self._limit):
+                    wait = max(self._paused_until.get(model, 0.0) - now,
+                               rpm.wait_time(1, now), tpm.wait_time(tokens, now))
+                    if wait <= 0:
+                        rpm.consume(1)
+                        tpm.consume(tokens)
+                        self._in_flight += 1
+                        break
+                self._cond.wait(timeout=wait if wait > 0 else None)
+            self.wait_seconds += time.monotonic() - start
+
+    def _release(self) -> None:
+        with self._cond:
+            self._in_flight -= 1
+            self._cond.notify_all()
+
+    def _decrease(self, now: float) -> None:
+        """乗算的減少（同じ輻輳で何度も下げないよう直近の減少から1秒は無視）"""
+        with self._cond:
+            if now - self._last_decrease < 1.0:
+                return
+            self._last_decrease = now
+            self._limit = max(float(self.min_concurrency), self._limit * self.decrease_factor)
+            logger.info(f"API同時実行数を縮小: {self.concurrency}")
+
+    def _on_success(self, model: str, latency: float, headers: Any) -> None:
+        now = time.monotonic()
+        with self._cond:
+            self.requests += 1
+            if headers is not None:
+                rpm, tpm = self._buckets[model]
+                rpm.sync(headers.get("x-ratelimit-limit-requests"), headers.get("x-ratelimit-remaining-requests"), now)
+                tpm.sync(headers.get("x-ratelimit-limit-tokens"), headers.get("x-ratelimit-remaining-tokens"), now)
+            floor, ewma = self._latency.get(model, (latency, latency))
+            floor = min(floor, latency)
+            ewma = 0.8 * ewma + 0.2 * latency
+            self._latency[model] = (floor, ewma)
+            congested = ewma > floor * self.latency_factor and ewma - floor > 0.5
+            if not congested:
+                self._limit = min(float(self.max_concurrency), self._limit + 1.0 / self._limit)
+                self._cond.notify_all()
+        if congested:
+            self._decrease(now)
+
+    def _retry_delay(self, attempt: int, error: Exception) -> float:
+        """retry-after ヘッダ優先、無ければ指数バックオフ（フルジッタ）"""
+        response = getattr(error, "response", None)
+        headers = getattr(response, "headers", None) or {}
+        retry_after = headers.get("retry-after-ms")
+        if retry_after:
+            try:
+                return min(self.max_delay, float(retry_after) / 1000.0)
+            except ValueError:
+                pass
+        retry_after = _parse_reset_seconds(headers.get("retry-after"))
+        if retry_after is not None:
+            return min(self.max_delay, retry_after)
+        return random.uniform(0, min(self.max_delay, self.base_delay * (2 ** attempt)))
+
+    def call(self, fn: Callable[[], Any], model: str = "default", tokens: float = 0) -> Any:
+        """fn を RPM/TPM・同時実行数の範囲内で実行し、再試行可能なエラーはバックオフして再実行
+
+        fn が raw レスポンス（headers と parse() を持つ）を返した場合はヘッダを取り込み parse() の結果を返す
+        """
+        attempt = 0
+        while True:
+            self._acquire(model, tokens)
+            start = time.monotonic()
+            try:
+                result = fn()
+            except (APIStatusError, APIConnectionError) as e:
+                self._release()
+                status = getattr(e, "status_code", None)
+                if status is not None and status not in self.RETRYABLE_STATUS:
+                    raise
+                if getattr(e, "code", None) == "insufficient_quota":  # 課金上限は待っても回復しない
+                    raise
+                if attempt >= self.max_retries:
+                    raise
+                delay = self._retry_delay(attempt, e)
+                now = time.monotonic()
+                with self._cond:
+                    self.retries += 1
+                    if status == 429:
+                        self.throttled += 1
+                        self._paused_until[model] = max(self._paused_until.get(model, 0.0), now + delay)
+                self._decrease(now)
+                logger.warning(f"API再試行 {attempt + 1}/{self.max_retries} ({model}, status={status}): {delay:.2f}秒後")
+                time.sleep(delay)
+                attempt += 1
+                continue
+            except Exception:
+                self._release()
+                raise
+            latency = time.monotonic() - start
+            self._release()
+            headers = getattr(result, "headers", None)
+            self._on_success(model, latency, headers)
+            if headers is not None and callable(getattr(result, "parse", None)):
+                return result.parse()
+            return result
+
+    def stats(self) -> Dict[str, Any]:
+        """リクエスト数・再試行数・429回数・現在の同時実行数・待機時間・モデル別上限"""
+        with self._cond:
+            return {
+                "requests"    : self.requests,
+                "retries"     : self.retries,
+                "throttled"   : self.throttled,
+                "concurrency" : self.concurrency,
+                "wait_seconds": self.wait_seconds,
+                "limits"      : {m: {"rpm": r.limit, "tpm": t.limit} for m, (r, t) in self._buckets.items()},
+            }
+
+
+_scheduler: Optional[RateLimitScheduler] = None
+_scheduler_lock = threading.Lock()
+
+
+def get_rate_limit_scheduler() -> RateLimitScheduler:
+    """プロセス共通のスケジューラ（config.yml の rate_limit セクションで初期化）"""
+    global _scheduler
+    with _scheduler_lock:
+        if _scheduler is None:
+            _scheduler = RateLimitScheduler(
+                initial_concurrency=config.get("rate_limit.initial_concurrency", 4),
+                min_concurrency=config.get("rate_limit.min_concurrency", 1),
+                max_concurrency=config.get("rate_limit.max_concurrency", 32),
+                max_retries=config.get("rate_limit.max_retries", 6),
+                base_delay=config.get("rate_limit.base_delay", 0.5),
+                max_delay=config.get("rate_limit.max_delay", 60.0),
+            )
+        return _scheduler
+
+
+_request_encodings: Dict[str, Any] = {}
+
+
+def estimate_request_tokens(texts: Union[str, Sequence[str]], model: str = "text-embedding-3-small") -> int:
+    """スケジューラの TPM 予約に使う入力トークン数（tiktoken で数える）
+
+    日本語は1文字が1〜3トークンになるため文字数では過小になる。
+    tiktoken を使えない場合は UTF-8 のバイト数（バイトレベル BPE のトークン数の上限）で見積もる
+    """
+    if isinstance(texts, str):
+        texts = [texts]
+    encoding_name = TokenManager.MODEL_ENCODINGS.get(model, "cl100k_base")
+    try:
+        if encoding_name not in _request_encodings:
+            _request_encodings[encoding_name] = tiktoken.get_encoding(encoding_name)
+        enc = _request_encodings[encoding_name]
+        return sum(len(enc.encode_ordinary(t)) for t in texts)
+    except Exception as e:
+        logger.warning(f"トークン数をバイト数で見積もります: {e}")
+        return sum(len(t.encode("utf-8")) for t in texts)
+
+
 # ==================================================
 # レスポンス処理
 # ==================================================
@@ -817,6 +1266,8 @@ __all__ = [
     'ConfigManager',
     'MessageManager',
     'TokenManager',
+    'EmbeddingBatchPacker',
+    'RateLimitScheduler',
     'ResponseProcessor',
     'OpenAIClient',
     'MemoryCache',
@@ -827,6 +1278,8 @@ __all__ = [
     'cache_result',
 
     # ユーティリティ
+    'get_rate_limit_scheduler',
+    'estimate_request_tokens',
     'sanitize_key',
     'load_json_file',
     'save_json_file',
@@ -0,0 +1,164 @@
+# helper_chunk.py
+# トークン数基準のテキストチャンク分割（Vector Store 登録用）
+# -----------------------------------------
+# - chunk_text_tokens: 1本のテキストを tiktoken のトークン数でチャンクに分割（文境界優先・O(n)・決定的）
+# - chunk_texts: 複数行をプロセスプールで並行に分割（入力順を保持）
+# - make_chunk_pool: chunk_texts に渡して使い回すプロセスプール（起動と tiktoken の読み込みは1回だけ）
+# a02_set_vector_store_vsid.py の VectorStoreProcessor.chunk_text から利用する
+import logging
+import os
+import re
+from concurrent.futures import ProcessPoolExecutor
+from typing import Callable, List, Optional, Sequence, Tuple
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_ENCODING = "cl100k_base"  # text-embedding-3 / file_search と同じエンコーディング
+MIN_PARALLEL_ROWS = 2000  # これ未満の行数はプロセスプールを使わない（起動・転送のコストが上回る）
+
+# 文境界（日本語の句点・感嘆符・疑問符＋閉じ括弧、英語の終止符＋空白、改行）を1回の走査で検出する
+_BOUNDARY = re.compile(r"[。！？!?．]+[」』）)\"']*|\.(?=\s)|\n+")
+
+_encoders = {}
+
+
+def _get_encoder(encoding: str):
+    """tiktoken のエンコーダ（プロセスごとに1回だけ読み込む。無ければ None）"""
+    if encoding not in _encoders:
+        try:
+            import tiktoken
+            _encoders[encoding] = tiktoken.get_encoding(encoding)
+        except Exception as e:
+            logger.warning(f"tiktoken を利用できないため文字数で分割します: {e}")
+            _encoders[encoding] = None
+    return _encoders[encoding]
+
+
+def split_sentences(text: str) -> List[str]:
+    """文境界で分割（区切り文字は直前の文に含める。連結すると元のテキストに戻る）"""
+    sentences = []
+    start = 0
+    for m in _BOUNDARY.finditer(text):
+        sentences.append(text[start:m.end()])
+        start = m.end()
+    if start < len(text):
+        sentences.append(text[start:])
+    return sentences
+
+
+def _split_long(sentence: str, max_tokens: int, encoder) -> List[Tuple[str, int]]:
+    """max_tokens を超える1文をトークン境界で分割（文字位置で切るので文字化けしない）"""
+    if encoder is None:
+        return [(sentence[i:i + max_tokens], len(sentence[i:i + max_tokens]))
+                for i in range(0, len(sentence), max_tokens)]
+    tokens = encoder.encode_ordinary(sentence)
+    _, offsets = encoder.decode_with_offsets(tokens)
+    pieces = []
+    for i in range(0, len(tokens), max_tokens):
+        start = offsets[i]
+        end = offsets[i + max_tokens] if i + max_tokens < len(tokens) else len(sentence)
+        if end > start:
+            pieces.append((sentence[start:end], min(max_tokens, len(tokens) - i)))
+    return pieces
+
+
+def chunk_text_tokens(text: str, max_tokens: int = 800, overlap_tokens: int = 100,
+                      encoding: str = DEFAULT_ENCODING) -> List[str]:
+    """テキストを最大 max_tokens トークンのチャンクに分割する
+
+    - 文境界で区切り、文を貪欲に詰める。1文が max_tokens を超える場合だけトークン境界で切る
+    - 直前のチャンク末尾の文を overlap_tokens 以内で次のチャンクの先頭に重ねる
+    - 各文のトークン化は1回、チャンクの開始位置は必ず前進するため全体で O(n)
+    - 同じ入力・パラメータなら常に同じチャンクを返す（キャッシュ可能）
+    """
+    if max_tokens <= 0:
+        raise ValueError(f"max_tokens must be positive: {max_tokens}")
+    overlap_tokens = max(0, min(overlap_tokens, max_tokens // 2))
+    encoder = _get_encoder(encoding)
+    count: Callable[[str], int] = (lambda s: len(encoder.encode_ordinary(s))) if encoder is not None else len
+
+    units: List[Tuple[str, int]] = []
+    for sentence in split_sentences(text):
+        n = count(sentence)
+        if n > max_tokens:
+            units.extend(_split_long(sentence, max_tokens, encoder))
+        elif sentence:
+            units.append((sentence, n))
+    if not units:
+        return []
+
+    chunks: List[str] = []
+    start = 0
+    while start < len(units):
+        end = start
+        total = 0
+        while end < len(units) and total + units[end][1] <= max_tokens:
+            total += units[end][1]
+            end += 1
+        chunk = "".join(u[0] for u in units[start:end]).strip()
+        if chunk:
+            chunks.append(chunk)
+        if end >= len(units):
+            break
+        # 末尾の文を overlap_tokens 以内で重ねる（少なくとも1文は前進させる）
+        next_start = end
+        carried = 0
+        while next_start - 1 > start and carried + units[next_start - 1][1] <= overlap_tokens:
+            next_start -= 1
+            carried += units[next_start][1]
+        start = next_start
+    return chunks
+
+
+def _chunk_worker(args: Tuple[str, int, int, str]) -> List[str]:
+    return chunk_text_tokens(*args)
+
+
+def make_chunk_pool(workers: Optional[int] = None,
+                    encoding: str = DEFAULT_ENCODING) -> Optional[ProcessPoolExecutor]:
+    """chunk_texts に渡すプロセスプール（workers <= 1 なら None。各ワーカーは起動時にエンコーダを読み込む）
+
+    呼び出し側がファイル単位などで使い回し、最後に shutdown する
+    """
+    workers = workers if workers is not None else (os.cpu_count() or 1)
+    if workers <= 1:
+        return None
+    return ProcessPoolExecutor(max_workers=workers, initializer=_get_encoder, initargs=(encoding,))
+
+
+def chunk_texts(texts: Sequence[str], max_tokens: int = 800, overlap_tokens: int = 100,
+                encoding: str = DEFAULT_ENCODING, workers: Optional[int] = None,
+                min_parallel_rows: int = MIN_PARALLEL_ROWS,
+                pool: Optional[ProcessPoolExecutor] = None) -> List[List[str]]:
+    """複数行を分割し、行ごとのチャンク列を入力順で返す
+
+    行数が min_parallel_rows 以上のとき、pool（make_chunk_pool）があればそれを使って並行に分割する。
+    pool が無く workers > 1 の場合はこの呼び出しだけのプールを作る（繰り返し呼ぶ場合は pool を渡すこと）
+    """
+    tasks = [(t, max_tokens, overlap_tokens, encoding) for t in texts]
+    if len(tasks) < min_parallel_rows:
+        return [_chunk_worker(t) for t in tasks]
+    own_pool = None
+    if pool is None:
+        own_pool = pool = make_chunk_pool(workers, encoding)
+        if pool is None:
+            return [_chunk_worker(t) for t in tasks]
+    workers = workers if workers is not None else (os.cpu_count() or 1)
+    try:
+        return list(pool.map(_chunk_worker, tasks, chunksize=max(1, len(tasks) // (max(1, workers) * 8))))
+    finally:
+        if own_pool is not None:
+            own_pool.shutdown()
+
+
+# ==================================================
+# エクスポート
+# ==================================================
+__all__ = [
+    'DEFAULT_ENCODING',
+    'MIN_PARALLEL_ROWS',
+    'split_sentences',
+    'chunk_text_tokens',
+    'chunk_texts',
+    'make_chunk_pool',
+]
@@ -0,0 +1,165 @@
+# helper_dedup.py
+# 埋め込み前の重複・近似重複の除去
+# -----------------------------------------
+# - canonical_text: NFKC 正規化・小文字化・空白/句読点の除去（全角/半角・表記ゆれの吸収）
+# - NearDuplicateFilter: 正規化テキストの完全一致ハッシュ + MinHash/LSH による近似重複の検出（ストリーミング）
+# a30_qdrant_registration.py / qdrant_data_loader.py / a02_set_vector_store_vsid.py から利用する
+import hashlib
+import logging
+import random
+import unicodedata
+from typing import Any, Callable, Dict, List, Optional, Sequence
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_DEDUP = {
+    "enabled": False,      # 既定は無効（config.yml の dedup.enabled / --dedup で有効にする）
+    "near": True,          # False: 正規化テキストの完全一致のみ除去
+    "threshold": 0.9,      # 近似重複とみなす推定 Jaccard 類似度（文字 shingle）
+    "num_perm": 64,        # MinHash の置換数
+    "bands": 16,           # LSH のバンド数（num_perm を割り切ること）
+    "shingle": 5,          # 文字 n-gram の長さ
+    "min_chars": 20,       # これより短い正規化テキストは完全一致のみで判定（短文は誤判定しやすい）
+}
+
+_MERSENNE_PRIME = (1 << 31) - 1
+
+
+# ==================================================
+# 正規化
+# ==================================================
+def canonical_text(text: str) -> str:
+    """重複判定用の正規化（NFKC → 小文字化 → 空白・句読点・記号を除去）"""
+    text = unicodedata.normalize("NFKC", str(text)).lower()
+    return "".join(ch for ch in text if not ch.isspace() and unicodedata.category(ch)[0] not in ("P", "S"))
+
+
+def _default_token_counter() -> Callable[[str], int]:
+    try:
+        import tiktoken
+        encoding = tiktoken.get_encoding("cl100k_base")
+        return lambda text: len(encoding.encode(text))
+    except Exception:
+        # tiktoken が無い場合は文字数で概算（日本語はおおむね1文字1トークン）
+        return len
+
+
+# ==================================================
+# 近似重複フィルタ
+# ==================================================
+class NearDuplicateFilter:
+    """完全一致（正規化後）+ MinHash/LSH で重複を判定するストリーミングフィルタ
+
+    先に出現したテキストを残し、後から来た重複を落とす（drop_duplicates と同じく先勝ち）。
+    LSH の候補は保存済みシグネチャの一致率（推定 Jaccard）が threshold 以上のときだけ重複とする。
+    """
+
+    def __init__(self, threshold: float = 0.9, num_perm: int = 64, bands: int = 16, shingle: int = 5,
+                 near: bool = True, min_chars: int = 20, seed: int = 1,
+                 count_tokens: Optional[Callable[[str], int]] = None):
+        if num_perm % bands:
+            raise ValueError(f"num_perm ({num_perm}) must be divisible by bands ({bands})")
+        if not 0.0 < threshold <= 1.0:
+            raise ValueError(f"threshold must be in (0, 1]: {threshold}")
+        self.threshold = threshold
+        self.num_perm = num_perm
+        self.bands = bands
+        self.rows_per_band = num_perm // bands
+        self.shingle = max(1, shingle)
+        self.near = near
+        self.min_chars = min_chars
+        rng = random.Random(seed)
+        self._a = np.array([rng.randrange(1, _MERSENNE_PRIME) for _ in range(num_perm)], dtype=np.uint64)
+        self._b = np.array([rng.randrange(0, _MERSENNE_PRIME) for _ in range(num_perm)], dtype=np.uint64)
+        self._exact: set = set()
+        self._buckets: List[Dict[bytes, List[int]]] = [{} for _ in range(bands)]
+        self._signatures: List[np.ndarray] = []
+        self._count_tokens = count_tokens or _default_token_counter()
+        self.rows = 0
+        self.exact_dropped = 0
+        self.near_dropped = 0
+        self.tokens_saved = 0
+
+    @classmethod
+    def from_config(cls, cfg: Optional[Dict[str, Any]] = None, **overrides) -> Optional["NearDuplicateFilter"]:
+        """dedup セクションからフィルタを生成（enabled=false なら None）"""
+        cfg = {**DEFAULT_DEDUP, **(cfg or {}), **{k: v for k, v in overrides.items() if v is not None}}
+        if not cfg.get("enabled", True):
+            return None
+        return cls(threshold=float(cfg["threshold"]), num_perm=int(cfg["num_perm"]), bands=int(cfg["bands"]),
+                   shingle=int(cfg["shingle"]), near=bool(cfg["near"]), min_chars=int(cfg["min_chars"]))
+
+    def _signature(self, canonical: str) -> np.ndarray:
+        n = self.shingle
+        grams = {canonical[i:i + n] for i in range(max(1, len(canonical) - n + 1))}
+        hashes = np.fromiter(
+            (int.from_bytes(hashlib.blake2b(g.encode("utf-8"), digest_size=4).digest(), "little") for g in grams),
+            dtype=np.uint64, count=len(grams),
+        ) % np.uint64(_MERSENNE_PRIME)
+        # (a * x + b) mod p の最小値（a, x < 2^31 なので uint64 で溢れない）
+        return ((np.outer(self._a, hashes) + self._b[:, None]) % np.uint64(_MERSENNE_PRIME)).min(axis=1)
+
+    def is_duplicate(self, text: str) -> bool:
+        """重複なら True（重複でなければ登録して False）"""
+        self.rows += 1
+        canonical = canonical_text(text)
+        key = hashlib.blake2b(canonical.encode("utf-8"), digest_size=16).digest()
+        if key in self._exact:
+            self.exact_dropped += 1
+            self.tokens_saved += self._count_tokens(text)
+            return True
+        self._exact.add(key)
+        if not self.near or len(canonical) < self.min_chars:
+            return False
+
+        sig = self._signature(canonical)
+        r = self.rows_per_band
+        band_keys = [sig[i * r:(i + 1) * r].tobytes() for i in range(self.bands)]
+        candidates = set()
+        for band, bkey in zip(self._buckets, band_keys):
+            candidates.update(band.get(bkey, ()))
+        for idx in candidates:
+            if float(np.mean(self._signatures[idx] == sig)) >= self.threshold:
+                self.near_dropped += 1
+                self.tokens_saved += self._count_tokens(text)
+                return True
+        idx = len(self._signatures)
+        self._signatures.append(sig.astype(np.uint32))
+        for band, bkey in zip(self._buckets, band_keys):
+            band.setdefault(bkey, []).append(idx)
+        return False
+
+    def keep_mask(self, texts: Sequence[str]) -> List[bool]:
+        """texts のうち残す行のマスク"""
+        return [not self.is_duplicate(t) for t in texts]
+
+    def report(self) -> Dict[str, Any]:
+        dropped = self.exact_dropped + self.near_dropped
+        return {
+            "rows"         : self.rows,
+            "kept"         : self.rows - dropped,
+            "dropped"      : dropped,
+            "exact_dropped": self.exact_dropped,
+            "near_dropped" : self.near_dropped,
+            "drop_rate"    : dropped / self.rows if self.rows else 0.0,
+            "tokens_saved" : self.tokens_saved,
+        }
+
+
+def format_dedup_report(label: str, rep: Dict[str, Any]) -> str:
+    return (f"[Dedup:{label}] rows={rep['rows']} kept={rep['kept']} dropped={rep['dropped']} "
+            f"(exact={rep['exact_dropped']}, near={rep['near_dropped']}, {rep['drop_rate']:.1%}) "
+            f"tokens_saved={rep['tokens_saved']}")
+
+
+# ==================================================
+# エクスポート
+# ==================================================
+__all__ = [
+    'DEFAULT_DEDUP',
+    'canonical_text',
+    'NearDuplicateFilter',
+    'format_dedup_report',
+]
@@ -0,0 +1,526 @@
+# helper_embedding.py
+# 埋め込み（Embeddings）関連の共通機能
+# -----------------------------------------
+# - EmbeddingCache: (provider, model, dims, 正規化テキストのハッシュ) をキーにした永続キャッシュ（SQLite）
+# - embed_with_cache: キャッシュ未登録のテキストだけを埋め込むラッパー
+# - request_dimensions / truncate_embedding: text-embedding-3 系の次元削減（Matryoshka）
+# - EmbeddingArtifactWriter / EmbeddingArtifact: 埋め込みの再利用ファイル（.npy memmap + Parquet サイドカー）
+# a30_qdrant_registration.py / qdrant_data_loader.py / a50_rag_search_local_qdrant.py から利用する
+import base64
+import hashlib
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+import unicodedata
+from pathlib import Path
+from typing import Any, Callable, Dict, Iterator, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_CACHE_PATH = "OUTPUT/cache/embeddings.sqlite"
+DEFAULT_CACHE_MAX_SIZE_MB = 2048
+
+# モデル既定の出力次元（text-embedding-3 系のみ dimensions で削減できる）
+NATIVE_DIMENSIONS = {
+    "text-embedding-3-small": 1536,
+    "text-embedding-3-large": 3072,
+    "text-embedding-ada-002": 1536,
+}
+
+
+# ==================================================
+# キャッシュキー
+# ==================================================
+def normalize_text(text: str) -> str:
+    """キャッシュキー用のテキスト正規化（Unicode NFC・前後空白除去）"""
+    return unicodedata.normalize("NFC", str(text)).strip()
+
+
+def embedding_cache_key(text: str, model: str, dims: Optional[int] = None, provider: str = "openai") -> str:
+    """(provider, model, dims, 正規化テキスト) から決定的なキーを生成
+
+    dims は API に要求した次元数（None はモデル既定）
+    """
+    h = hashlib.sha256()
+    h.update(f"{provider}\x1f{model}\x1f{dims or 0}\x1f".encode("utf-8"))
+    h.update(normalize_text(text).encode("utf-8"))
+    return h.hexdigest()
+
+
+# ==================================================
+# 次元削減（Matryoshka）
+# ==================================================
+def request_dimensions(model: str, dims: Optional[int]) -> Optional[int]:
+    """API に送る dimensions を返す（モデル既定の次元なら None = 指定しない）
+
+    text-embedding-3 系以外で既定と異なる次元を指定した場合は ValueError
+    """
+    native = NATIVE_DIMENSIONS.get(model)
+    if not dims or native is None or int(dims) == native:
+        return None
+    if not model.startswith("text-embedding-3"):
+        raise ValueError(f"{model} does not support reduced dimensions (native {native}, requested {dims})")
+    if int(dims) > native:
+        raise ValueError(f"{model}: requested dims {dims} exceed native dims {native}")
+    return int(dims)
+
+
+def truncate_embedding(vector: Sequence[float], dims: int) -> np.ndarray:
+    """先頭 dims 次元に切り詰めて L2 正規化（text-embedding-3 の dimensions 指定と同等）"""
+    head = np.asarray(vector, dtype=np.float32)[:dims]
+    norm = float(np.linalg.norm(head))
+    return head / norm if norm > 0 else head
+
+
+# ==================================================
+# 永続埋め込みキャッシュ（SQLite）
+# ==================================================
+class EmbeddingCache:
+    """float32 ベクトルを BLOB として保存するコンテンツアドレス型キャッシュ
+
+    - get_many / put_many でバッチ取得・登録
+    - 合計サイズが max_size_mb を超えると最終アクセスの古い順に削除（LRU近似）
+    - hits / misses / puts / evictions を stats() で取得
+    スレッド間で1接続を共有する（ロックで直列化）。別プロセスはそれぞれ接続を開く（WALモード）。
+    """
+
+    _SQL_CHUNK = 500  # SQLite のプレースホルダ上限対策
+
+    def __init__(self, path: str = DEFAULT_CACHE_PATH, max_size_mb: float = DEFAULT_CACHE_MAX_SIZE_MB):
+        self.path = str(path)
+        self.max_bytes = int(max_size_mb * 1024 * 1024) if max_size_mb else 0
+        Path(self.path).parent.mkdir(parents=True, exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(self.path, check_same_thread=False, timeout=30)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            """CREATE TABLE IF NOT EXISTS embeddings (
+                   key         TEXT PRIMARY KEY,
+                   provider    TEXT NOT NULL,
+                   model       TEXT NOT NULL,
+                   dims        INTEGER NOT NULL,
+                   vector      BLOB NOT NULL,
+                   nbytes      INTEGER NOT NULL,
+                   last_access REAL NOT NULL
+               )"""
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_embeddings_last_access ON embeddings(last_access)")
+        self._conn.commit()
+        self._total_bytes = self._query_total_bytes()
+        self.hits = 0
+        self.misses = 0
+        self.puts = 0
+        self.evictions = 0
+
+    def _query_total_bytes(self) -> int:
+        row = self._conn.execute("SELECT COALESCE(SUM(nbytes), 0) FROM embeddings").fetchone()
+        return int(row[0])
+
+    def get_many(self, texts: Sequence[str], model: str, dims: Optional[int] = None,
+                 provider: str = "openai") -> List[Optional[np.ndarray]]:
+        """テキスト列に対応するベクトル（未登録は None）を返す"""
+        keys = [embedding_cache_key(t, model, dims, provider) for t in texts]
+        found: Dict[str, np.ndarray] = {}
+        unique_keys = list(dict.fromkeys(keys))
+        now = time.time()
+        with self._lock:
+            for i in range(0, len(unique_keys), self._SQL_CHUNK):
+                part = unique_keys[i:i + self._SQL_CHUNK]
+                placeholders = ",".join("?" * len(part))
+                rows = self._conn.execute(
+                    f"SELECT key, vector FROM embeddings WHERE key IN ({placeholders})", part
+                ).fetchall()
+                for key, blob in rows:
+                    found[key] = np.frombuffer(blob, dtype=np.float32)
+            if found:
+                self._conn.executemany("UPDATE embeddings SET last_access = ? WHERE key = ?",
+                                       [(now, k) for k in found])
+                self._conn.commit()
+            results = [found.get(k) for k in keys]
+            hit = sum(1 for r in results if r is not None)
+            self.hits += hit
+            self.misses += len(results) - hit
+        return results
+
+    def put_many(self, texts: Sequence[str], vectors: Sequence[Sequence[float]], model: str,
+                 dims: Optional[int] = None, provider: str = "openai") -> None:
+        """テキストとベクトルを登録（既存キーは上書き）"""
+        if len(texts) != len(vectors):
+            raise ValueError(f"texts/vectors length mismatch: {len(texts)} != {len(vectors)}")
+        now = time.time()
+        rows = []
+        added = 0
+        for text, vec in zip(texts, vectors):
+            blob = np.asarray(vec, dtype=np.float32).tobytes()
+            rows.append((embedding_cache_key(text, model, dims, provider), provider, model,
+                         len(blob) // 4, blob, len(blob), now))
+            added += len(blob)
+        with self._lock:
+            self._conn.executemany("INSERT OR REPLACE INTO embeddings VALUES (?, ?, ?, ?, ?, ?, ?)", rows)
+            self._conn.commit()
+            self.puts += len(rows)
+            self._total_bytes += added
+            if self.max_bytes and self._total_bytes > self.max_bytes:
+                self._evict()
+
+    def _evict(self) -> None:
+        """最終アクセスの古い順に削除し、上限の90%まで縮小（ロック取得済みで呼ぶ）"""
+        self._total_bytes = self._query_total_bytes()
+        excess = self._total_bytes - int(self.max_bytes * 0.9)
+        if excess <= 0:
+            return
+        victims = []
+        freed = 0
+        for key, nbytes in self._conn.execute("SELECT key, nbytes FROM embeddings ORDER BY last_access"):
+            victims.append((key,))
+            freed += nbytes
+            if freed >= excess:
+                break
+        self._conn.executemany("DELETE FROM embeddings WHERE key = ?", victims)
+        self._conn.commit()
+        self.evictions += len(victims)
+        self._total_bytes -= freed
+        logger.info(f"埋め込みキャッシュを縮小: {len(victims)}件削除 ({freed / (1024 * 1024):.1f}MB)")
+
+    def stats(self) -> Dict[str, Any]:
+        """ヒット率・件数・サイズなどの統計"""
+        with self._lock:
+            entries = self._conn.execute("SELECT COUNT(*) FROM embeddings").fetchone()[0]
+            lookups = self.hits + self.misses
+            return {
+                "hits"     : self.hits,
+                "misses"   : self.misses,
+                "hit_rate" : self.hits / lookups if lookups else 0.0,
+                "puts"     : self.puts,
+                "evictions": self.evictions,
+                "entries"  : entries,
+                "size_mb"  : self._total_bytes / (1024 * 1024),
+            }
+
+    def clear(self) -> None:
+        """キャッシュを全削除"""
+        with self._lock:
+            self._conn.execute("DELETE FROM embeddings")
+            self._conn.commit()
+            self._total_bytes = 0
+
+    def close(self) -> None:
+        with self._lock:
+            self._conn.close()
+
+
+_caches: Dict[str, EmbeddingCache] = {}
+_caches_lock = threading.Lock()
+
+
+def get_embedding_cache(cache_cfg: Optional[Dict[str, Any]] = None) -> Optional[EmbeddingCache]:
+    """設定（config.yml の embedding_cache セクション）からキャッシュを取得（パスごとに共有）
+
+    enabled: false の場合や環境変数 EMBEDDING_CACHE=0 の場合は None を返す
+    """
+    cache_cfg = cache_cfg or {}
+    if not cache_cfg.get("enabled", True) or os.getenv("EMBEDDING_CACHE", "1") == "0":
+        return None
+    path = cache_cfg.get("path") or DEFAULT_CACHE_PATH
+    with _caches_lock:
+        if path not in _caches:
+            try:
+                _caches[path] = EmbeddingCache(path, cache_cfg.get("max_size_mb", DEFAULT_CACHE_MAX_SIZE_MB))
+            except Exception as e:
+                logger.warning(f"埋め込みキャッシュを開けません（キャッシュ無しで続行）: {path} - {e}")
+                return None
+        return _caches[path]
+
+
+# ==================================================
+# float32 行列への変換
+# ==================================================
+EMBEDDING_ENCODING_FORMAT = "base64"  # Embeddings API に要求する encoding_format
+
+
+def decode_embedding(value: Any) -> np.ndarray:
+    """1件の埋め込みを float32 ベクトルにする
+
+    encoding_format="base64" の応答はリトルエンディアン float32 のバイト列（base64）なので
+    np.frombuffer でそのまま読む（float 文字列の JSON パースもリスト化もしない）
+    """
+    if isinstance(value, str):
+        return np.frombuffer(base64.b64decode(value), dtype="<f4")
+    return np.asarray(value, dtype=np.float32)
+
+
+def embeddings_to_array(data: Sequence[Any], dims: Optional[int] = None) -> np.ndarray:
+    """Embeddings API の data（.embedding を持つ要素）またはベクトル列を (n, dims) の float32 行列に詰める
+
+    1536次元の Python float のリストは約50KB、float32 行は6KB。確保済みの行列に1行ずつ書き込み、
+    中間のリスト・リストを作らない。.embedding が base64 文字列の場合はバイト列から直接デコードする
+    """
+    n = len(data)
+    if n == 0:
+        return np.empty((0, dims or 0), dtype=np.float32)
+    first = decode_embedding(getattr(data[0], "embedding", data[0]))
+    out = np.empty((n, dims or len(first)), dtype=np.float32)
+    out[0] = first
+    for i in range(1, n):
+        out[i] = decode_embedding(getattr(data[i], "embedding", data[i]))
+    return out
+
+
+# ==================================================
+# キャッシュ付き埋め込み
+# ==================================================
+def embed_with_cache(texts: Sequence[str], model: str, embed_fn: Callable[[List[str]], Sequence[Sequence[float]]],
+                     cache: Optional[EmbeddingCache] = None, dims: Optional[int] = None,
+                     provider: str = "openai", as_array: bool = False) -> Any:
+    """キャッシュにあるベクトルを再利用し、未登録テキストだけ embed_fn で埋め込む
+
+    同一バッチ内の重複テキスト（正規化後に一致）は1回だけ埋め込む
+    as_array=True の場合は (n, dims) の float32 行列を返す（既定はベクトルのリスト）
+    """
+    texts = list(texts)
+    if cache is None:
+        if as_array:
+            return embeddings_to_array(embed_fn(texts))
+        return [v.tolist() if isinstance(v, np.ndarray) else list(v) for v in embed_fn(texts)]
+
+    cached = cache.get_many(texts, model, dims, provider)
+    missing: Dict[str, str] = {}
+    for text, vec in zip(texts, cached):
+        if vec is None:
+            missing.setdefault(normalize_text(text), text)
+
+    fresh: Dict[str, Sequence[float]] = {}
+    if missing:
+        miss_texts = list(missing.values())
+        miss_vecs = embed_fn(miss_texts)
+        cache.put_many(miss_texts, miss_vecs, model, dims, provider)
+        fresh = dict(zip(missing.keys(), miss_vecs))
+
+    if as_array:
+        out: Optional[np.ndarray] = None
+        for i, (text, vec) in enumerate(zip(texts, cached)):
+            if vec is None:
+                vec = fresh[normalize_text(text)]
+            if out is None:
+                out = np.empty((len(texts), len(vec)), dtype=np.float32)
+            out[i] = vec
+        return out if out is not None else np.empty((0, dims or 0), dtype=np.float32)
+
+    results: List[List[float]] = []
+    for text, vec in zip(texts, cached):
+        if vec is None:
+            vec = fresh[normalize_text(text)]
+        results.append(vec.tolist() if isinstance(vec, np.ndarray) else list(vec))
+    return results
+
+
+# ==================================================
+# 埋め込みアーティファクト（.npy memmap + Parquet サイドカー）
+# ==================================================
+ARTIFACT_DTYPES = ("float32", "float16")
+_NPY_HEADER_SIZE = 128  # 固定長ヘッダ（行数は close 時に書き換える）
+
+
+def _npy_header(dtype: np.dtype, rows: int, dims: int) -> bytes:
+    """固定長（128バイト）の .npy v1.0 ヘッダ"""
+    header = "{'descr': '%s', 'fortran_order': False, 'shape': (%d, %d), }" % (dtype.str, rows, dims)
+    header = header.ljust(_NPY_HEADER_SIZE - 10 - 1) + "\n"
+    if len(header) + 10 != _NPY_HEADER_SIZE:
+        raise ValueError(f"npy header too long: rows={rows}, dims={dims}")
+    return b"\x93NUMPY\x01\x00" + len(header).to_bytes(2, "little") + header.encode("latin1")
+
+
+def text_hash(text: str) -> str:
+    """埋め込み入力テキストのハッシュ（正規化後の sha256）"""
+    return hashlib.sha256(normalize_text(text).encode("utf-8")).hexdigest()
+
+
+class EmbeddingArtifactWriter:
+    """1ドメイン分の埋め込みを追記していくライター
+
+    - <prefix>.<vector>.npy: Named Vector ごとの行列（float32 / float16、np.load(mmap_mode="r") で読める）
+    - <prefix>.parquet    : 行ごとの point_id / text_hash / row_hash / payload(JSON)。スキーマのメタデータに
+                            ベクトル名ごとの model / dims / dtype を保持
+    npy の行 i とサイドカーの行 i が対応する。append はスレッドセーフ。
+    サイドカーは row_group_rows 行ごとに ParquetWriter で書き出す（保持する行はドメインの大きさによらず一定）
+    書き込み中は <path>.tmp に書き、close(commit=True) で npy → parquet の順に rename する
+    （途中で落ちても list_artifacts が拾うのは完成したファイルだけ）
+    """
+
+    def __init__(self, prefix: str, vectors: Dict[str, Dict[str, Any]], dtype: str = "float32",
+                 row_group_rows: int = 8192):
+        if dtype not in ARTIFACT_DTYPES:
+            raise ValueError(f"Invalid artifact dtype: {dtype}. Must be one of {ARTIFACT_DTYPES}")
+        self.prefix = str(prefix)
+        self.vectors = {name: {"model": v["model"], "dims": int(v["dims"])} for name, v in vectors.items()}
+        self.dtype = np.dtype(dtype)
+        self.rows = 0
+        self.row_group_rows = max(1, row_group_rows)
+        self._lock = threading.Lock()
+        self._parquet = None
+        self._ids: List[Any] = []
+        self._hashes: List[str] = []
+        self._row_hashes: List[str] = []
+        self._payloads: List[str] = []
+        Path(self.prefix).parent.mkdir(parents=True, exist_ok=True)
+        self._files = {}
+        for name, v in self.vectors.items():
+            f = open(self.vector_path(self.prefix, name) + ".tmp", "wb")
+            f.write(_npy_header(self.dtype, 0, v["dims"]))
+            self._files[name] = f
+
+    @staticmethod
+    def vector_path(prefix: str, name: str) -> str:
+        return f"{prefix}.{name}.npy" if name else f"{prefix}.npy"
+
+    def append(self, ids: Sequence[Any], texts: Sequence[str], payloads: Sequence[Dict[str, Any]],
+               vectors_by_name: Dict[str, Sequence[Sequence[float]]],
+               row_hashes: Optional[Sequence[str]] = None) -> None:
+        """row_hashes: 差分インジェスト台帳の行ハッシュ（--from-artifacts 時に台帳へ記録する）"""
+        blobs = {}
+        for name, v in self.vectors.items():
+            arr = np.asarray(vectors_by_name[name], dtype=self.dtype)
+            if arr.shape != (len(ids), v["dims"]):
+                raise ValueError(f"artifact '{name}': expected {(len(ids), v['dims'])}, got {arr.shape}")
+            blobs[name] = arr.tobytes()
+        hashes = [text_hash(t) for t in texts]
+        encoded = [json.dumps(p, ensure_ascii=False) for p in payloads]
+        with self._lock:
+            for name, blob in blobs.items():
+                self._files[name].write(blob)
+            self._ids.extend(ids)
+            self._hashes.extend(hashes)
+            self._row_hashes.extend(row_hashes if row_hashes is not None else [""] * len(ids))
+            self._payloads.extend(encoded)
+            self.rows += len(ids)
+            if len(self._ids) >= self.row_group_rows:
+                self._flush()
+
+    def _flush(self) -> None:
+        """保持している行をサイドカーの row group として書き出す（ロック取得済みで呼ぶ）"""
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+
+        if self._parquet is None:
+            # 行数はヘッダに持たず、読み出し側は Parquet の行数を使う（スキーマは書き出し開始時に確定する）
+            point_id = pa.array(self._ids).type if self._ids else pa.string()
+            schema = pa.schema([("point_id", point_id), ("text_hash", pa.string()),
+                                ("row_hash", pa.string()), ("payload", pa.string())],
+                               metadata={"embedding_artifact": json.dumps({"vectors": self.vectors,
+                                                                           "dtype": self.dtype.name})})
+            self._parquet = pq.ParquetWriter(f"{self.prefix}.parquet.tmp", schema)
+        if self._ids:
+            table = pa.table({"point_id": self._ids, "text_hash": self._hashes,
+                              "row_hash": self._row_hashes, "payload": self._payloads},
+                             schema=self._parquet.schema)
+            self._parquet.write_table(table)
+        self._ids, self._hashes, self._row_hashes, self._payloads = [], [], [], []
+
+    def close(self, commit: bool = True) -> None:
+        """ヘッダの行数を確定し、残りの行をサイドカーへ書き出して正式な名前へ rename する
+
+        commit=False（インジェスト失敗時）は一時ファイルを削除し、既存のアーティファクトには触れない。
+        2回目以降の呼び出しは何もしない（finally から呼べる）
+        """
+        with self._lock:
+            if self._files is None:
+                return
+            files, self._files = self._files, None
+            paths = [self.vector_path(self.prefix, name) for name in files] + [f"{self.prefix}.parquet"]
+            try:
+                for name, f in files.items():
+                    if commit:
+                        f.seek(0)
+                        f.write(_npy_header(self.dtype, self.rows, self.vectors[name]["dims"]))
+                    f.close()
+                if commit:
+                    self._flush()
+                if self._parquet is not None:
+                    self._parquet.close()
+            except Exception:
+                commit = False
+                raise
+            finally:
+                for path in paths:
+                    if commit:
+                        # サイドカーを最後に置き換える（list_artifacts は *.parquet を完成の目印にする）
+                        os.replace(path + ".tmp", path)
+                    elif os.path.exists(path + ".tmp"):
+                        os.remove(path + ".tmp")
+        if commit:
+            logger.info(f"埋め込みアーティファクトを保存: {self.prefix} ({self.rows}行, {self.dtype.name})")
+        else:
+            logger.warning(f"埋め込みアーティファクトを破棄: {self.prefix}（書き込み未完了）")
+
+
+class EmbeddingArtifact:
+    """EmbeddingArtifactWriter で書いたファイルの読み出し
+
+    ベクトルは memmap、サイドカーは iter_batches で row group 単位に読む（全行を Python のリストにしない）
+    """
+
+    def __init__(self, prefix: str):
+        import pyarrow.parquet as pq
+
+        self.prefix = str(prefix)
+        self._parquet = pq.ParquetFile(f"{self.prefix}.parquet")
+        meta = json.loads((self._parquet.schema_arrow.metadata or {})[b"embedding_artifact"])
+        self.vectors: Dict[str, Dict[str, Any]] = meta["vectors"]
+        self.dtype = meta["dtype"]
+        self.rows = self._parquet.metadata.num_rows
+        self.arrays = {name: np.load(EmbeddingArtifactWriter.vector_path(self.prefix, name), mmap_mode="r")
+                       for name in self.vectors}
+        for name, arr in self.arrays.items():
+            if arr.shape != (self.rows, int(self.vectors[name]["dims"])):
+                raise ValueError(f"artifact '{self.prefix}' vector '{name}': expected "
+                                 f"{(self.rows, self.vectors[name]['dims'])}, got {arr.shape}")
+
+    def iter_batches(self, batch_size: int = 512) -> Iterator[Tuple[List[Any], List[Dict[str, Any]],
+                                                                    Dict[str, np.ndarray], List[str]]]:
+        """(point_ids, payloads, name -> float32 行列, row_hashes) をバッチ単位で返す（APIは呼ばない）"""
+        start = 0
+        for batch in self._parquet.iter_batches(batch_size=batch_size, columns=["point_id", "row_hash", "payload"]):
+            end = start + batch.num_rows
+            vectors = {name: np.asarray(arr[start:end], dtype=np.float32) for name, arr in self.arrays.items()}
+            payloads = [json.loads(p) for p in batch.column("payload").to_pylist()]
+            yield batch.column("point_id").to_pylist(), payloads, vectors, batch.column("row_hash").to_pylist()
+            start = end
+
+
+def list_artifacts(directory: str) -> Dict[str, str]:
+    """ディレクトリ内のアーティファクト（<domain>.parquet）を domain -> prefix で返す
+
+    書き込み途中の <domain>.parquet.tmp は対象外（close で rename されたものだけ）
+    """
+    return {p.stem: str(p.with_suffix("")) for p in sorted(Path(directory).glob("*.parquet"))}
+
+
+# ==================================================
+# エクスポート
+# ==================================================
+__all__ = [
+    'EmbeddingCache',
+    'normalize_text',
+    'embedding_cache_key',
+    'get_embedding_cache',
+    'embed_with_cache',
+    'request_dimensions',
+    'truncate_embedding',
+    'NATIVE_DIMENSIONS',
+    'embeddings_to_array',
+    'decode_embedding',
+    'EMBEDDING_ENCODING_FORMAT',
+    'EmbeddingArtifactWriter',
+    'EmbeddingArtifact',
+    'list_artifacts',
+    'text_hash',
+    'ARTIFACT_DTYPES',
+    'DEFAULT_CACHE_PATH',
+    'DEFAULT_CACHE_MAX_SIZE_MB',
+]
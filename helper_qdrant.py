@@ -0,0 +1,253 @@
+# helper_qdrant.py
+# Qdrant コレクション設定の共通機能
+# -----------------------------------------
+# - build_quantization_config: config.yml の quantization セクションから量子化設定を生成
+# - build_search_params: 量子化コレクション検索時の oversampling / rescore を指定
+# - estimate_memory: ベクトル・量子化・HNSW グラフのメモリ見積もり
+# - storage_profile_settings / warm_up_collection: RAM に収まらないコーパス向けのディスク配置と暖機
+# - collection_footprint: 既存コレクションの常駐(RAM)/ディスク使用量の見積もり
+# a30_qdrant_registration.py / a50_rag_search_local_qdrant.py / bench_qdrant_quantization.py から利用する
+import logging
+import time
+from typing import Any, Dict, List, Optional
+
+from qdrant_client.http import models
+
+logger = logging.getLogger(__name__)
+
+QUANTIZATION_TYPES = ("none", "scalar", "product", "binary")
+PRODUCT_COMPRESSIONS = ("x4", "x8", "x16", "x32", "x64")
+
+DEFAULT_QUANTIZATION = {
+    "type": "none",               # none / scalar / product / binary
+    "always_ram": True,           # 量子化ベクトルを常にRAMに保持
+    "on_disk_vectors": False,     # 原本（float32）ベクトルをディスクに置く
+    "scalar_quantile": 0.99,      # int8 変換時に外れ値を切る分位点
+    "product_compression": "x16",
+    "search": {
+        "rescore": True,          # 原本ベクトルで再スコアリング
+        "oversampling": 2.0,      # limit × oversampling 件を量子化ベクトルで候補取得
+        "ignore": False,          # True: 量子化ベクトルを使わず検索
+    },
+}
+
+STORAGE_PROFILES = ("memory", "on_disk")
+
+DEFAULT_STORAGE = {
+    "profile": "memory",          # memory: すべてRAM / on_disk: ベクトル・payload・HNSW をディスク（mmap）
+    "warmup_queries": 32,         # on_disk 時、インジェスト後に発行する暖機クエリ数
+}
+
+
+# ==================================================
+# 量子化設定
+# ==================================================
+def build_quantization_config(qcfg: Optional[Dict[str, Any]] = None) -> Optional[models.QuantizationConfig]:
+    """quantization セクションから QuantizationConfig を生成（type=none なら None）"""
+    qcfg = {**DEFAULT_QUANTIZATION, **(qcfg or {})}
+    qtype = str(qcfg.get("type") or "none").lower()
+    always_ram = bool(qcfg.get("always_ram", True))
+    if qtype == "none":
+        return None
+    if qtype == "scalar":
+        return models.ScalarQuantization(
+            scalar=models.ScalarQuantizationConfig(
+                type=models.ScalarType.INT8,
+                quantile=float(qcfg.get("scalar_quantile", 0.99)),
+                always_ram=always_ram,
+            )
+        )
+    if qtype == "product":
+        compression = str(qcfg.get("product_compression", "x16")).lower()
+        if compression not in PRODUCT_COMPRESSIONS:
+            raise ValueError(f"Invalid product_compression: {compression}. Must be one of {PRODUCT_COMPRESSIONS}")
+        return models.ProductQuantization(
+            product=models.ProductQuantizationConfig(
+                compression=models.CompressionRatio(compression),
+                always_ram=always_ram,
+            )
+        )
+    if qtype == "binary":
+        return models.BinaryQuantization(binary=models.BinaryQuantizationConfig(always_ram=always_ram))
+    raise ValueError(f"Invalid quantization type: {qtype}. Must be one of {QUANTIZATION_TYPES}")
+
+
+def build_search_params(qcfg: Optional[Dict[str, Any]] = None, oversampling: Optional[float] = None,
+                        rescore: Optional[bool] = None, exact: bool = False) -> Optional[models.SearchParams]:
+    """量子化コレクション向けの SearchParams（type=none かつ exact=False なら None）
+
+    oversampling / rescore を指定すると quantization.search の値より優先する
+    """
+    qcfg = {**DEFAULT_QUANTIZATION, **(qcfg or {})}
+    search_cfg = {**DEFAULT_QUANTIZATION["search"], **(qcfg.get("search") or {})}
+    if exact:
+        # 厳密検索は量子化ベクトルも使わない（原本ベクトルの全件比較）
+        return models.SearchParams(exact=True, quantization=models.QuantizationSearchParams(ignore=True))
+    if str(qcfg.get("type") or "none").lower() == "none" and oversampling is None and rescore is None:
+        return None
+    return models.SearchParams(
+        quantization=models.QuantizationSearchParams(
+            ignore=bool(search_cfg.get("ignore", False)),
+            rescore=bool(search_cfg.get("rescore", True) if rescore is None else rescore),
+            oversampling=float(search_cfg.get("oversampling", 2.0) if oversampling is None else oversampling),
+        )
+    )
+
+
+# ==================================================
+# メモリ見積もり
+# ==================================================
+def estimate_memory(num_points: int, dims: int, qtype: str = "none", product_compression: str = "x16",
+                    on_disk_vectors: bool = False, always_ram: bool = True, hnsw_m: int = 16,
+                    hnsw_on_disk: bool = False) -> Dict[str, float]:
+    """ベクトル1種類あたりのRAM・ディスク使用量の概算（バイト）
+
+    - 原本: float32 × dims
+    - 量子化: scalar=1バイト/次元、binary=1ビット/次元、product=原本/圧縮率
+    - HNSW グラフ: レベル0のリンク 2m 個 × 4バイト/点（上位レベルは無視）
+    """
+    original = float(num_points) * dims * 4
+    qtype = (qtype or "none").lower()
+    if qtype == "scalar":
+        quantized = float(num_points) * dims
+    elif qtype == "binary":
+        quantized = float(num_points) * dims / 8
+    elif qtype == "product":
+        quantized = original / int(product_compression.lstrip("x"))
+    else:
+        quantized = 0.0
+    graph = float(num_points) * hnsw_m * 2 * 4
+
+    ram = 0.0
+    disk = 0.0
+    if hnsw_on_disk:
+        disk += graph
+    else:
+        ram += graph
+    if on_disk_vectors:
+        disk += original
+    else:
+        ram += original
+    if quantized:
+        if always_ram:
+            ram += quantized
+        else:
+            disk += quantized
+    return {
+        "original_bytes" : original,
+        "quantized_bytes": quantized,
+        "graph_bytes"    : graph,
+        "ram_bytes"      : ram,
+        "disk_bytes"     : disk,
+    }
+
+
+# ==================================================
+# ストレージプロファイル（ディスク配置・暖機）
+# ==================================================
+def storage_profile_settings(profile: str = "memory") -> Dict[str, Any]:
+    """プロファイル名から on_disk 系の設定を返す
+
+    on_disk: 原本ベクトルは mmap、payload はディスク（RocksDB）、HNSW グラフも mmap
+    量子化ベクトル（always_ram）は on_disk でもRAMに残る
+    """
+    profile = (profile or "memory").lower()
+    if profile not in STORAGE_PROFILES:
+        raise ValueError(f"Invalid storage profile: {profile}. Must be one of {STORAGE_PROFILES}")
+    on_disk = profile == "on_disk"
+    return {
+        "on_disk_vectors": on_disk,
+        "on_disk_payload": on_disk,
+        "hnsw_config"    : models.HnswConfigDiff(on_disk=True) if on_disk else None,
+    }
+
+
+def warm_up_collection(client: Any, collection: str, using: Optional[str] = None, queries: int = 32,
+                       topk: int = 10) -> float:
+    """登録済みベクトルで検索を発行し、よく使うセグメント（グラフ・ベクトル・payload）をページキャッシュに載せる
+
+    経過秒を返す
+    """
+    if queries <= 0:
+        return 0.0
+    started = time.time()
+    records, _ = client.scroll(collection_name=collection, limit=queries, with_payload=False,
+                               with_vectors=[using] if using else True)
+    for r in records:
+        vec = r.vector.get(using) if isinstance(r.vector, dict) else r.vector
+        if vec is None:
+            continue
+        client.search(collection_name=collection, query_vector=(using, vec) if using else vec,
+                      limit=topk, with_payload=True)
+    elapsed = time.time() - started
+    logger.info(f"{collection}: 暖機クエリ {len(records)}件 ({elapsed:.1f}秒)")
+    return elapsed
+
+
+def _quantization_info(quantization_config: Any) -> Dict[str, Any]:
+    if isinstance(quantization_config, models.ScalarQuantization):
+        return {"type": "scalar", "always_ram": bool(quantization_config.scalar.always_ram)}
+    if isinstance(quantization_config, models.ProductQuantization):
+        compression = quantization_config.product.compression
+        return {"type": "product", "always_ram": bool(quantization_config.product.always_ram),
+                "product_compression": getattr(compression, "value", compression)}
+    if isinstance(quantization_config, models.BinaryQuantization):
+        return {"type": "binary", "always_ram": bool(quantization_config.binary.always_ram)}
+    return {"type": "none", "always_ram": True}
+
+
+def collection_footprint(info: Any) -> Dict[str, Any]:
+    """get_collection の結果から常駐(RAM)/ディスク使用量を見積もる（payload のサイズは含まない）"""
+    points = info.points_count or 0
+    params = info.config.params
+    hnsw = info.config.hnsw_config
+    default_quant = _quantization_info(info.config.quantization_config)
+    vectors = params.vectors if isinstance(params.vectors, dict) else {"": params.vectors}
+
+    rows: List[Dict[str, Any]] = []
+    resident = 0.0
+    on_disk = 0.0
+    for name, vp in vectors.items():
+        quant = _quantization_info(vp.quantization_config) if getattr(vp, "quantization_config", None) else default_quant
+        vec_hnsw = getattr(vp, "hnsw_config", None)
+        hnsw_m = (vec_hnsw.m if vec_hnsw and vec_hnsw.m is not None else hnsw.m) or 16
+        hnsw_on_disk = bool(vec_hnsw.on_disk if vec_hnsw and vec_hnsw.on_disk is not None else hnsw.on_disk)
+        mem = estimate_memory(points, vp.size, quant["type"], quant.get("product_compression", "x16"),
+                              on_disk_vectors=bool(vp.on_disk), always_ram=quant["always_ram"],
+                              hnsw_m=hnsw_m, hnsw_on_disk=hnsw_on_disk)
+        resident += mem["ram_bytes"]
+        on_disk += mem["disk_bytes"]
+        rows.append({
+            "vector"         : name or "(default)",
+            "dims"           : vp.size,
+            "on_disk_vectors": bool(vp.on_disk),
+            "hnsw_on_disk"   : hnsw_on_disk,
+            "quantization"   : quant["type"],
+            "resident_mb"    : mem["ram_bytes"] / 2 ** 20,
+            "on_disk_mb"     : mem["disk_bytes"] / 2 ** 20,
+        })
+    return {
+        "points"         : points,
+        "on_disk_payload": bool(params.on_disk_payload),
+        "resident_bytes" : resident,
+        "on_disk_bytes"  : on_disk,
+        "vectors"        : rows,
+    }
+
+
+# ==================================================
+# エクスポート
+# ==================================================
+__all__ = [
+    'QUANTIZATION_TYPES',
+    'PRODUCT_COMPRESSIONS',
+    'DEFAULT_QUANTIZATION',
+    'build_quantization_config',
+    'build_search_params',
+    'estimate_memory',
+    'STORAGE_PROFILES',
+    'DEFAULT_STORAGE',
+    'storage_profile_settings',
+    'warm_up_collection',
+    'collection_footprint',
+]
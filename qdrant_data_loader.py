@@ -4,13 +4,16 @@
 Qdrant データローダー - 簡略版データ投入スクリプト
 使用方法:
   python qdrant_data_loader.py --recreate --limit 100
+  python qdrant_data_loader.py --recreate --write-artifacts   # 埋め込みを OUTPUT/artifacts に保存
+  python qdrant_data_loader.py --recreate --from-artifacts    # 保存済み埋め込みから投入（API呼び出しなし）
 """
 
 import os
 import sys
 import argparse
 from pathlib import Path
-from typing import List, Dict, Any
+from typing import List, Dict, Any, Iterator, Optional
+import numpy as np
 import pandas as pd
 from datetime import datetime, timezone
 
@@ -24,6 +27,13 @@ from qdrant_client import QdrantClient
 from qdrant_client.http import models
 from openai import OpenAI
 
+from helper_api import estimate_request_tokens, get_rate_limit_scheduler
+from helper_embedding import (EMBEDDING_ENCODING_FORMAT, EmbeddingArtifact, EmbeddingArtifactWriter, EmbeddingCache,
+                              embed_with_cache, embeddings_to_array, get_embedding_cache, list_artifacts,
+                              request_dimensions)
+from helper_dedup import DEFAULT_DEDUP, NearDuplicateFilter, format_dedup_report
+from helper_qdrant import STORAGE_PROFILES, storage_profile_settings, warm_up_collection
+
 # 設定読み込み
 def load_config(path: str = "config.yml") -> Dict[str, Any]:
     """config.yml から設定を読み込む"""
@@ -37,6 +47,14 @@ def load_config(path: str = "config.yml") -> Dict[str, Any]:
             }
         },
         "qdrant": {"url": "http://localhost:6333"},
+        "embedding_cache": {
+            "enabled": True,
+            "path": "OUTPUT/cache/embeddings.sqlite",
+            "max_size_mb": 2048
+        },
+        "storage": {"profile": "memory", "warmup_queries": 32},
+        "artifacts": {"write": False, "dir": "OUTPUT/artifacts", "dtype": "float32"},
+        "dedup": dict(DEFAULT_DEDUP),
     }
     
     if os.path.exists(path):
@@ -82,10 +100,11 @@ def get_data_files() -> Dict[str, str]:
     
     return available_files
 
-def load_and_prepare_data(filepath: str, limit: int = 0) -> pd.DataFrame:
-    """CSVファイルを読み込みクリーニング"""
-    df = pd.read_csv(filepath)
-    
+def iter_prepared_chunks(filepath: str, limit: int = 0, chunk_rows: int = 5000) -> Iterator[pd.DataFrame]:
+    """CSVファイルをチャンク単位で読み込みクリーニング（保持するのは chunk_rows 行分のみ）
+
+    重複の除去は行わない（必要なら呼び出し側で dedup 設定の NearDuplicateFilter を使う）
+    """
     # 列名をマッピング
     column_mappings = {
         'Question': 'question',
@@ -93,40 +112,69 @@ def load_and_prepare_data(filepath: str, limit: int = 0) -> pd.DataFrame:
         'Answer': 'answer',
         'correct_answer': 'answer'
     }
-    df = df.rename(columns=column_mappings)
-    
-    # 必要な列が存在することを確認
-    required_cols = ['question', 'answer']
-    for col in required_cols:
-        if col not in df.columns:
-            # answerがない場合は空文字で作成
-            df[col] = ""
-    
-    # クリーニング
-    df = df.fillna("")
-    df = df[df['question'].str.len() > 0]  # 空の質問を除外
-    
-    if limit > 0:
-        df = df.head(limit)
-    
-    return df
+    emitted = 0
 
-def create_embeddings(texts: List[str], model: str = "text-embedding-3-small") -> List[List[float]]:
-    """OpenAI APIを使用して埋め込みを生成"""
-    client = OpenAI()
-    embeddings = []
-    
-    # バッチ処理
-    batch_size = 100
-    for i in range(0, len(texts), batch_size):
-        batch = texts[i:i+batch_size]
-        response = client.embeddings.create(model=model, input=batch)
-        embeddings.extend([data.embedding for data in response.data])
-    
-    return embeddings
+    for df in pd.read_csv(filepath, chunksize=chunk_rows):
+        df = df.rename(columns=column_mappings)
+
+        # 必要な列が存在することを確認
+        required_cols = ['question', 'answer']
+        for col in required_cols:
+            if col not in df.columns:
+                # answerがない場合は空文字で作成
+                df[col] = ""
+
+        # クリーニング
+        df = df.fillna("")
+        df = df[df['question'].astype(str).str.len() > 0]  # 空の質問を除外
+
+        if limit > 0:
+            df = df.head(limit - emitted)
+        if len(df) > 0:
+            emitted += len(df)
+            yield df.reset_index(drop=True)
+        if limit > 0 and emitted >= limit:
+            break
+
+def load_and_prepare_data(filepath: str, limit: int = 0) -> pd.DataFrame:
+    """CSVファイルを読み込みクリーニング"""
+    chunks = list(iter_prepared_chunks(filepath, limit))
+    if not chunks:
+        return pd.DataFrame(columns=['question', 'answer'])
+    return pd.concat(chunks, ignore_index=True)
+
+def create_embeddings(texts: List[str], model: str = "text-embedding-3-small",
+                      cache: Optional[EmbeddingCache] = None, dims: Optional[int] = None) -> np.ndarray:
+    """OpenAI APIを使用して埋め込みを生成（キャッシュ済みのテキストはAPIを呼ばない）
+
+    dims を指定すると text-embedding-3 系の次元削減（dimensions）を要求する
+    戻り値は (len(texts), dims) の float32 行列（base64 応答を np.frombuffer で復元）
+    """
+    req_dims = request_dimensions(model, dims)
+    # 再試行・レート制御は共通スケジューラで行う（SDKの自動リトライは無効化）
+    client = OpenAI(max_retries=0)
+    scheduler = get_rate_limit_scheduler()
+
+    def _embed(batch_texts: List[str]) -> np.ndarray:
+        embeddings = []
+        # バッチ処理
+        batch_size = 100
+        for i in range(0, len(batch_texts), batch_size):
+            batch = batch_texts[i:i+batch_size]
+            params: Dict[str, Any] = {"model": model, "input": batch, "encoding_format": EMBEDDING_ENCODING_FORMAT}
+            if req_dims:
+                params["dimensions"] = req_dims
+            response = scheduler.call(lambda: client.embeddings.with_raw_response.create(**params),
+                                      model=model, tokens=estimate_request_tokens(batch, model))
+            embeddings.append(embeddings_to_array(response.data))
+        return np.concatenate(embeddings) if embeddings else np.empty((0, req_dims or 0), dtype=np.float32)
 
-def setup_qdrant_collection(client: QdrantClient, collection_name: str, vector_size: int, recreate: bool = False):
-    """Qdrantコレクションのセットアップ"""
+    return embed_with_cache(texts, model, _embed, cache=cache, dims=req_dims, as_array=True)
+
+def setup_qdrant_collection(client: QdrantClient, collection_name: str, vector_size: int, recreate: bool = False,
+                            storage_profile: str = "memory"):
+    """Qdrantコレクションのセットアップ（storage_profile="on_disk" でベクトル・payload・HNSW をディスクに配置）"""
+    storage = storage_profile_settings(storage_profile)
     if recreate:
         try:
             client.delete_collection(collection_name)
@@ -143,10 +191,13 @@ def setup_qdrant_collection(client: QdrantClient, collection_name: str, vector_s
             collection_name=collection_name,
             vectors_config=models.VectorParams(
                 size=vector_size,
-                distance=models.Distance.COSINE
-            )
+                distance=models.Distance.COSINE,
+                on_disk=storage["on_disk_vectors"]
+            ),
+            on_disk_payload=storage["on_disk_payload"],
+            hnsw_config=storage["hnsw_config"]
         )
-        print(f"コレクション '{collection_name}' を作成しました")
+        print(f"コレクション '{collection_name}' を作成しました（ストレージ: {storage_profile}）")
         
         # インデックスを作成
         client.create_payload_index(
@@ -159,11 +210,12 @@ def insert_data_to_qdrant(
     client: QdrantClient, 
     collection_name: str,
     df: pd.DataFrame,
-    embeddings: List[List[float]],
+    embeddings: np.ndarray,
     domain: str,
-    offset: int = 0
+    offset: int = 0,
+    artifact_writer: Optional[EmbeddingArtifactWriter] = None
 ):
-    """データをQdrantに投入"""
+    """データをQdrantに投入（artifact_writer があれば投入したベクトルを保存）"""
     points = []
     timestamp = datetime.now(timezone.utc).isoformat()
     
@@ -180,7 +232,7 @@ def insert_data_to_qdrant(
         
         points.append(models.PointStruct(
             id=point_id,
-            vector=embeddings[idx],
+            vector=embeddings[idx].tolist(),
             payload=payload
         ))
     
@@ -189,29 +241,77 @@ def insert_data_to_qdrant(
     for i in range(0, len(points), batch_size):
         batch = points[i:i+batch_size]
         client.upsert(collection_name=collection_name, points=batch)
+
+    if artifact_writer is not None:
+        artifact_writer.append([p.id for p in points], df["question"].astype(str).tolist(),
+                               [p.payload for p in points], {"": embeddings})
     
     print(f"  {domain}: {len(points)}件のデータを投入しました")
 
+def insert_from_artifacts(client: QdrantClient, collection_name: str, directory: str, model: str,
+                          vector_size: int, batch_size: int = 100) -> Dict[str, int]:
+    """保存済みの埋め込み（memmap）を OpenAI API を呼ばずに投入し、ドメイン別件数を返す"""
+    found = list_artifacts(directory)
+    if not found:
+        raise FileNotFoundError(f"埋め込みアーティファクトが見つかりません: {directory}")
+    expected = {"": {"model": model, "dims": vector_size}}
+    counts: Dict[str, int] = {}
+    for domain, prefix in found.items():
+        artifact = EmbeddingArtifact(prefix)
+        if artifact.vectors != expected:
+            raise ValueError(f"{prefix}: 埋め込み設定が一致しません（{artifact.vectors} != {expected}）")
+        for ids, payloads, arrays, _ in artifact.iter_batches(batch_size):
+            client.upsert(collection_name=collection_name,
+                          points=models.Batch(ids=ids, vectors=arrays[""].tolist(),
+                                              payloads=payloads))
+        counts[domain] = artifact.rows
+        print(f"  {domain}: {artifact.rows}件のデータを投入しました（{artifact.dtype}, {prefix}）")
+    return counts
+
 def main():
     parser = argparse.ArgumentParser(description="Qdrantにデータを投入")
     parser.add_argument("--recreate", action="store_true", help="コレクションを再作成")
     parser.add_argument("--limit", type=int, default=0, help="各ドメインの最大件数（0=制限なし）")
     parser.add_argument("--collection", type=str, default=None, help="コレクション名")
     parser.add_argument("--qdrant-url", type=str, default=None, help="Qdrant URL")
+    parser.add_argument("--no-embedding-cache", action="store_true", help="埋め込みキャッシュを使わない")
+    parser.add_argument("--chunk-rows", type=int, default=5000, help="CSVを読み込むチャンク行数")
+    parser.add_argument("--dims", type=int, default=None,
+                        help="埋め込み次元（text-embedding-3 系のみ削減可: 256/512/768 など、既定は config.yml）")
+    parser.add_argument("--storage-profile", choices=list(STORAGE_PROFILES), default=None,
+                        help="memory / on_disk（既定は config.yml の storage.profile）")
+    parser.add_argument("--no-dedup", action="store_true", help="表記ゆれ・近似重複の除去を行わない")
+    parser.add_argument("--dedup", action="store_true",
+                        help="表記ゆれ・近似重複を除去する（既定は config.yml の dedup.enabled = false）")
+    parser.add_argument("--write-artifacts", action="store_true",
+                        help="埋め込みをドメインごとに .npy + Parquet で保存（既定は config.yml の artifacts.write）")
+    parser.add_argument("--from-artifacts", action="store_true", help="保存済みの埋め込みから投入（APIを呼ばない）")
+    parser.add_argument("--artifacts-dir", type=str, default=None, help="アーティファクトの保存先")
+    parser.add_argument("--artifact-dtype", choices=["float32", "float16"], default=None, help="保存時の型")
     args = parser.parse_args()
     
     # 設定読み込み
     config = load_config()
+    storage_cfg = config.get("storage", {})
+    storage_profile = args.storage_profile or storage_cfg.get("profile", "memory")
+    artifacts_cfg = config.get("artifacts", {})
+    artifacts_dir = args.artifacts_dir or artifacts_cfg.get("dir", "OUTPUT/artifacts")
+    artifact_dtype = args.artifact_dtype or artifacts_cfg.get("dtype", "float32")
+    write_artifacts = (args.write_artifacts or artifacts_cfg.get("write", False)) and not args.from_artifacts
     collection_name = args.collection or config.get("rag", {}).get("collection", "qa_corpus")
     qdrant_url = args.qdrant_url or config.get("qdrant", {}).get("url", "http://localhost:6333")
     embedding_config = config.get("embeddings", {}).get("primary", {})
     embedding_model = embedding_config.get("model", "text-embedding-3-small")
-    vector_size = embedding_config.get("dims", 1536)
+    vector_size = args.dims or embedding_config.get("dims", 1536)
+    request_dimensions(embedding_model, vector_size)  # 次元削減に対応しないモデルはここでエラー
     
     print(f"Qdrantデータローダー開始")
     print(f"  URL: {qdrant_url}")
     print(f"  コレクション: {collection_name}")
-    print(f"  埋め込みモデル: {embedding_model}")
+    print(f"  埋め込みモデル: {embedding_model} ({vector_size}次元)")
+
+    # 埋め込みキャッシュ
+    cache = None if args.no_embedding_cache else get_embedding_cache(config.get("embedding_cache"))
     
     # Qdrantクライアント初期化
     try:
@@ -226,8 +326,15 @@ def main():
         return 1
     
     # コレクションセットアップ
-    setup_qdrant_collection(client, collection_name, vector_size, args.recreate)
+    setup_qdrant_collection(client, collection_name, vector_size, args.recreate, storage_profile)
     
+    # 保存済み埋め込みから投入
+    if args.from_artifacts:
+        print(f"\n📦 埋め込みアーティファクトから投入: {artifacts_dir}")
+        counts = insert_from_artifacts(client, collection_name, artifacts_dir, embedding_model, vector_size)
+        print(f"\n✅ 完了！合計 {sum(counts.values())} 件のデータを投入しました（埋め込みAPI呼び出しなし）")
+        return 0
+
     # データファイル取得
     data_files = get_data_files()
     if not data_files:
@@ -247,31 +354,64 @@ def main():
         print(f"\n処理中: {domain}")
         print(f"  ファイル: {filepath}")
         
-        # データ読み込み
-        df = load_and_prepare_data(filepath, args.limit)
-        if len(df) == 0:
+        # チャンク単位で 読み込み → 埋め込み → 投入（ファイル全体をメモリに載せない）
+        domain_points = 0
+        dedup = None if args.no_dedup else NearDuplicateFilter.from_config(config.get("dedup"),
+                                                                             enabled=True if args.dedup else None)
+        writer = None
+        if write_artifacts:
+            writer = EmbeddingArtifactWriter(os.path.join(artifacts_dir, domain),
+                                             {"": {"model": embedding_model, "dims": vector_size}},
+                                             dtype=artifact_dtype)
+        completed = False
+        try:
+            for df in iter_prepared_chunks(filepath, args.limit, args.chunk_rows):
+                # 正規化後に一致する・近似重複の質問は埋め込まない
+                if dedup is not None:
+                    df = df[dedup.keep_mask(df['question'].astype(str).tolist())].reset_index(drop=True)
+                    if len(df) == 0:
+                        continue
+                # 埋め込みを作成
+                print(f"  埋め込み生成中... ({len(df)}件)")
+                texts = df['question'].tolist()
+                embeddings = create_embeddings(texts, embedding_model, cache=cache, dims=vector_size)
+
+                # Qdrantに投入
+                insert_data_to_qdrant(
+                    client,
+                    collection_name,
+                    df,
+                    embeddings,
+                    domain,
+                    point_offset,
+                    artifact_writer=writer
+                )
+
+                point_offset += len(df)
+                domain_points += len(df)
+            completed = True
+        finally:
+            # 失敗時は書きかけのアーティファクトを破棄する（既存のファイルは残す）
+            if writer is not None:
+                writer.close(commit=completed)
+        if dedup is not None and dedup.rows:
+            print("  " + format_dedup_report(domain, dedup.report()))
+        if domain_points == 0:
             print(f"  ⚠️ 有効なデータがありません")
             continue
-        
-        # 埋め込みを作成
-        print(f"  埋め込み生成中... ({len(df)}件)")
-        texts = df['question'].tolist()
-        embeddings = create_embeddings(texts, embedding_model)
-        
-        # Qdrantに投入
-        insert_data_to_qdrant(
-            client, 
-            collection_name, 
-            df, 
-            embeddings, 
-            domain,
-            point_offset
-        )
-        
-        point_offset += len(df)
-        total_points += len(df)
+        total_points += domain_points
     
     print(f"\n✅ 完了！合計 {total_points} 件のデータを投入しました")
+    if cache is not None:
+        cache_stats = cache.stats()
+        print(f"  埋め込みキャッシュ: ヒット {cache_stats['hits']}件 / ミス {cache_stats['misses']}件 "
+              f"(ヒット率 {cache_stats['hit_rate']:.1%}, {cache_stats['size_mb']:.1f}MB)")
+    if storage_profile == "on_disk" and storage_cfg.get("warmup_queries", 32) > 0:
+        warm_elapsed = warm_up_collection(client, collection_name, queries=storage_cfg.get("warmup_queries", 32))
+        print(f"  暖機クエリ: {storage_cfg.get('warmup_queries', 32)}件 ({warm_elapsed:.1f}秒)")
+    rate_stats = get_rate_limit_scheduler().stats()
+    print(f"  APIリクエスト: {rate_stats['requests']}件 (再試行 {rate_stats['retries']}件, 429 {rate_stats['throttled']}件, "
+          f"同時実行数 {rate_stats['concurrency']})")
     
     # 統計情報を表示
     try:
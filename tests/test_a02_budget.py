@@ -0,0 +1,89 @@
+# tests/test_a02_budget.py
+# a02_set_vector_store_vsid.py: JSONL の予算管理（JsonlBudgetWriter / JsonlBudgetView）と統合時の予算配分
+import json
+
+import pytest
+
+pytest.importorskip("streamlit")
+pytest.importorskip("pandas")
+pytest.importorskip("openai")
+
+from a02_set_vector_store_vsid import JsonlBudgetWriter, VectorStoreManager  # noqa: E402
+
+ENTRY = {"text": "x" * 20}
+LINE_BYTES = len(JsonlBudgetWriter.encode(ENTRY))
+
+
+def read_lines(path):
+    return [json.loads(line) for line in path.read_text(encoding="utf-8").splitlines()]
+
+
+def test_writer_stops_at_chunk_limit(tmp_path):
+    with JsonlBudgetWriter(tmp_path / "out.jsonl", max_bytes=10 ** 6, max_chunks=3) as writer:
+        results = [writer.write(ENTRY) for _ in range(5)]
+    assert results == [True, True, True, False, False]
+    assert writer.full_reason == "chunks"
+    assert len(read_lines(tmp_path / "out.jsonl")) == 3
+
+
+def test_writer_stops_at_byte_limit_with_exact_count(tmp_path):
+    with JsonlBudgetWriter(tmp_path / "out.jsonl", max_bytes=2 * LINE_BYTES + 1, max_chunks=100) as writer:
+        assert writer.write(ENTRY) and writer.write(ENTRY)
+        assert not writer.write(ENTRY)
+    assert writer.full_reason == "bytes"
+    assert writer.bytes_written == 2 * LINE_BYTES == (tmp_path / "out.jsonl").stat().st_size
+
+
+def test_writer_balances_shards(tmp_path):
+    with JsonlBudgetWriter(tmp_path / "out.jsonl", max_bytes=10 ** 6, max_chunks=100, shards=3) as writer:
+        for i in range(7):
+            writer.write(ENTRY, key=f"k{i}")
+    assert [p.name for p in writer.paths] == ["out.00.jsonl", "out.01.jsonl", "out.02.jsonl"]
+    assert writer.shard_chunks == [3, 2, 2]
+    assert sum(len(keys) for keys in writer.shard_keys) == 7
+    assert writer.written_paths() == writer.paths
+    writer.remove()
+    assert not any(p.exists() for p in writer.paths)
+
+
+def test_view_uses_own_budget_and_shard_range(tmp_path):
+    with JsonlBudgetWriter(tmp_path / "out.jsonl", max_bytes=10 ** 6, max_chunks=100, shards=4) as writer:
+        view = writer.sub_budget(max_bytes=10 ** 6, max_chunks=2, shards=range(2, 4))
+        assert [view.write(ENTRY) for _ in range(3)] == [True, True, False]
+    assert view.full_reason == "chunks"
+    assert writer.shard_chunks == [0, 0, 1, 1]
+    assert writer.chunks == view.chunks == 2
+
+
+def test_view_reports_parent_limit(tmp_path):
+    with JsonlBudgetWriter(tmp_path / "out.jsonl", max_bytes=10 ** 6, max_chunks=1) as writer:
+        view = writer.sub_budget(max_bytes=10 ** 6, max_chunks=10)
+        assert view.write(ENTRY) and not view.write(ENTRY)
+    assert view.full_reason == "chunks"
+
+
+@pytest.fixture
+def manager(tmp_path):
+    return VectorStoreManager(api_key="sk-test", manifest_path=tmp_path / "manifest.json")
+
+
+def test_allocate_unified_budget_is_proportional(manager):
+    budgets = manager.allocate_unified_budget({"a": 300, "b": 100}, max_bytes=1000, max_chunks=40)
+    assert budgets == {"a": {"max_bytes": 750, "max_chunks": 30}, "b": {"max_bytes": 250, "max_chunks": 10}}
+
+
+def test_unused_budget_carries_over(manager, tmp_path):
+    # process_unified_datasets と同じ手順: 使い切らなかった予算を次のデータセットの view に加える
+    budgets = manager.allocate_unified_budget({"a": 1, "b": 1}, max_bytes=10 ** 6, max_chunks=10)
+    written = {"a": 2, "b": 10}
+    with JsonlBudgetWriter(tmp_path / "out.jsonl", max_bytes=10 ** 6, max_chunks=10, shards=2) as writer:
+        carry_bytes = carry_chunks = 0
+        counts = {}
+        for i, (name, budget) in enumerate(budgets.items()):
+            view = writer.sub_budget(budget["max_bytes"] + carry_bytes, budget["max_chunks"] + carry_chunks,
+                                     shards=range(i, i + 1))
+            counts[name] = sum(view.write(ENTRY) for _ in range(written[name]))
+            carry_bytes = view.max_bytes - view.bytes_written
+            carry_chunks = view.max_chunks - view.chunks
+    assert counts == {"a": 2, "b": 8}
+    assert writer.chunks == 10 and writer.shard_chunks == [2, 8]
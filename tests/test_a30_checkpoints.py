@@ -0,0 +1,72 @@
+# tests/test_a30_checkpoints.py
+# a30_qdrant_registration.py: IngestCheckpoints の watermark（先頭から連続してコミット済みのチャンク終端）
+import pytest
+
+pytest.importorskip("numpy")
+pytest.importorskip("pandas")
+pytest.importorskip("qdrant_client")
+pytest.importorskip("openai")
+
+from a30_qdrant_registration import IngestCheckpoints  # noqa: E402
+
+
+@pytest.fixture
+def checkpoints(tmp_path):
+    cp = IngestCheckpoints(str(tmp_path / "manifest.sqlite"), "qa_corpus")
+    cp.begin("customer", fingerprint="fp", settings="{}", run_id="run-1")
+    return cp
+
+
+def test_watermark_waits_for_earlier_chunks(checkpoints):
+    checkpoints.add_chunk("customer", 0, 100, num_jobs=2)
+    checkpoints.add_chunk("customer", 100, 200, num_jobs=1)
+    checkpoints.complete("customer", 100, 40)
+    assert checkpoints.load("customer")["watermark"] == 0
+    checkpoints.complete("customer", 0, 50)
+    assert checkpoints.load("customer")["watermark"] == 0
+    checkpoints.complete("customer", 0, 50)
+    cp = checkpoints.load("customer")
+    assert (cp["watermark"], cp["committed_rows"], cp["status"]) == (200, 140, "running")
+
+
+def test_done_only_after_finish(checkpoints):
+    checkpoints.add_chunk("customer", 0, 10, num_jobs=1)
+    checkpoints.complete("customer", 0, 10)
+    assert checkpoints.load("customer")["status"] == "running"
+    checkpoints.finish("customer")
+    assert checkpoints.load("customer")["status"] == "done"
+
+
+def test_chunk_without_jobs_advances_immediately(checkpoints):
+    # 重複除去・差分判定で全行が落ちたチャンクはジョブ0件で登録される
+    checkpoints.add_chunk("customer", 0, 10, num_jobs=0)
+    assert checkpoints.load("customer")["watermark"] == 10
+
+
+def test_resume_keeps_previous_watermark(tmp_path):
+    path = str(tmp_path / "manifest.sqlite")
+    first = IngestCheckpoints(path, "qa_corpus")
+    first.begin("legal", "fp", "{}", "run-1")
+    first.add_chunk("legal", 0, 100, num_jobs=1)
+    first.complete("legal", 0, 100)
+
+    resumed = IngestCheckpoints(path, "qa_corpus")
+    cp = resumed.load("legal")
+    assert (cp["fingerprint"], cp["watermark"], cp["committed_rows"]) == ("fp", 100, 100)
+    resumed.begin("legal", "fp", "{}", "run-2", watermark=cp["watermark"], committed_rows=cp["committed_rows"])
+    resumed.add_chunk("legal", 100, 150, num_jobs=1)
+    resumed.complete("legal", 100, 50)
+    resumed.finish("legal")
+    cp = resumed.load("legal")
+    assert (cp["run_id"], cp["watermark"], cp["committed_rows"], cp["status"]) == ("run-2", 150, 150, "done")
+
+
+def test_reset_is_scoped_to_collection(tmp_path):
+    path = str(tmp_path / "manifest.sqlite")
+    a = IngestCheckpoints(path, "a")
+    b = IngestCheckpoints(path, "b")
+    a.begin("trivia", "fp", "{}", "run")
+    b.begin("trivia", "fp", "{}", "run")
+    a.reset()
+    assert a.load("trivia") is None
+    assert b.load("trivia") is not None
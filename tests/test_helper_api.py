@@ -0,0 +1,74 @@
+# tests/test_helper_api.py
+# helper_api.py: EmbeddingBatchPacker のリクエスト詰め（トークン数・件数の上限、overflow ポリシー）
+import pytest
+
+np = pytest.importorskip("numpy")
+tiktoken = pytest.importorskip("tiktoken")
+pytest.importorskip("openai")
+pytest.importorskip("yaml")
+
+from helper_api import EmbeddingBatchPacker  # noqa: E402
+
+
+@pytest.fixture(scope="module", autouse=True)
+def encoding_available():
+    # エンコーディング表はダウンロードが必要（オフライン環境ではスキップ）
+    try:
+        tiktoken.get_encoding("cl100k_base")
+    except Exception as e:
+        pytest.skip(f"tiktoken encoding unavailable: {e}")
+
+
+def make_packer(**kwargs) -> EmbeddingBatchPacker:
+    return EmbeddingBatchPacker("text-embedding-3-small", **kwargs)
+
+
+def test_pack_respects_item_limit():
+    packer = make_packer(max_batch_items=3)
+    segments = [[(f"t{i}", 1)] for i in range(7)]
+    assert list(packer.pack([""] * 7, segments)) == [[0, 1, 2], [3, 4, 5], [6]]
+
+
+def test_pack_respects_token_limit():
+    packer = make_packer(max_batch_tokens=10)
+    segments = [[("a", 4)], [("b", 4)], [("c", 4)], [("d", 10)], [("e", 1)]]
+    assert list(packer.pack([""] * 5, segments)) == [[0, 1], [2], [3], [4]]
+
+
+def test_pack_counts_split_segments_as_items():
+    packer = make_packer(max_batch_items=3)
+    segments = [[("a", 1), ("b", 1)], [("c", 1), ("d", 1)], [("e", 1)]]
+    assert list(packer.pack([""] * 3, segments)) == [[0], [1, 2]]
+
+
+def test_pack_tokenizes_when_segments_omitted():
+    packer = make_packer(max_batch_items=2)
+    assert list(packer.pack(["hello", "world", "again"])) == [[0, 1], [2]]
+
+
+def test_truncate_and_split_policies():
+    text = "word " * 50
+    truncated = make_packer(max_input_tokens=10, overflow="truncate").prepare(text)
+    assert len(truncated) == 1 and truncated[0][1] == 10
+    split = make_packer(max_input_tokens=10, overflow="split").prepare(text)
+    assert len(split) > 1 and all(n <= 10 for _, n in split)
+    with pytest.raises(ValueError):
+        make_packer(max_input_tokens=10, overflow="error").prepare(text)
+
+
+def test_embed_merges_split_inputs_in_order():
+    packer = make_packer(max_input_tokens=10, max_batch_items=4, overflow="split")
+    texts = ["short", "word " * 6, "tail"]
+    calls = []
+
+    def embed_fn(inputs):
+        calls.append(list(inputs))
+        return np.ones((len(inputs), 2), dtype=np.float32)
+
+    segments = packer.segments(texts)
+    assert len(segments[1]) > 1
+    out = packer.embed(texts, embed_fn, segments=segments)
+    assert out.shape == (3, 2)
+    np.testing.assert_allclose(np.linalg.norm(out[1]), 1.0, rtol=1e-6)
+    assert sum(len(c) for c in calls) == packer.items
+    assert all(len(c) <= 4 for c in calls)
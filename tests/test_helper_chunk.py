@@ -0,0 +1,68 @@
+# tests/test_helper_chunk.py
+# helper_chunk.py: 文境界・トークン境界でのチャンク分割（tiktoken が無い環境では文字数で分割）
+import pytest
+
+from helper_chunk import DEFAULT_ENCODING, _get_encoder, _split_long, chunk_text_tokens, chunk_texts, split_sentences
+
+
+def count_tokens(text: str) -> int:
+    encoder = _get_encoder(DEFAULT_ENCODING)
+    return len(encoder.encode_ordinary(text)) if encoder is not None else len(text)
+
+
+JA_TEXT = "".join(f"これは{i}番目の文です。" for i in range(40))
+
+
+def test_split_sentences_is_lossless():
+    text = "一文目。二文目！「三文目？」\n\nFourth sentence. Fifth"
+    sentences = split_sentences(text)
+    assert "".join(sentences) == text
+    assert sentences[:3] == ["一文目。", "二文目！", "「三文目？」"]
+
+
+@pytest.mark.parametrize("max_tokens", [1, 3, 7, 64])
+def test_split_long_offsets_cover_sentence(max_tokens):
+    sentence = "あいうえおかきくけこ🙂さしすせそ" * 5 + "token boundary test"
+    pieces = _split_long(sentence, max_tokens, _get_encoder(DEFAULT_ENCODING))
+    assert "".join(p for p, _ in pieces) == sentence
+    assert all(0 < n <= max_tokens for _, n in pieces)
+
+
+def test_chunks_respect_max_tokens_and_keep_order():
+    chunks = chunk_text_tokens(JA_TEXT, max_tokens=50, overlap_tokens=0)
+    assert len(chunks) > 1
+    assert all(count_tokens(c) <= 50 for c in chunks)
+    assert "".join(chunks) == JA_TEXT
+
+
+def test_overlap_repeats_previous_tail():
+    sentence = max(split_sentences(JA_TEXT), key=count_tokens)
+    size = count_tokens(sentence)
+    chunks = chunk_text_tokens(JA_TEXT, max_tokens=4 * size, overlap_tokens=2 * size - 1)
+    assert len(chunks) > 1
+    for prev, cur in zip(chunks, chunks[1:]):
+        prev_sentences, cur_sentences = split_sentences(prev), split_sentences(cur)
+        # 次のチャンクは直前のチャンク末尾の文（overlap_tokens 以内）から始まる
+        carried = prev_sentences.index(cur_sentences[0])
+        assert prev_sentences[carried:] == cur_sentences[:len(prev_sentences) - carried]
+        assert 0 < carried < len(prev_sentences)
+
+
+def test_long_sentence_without_boundaries_is_split():
+    text = "abcdefghij" * 50
+    chunks = chunk_text_tokens(text, max_tokens=40, overlap_tokens=0)
+    assert len(chunks) > 1
+    assert "".join(chunks) == text
+
+
+def test_empty_and_invalid_input():
+    assert chunk_text_tokens("", max_tokens=10) == []
+    with pytest.raises(ValueError):
+        chunk_text_tokens("abc", max_tokens=0)
+
+
+def test_chunk_texts_matches_serial():
+    texts = [JA_TEXT, "短い文。", ""]
+    expected = [chunk_text_tokens(t, 30, 5) for t in texts]
+    assert chunk_texts(texts, max_tokens=30, overlap_tokens=5, workers=1) == expected
+    assert chunk_texts(texts, max_tokens=30, overlap_tokens=5, workers=2, min_parallel_rows=1) == expected
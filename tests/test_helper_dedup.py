@@ -0,0 +1,68 @@
+# tests/test_helper_dedup.py
+# helper_dedup.py: 正規化・完全一致・MinHash/LSH の近似重複判定
+import pytest
+
+pytest.importorskip("numpy")
+
+from helper_dedup import DEFAULT_DEDUP, NearDuplicateFilter, canonical_text  # noqa: E402
+
+BASE = ("The mitochondria is the powerhouse of the cell and produces most of the chemical energy "
+        "needed to power the biochemical reactions of the cell, stored as ATP.")
+NEAR = BASE.replace("most of the", "most the")  # 1語だけ異なる（推定 Jaccard は約 0.9）
+
+
+def make_filter(**kwargs) -> NearDuplicateFilter:
+    # tiktoken の読み込みを避けるため tokens_saved は文字数で数える
+    return NearDuplicateFilter(count_tokens=len, **kwargs)
+
+
+def test_canonical_text_absorbs_width_case_and_punctuation():
+    assert canonical_text("ＡＢＣ　１２３、テスト！") == canonical_text("abc 123 テスト")
+
+
+def test_exact_duplicate_after_normalization():
+    f = make_filter()
+    assert f.keep_mask(["Hello, World!", "ｈｅｌｌｏ　ｗｏｒｌｄ", "Goodbye"]) == [True, False, True]
+    rep = f.report()
+    assert (rep["rows"], rep["kept"], rep["exact_dropped"], rep["near_dropped"]) == (3, 2, 1, 0)
+    assert rep["tokens_saved"] == len("ｈｅｌｌｏ　ｗｏｒｌｄ")
+
+
+def test_near_duplicate_dropped_below_threshold():
+    f = make_filter(threshold=0.7)
+    assert f.keep_mask([BASE, NEAR]) == [True, False]
+    assert f.near_dropped == 1
+
+
+def test_near_duplicate_kept_at_threshold_one():
+    f = make_filter(threshold=1.0)
+    assert f.keep_mask([BASE, NEAR]) == [True, True]
+
+
+def test_near_disabled_keeps_near_duplicates():
+    f = make_filter(near=False, threshold=0.5)
+    assert f.keep_mask([BASE, NEAR, BASE]) == [True, True, False]
+
+
+def test_short_texts_use_exact_match_only():
+    f = make_filter(threshold=0.5, min_chars=1000)
+    assert f.keep_mask([BASE, NEAR]) == [True, True]
+
+
+def test_unrelated_texts_are_kept():
+    f = make_filter(threshold=0.5)
+    other = "Photosynthesis converts light energy into chemical energy stored in glucose molecules."
+    assert f.keep_mask([BASE, other]) == [True, True]
+
+
+@pytest.mark.parametrize("kwargs", [{"num_perm": 64, "bands": 10}, {"threshold": 0.0}, {"threshold": 1.5}])
+def test_invalid_parameters(kwargs):
+    with pytest.raises(ValueError):
+        make_filter(**kwargs)
+
+
+def test_from_config_disabled_by_default():
+    assert DEFAULT_DEDUP["enabled"] is False
+    assert NearDuplicateFilter.from_config(None) is None
+    f = NearDuplicateFilter.from_config({"threshold": 0.8}, enabled=True)
+    assert isinstance(f, NearDuplicateFilter) and f.threshold == 0.8
@@ -0,0 +1,125 @@
+# tests/test_helper_embedding.py
+# helper_embedding.py: decode_embedding / embeddings_to_array / 埋め込みアーティファクトの読み書き
+import base64
+from pathlib import Path
+from types import SimpleNamespace
+
+import pytest
+
+np = pytest.importorskip("numpy")
+pytest.importorskip("pyarrow")
+
+from helper_embedding import (EmbeddingArtifact, EmbeddingArtifactWriter, decode_embedding,  # noqa: E402
+                              embeddings_to_array, list_artifacts)
+
+
+# ==================================================
+# decode_embedding / embeddings_to_array
+# ==================================================
+def test_decode_embedding_base64_roundtrip():
+    vec = np.array([0.5, -1.25, 3.0], dtype="<f4")
+    decoded = decode_embedding(base64.b64encode(vec.tobytes()).decode("ascii"))
+    assert decoded.dtype == np.float32
+    np.testing.assert_array_equal(decoded, vec)
+
+
+def test_decode_embedding_float_list():
+    decoded = decode_embedding([0.1, 0.2])
+    assert decoded.dtype == np.float32
+    np.testing.assert_allclose(decoded, [0.1, 0.2], rtol=1e-6)
+
+
+def test_embeddings_to_array_mixed_items():
+    rows = np.arange(6, dtype="<f4").reshape(3, 2)
+    data = [SimpleNamespace(embedding=base64.b64encode(rows[0].tobytes()).decode("ascii")),
+            SimpleNamespace(embedding=rows[1].tolist()),
+            rows[2].tolist()]
+    out = embeddings_to_array(data)
+    assert out.shape == (3, 2) and out.dtype == np.float32
+    np.testing.assert_array_equal(out, rows)
+
+
+def test_embeddings_to_array_empty():
+    assert embeddings_to_array([], dims=4).shape == (0, 4)
+
+
+# ==================================================
+# EmbeddingArtifactWriter / EmbeddingArtifact
+# ==================================================
+VECTORS = {"primary": {"model": "text-embedding-3-small", "dims": 4},
+           "secondary": {"model": "text-embedding-3-large", "dims": 3}}
+
+
+def write_artifact(prefix: Path, rows: int, dtype: str = "float32", row_group_rows: int = 4):
+    rng = np.random.default_rng(0)
+    expected = {name: rng.standard_normal((rows, v["dims"])).astype(np.float32) for name, v in VECTORS.items()}
+    writer = EmbeddingArtifactWriter(str(prefix), VECTORS, dtype=dtype, row_group_rows=row_group_rows)
+    for start in range(0, rows, 3):
+        end = min(rows, start + 3)
+        ids = list(range(start, end))
+        writer.append(ids, [f"text {i}" for i in ids], [{"row": i} for i in ids],
+                      {name: arr[start:end] for name, arr in expected.items()},
+                      row_hashes=[f"h{i}" for i in ids])
+    writer.close()
+    return expected
+
+
+@pytest.mark.parametrize("dtype, atol", [("float32", 0.0), ("float16", 1e-2)])
+def test_artifact_roundtrip(tmp_path, dtype, atol):
+    prefix = tmp_path / "customer"
+    expected = write_artifact(prefix, rows=11, dtype=dtype)
+
+    art = EmbeddingArtifact(str(prefix))
+    assert art.rows == 11
+    assert art.dtype == dtype
+    assert art.vectors == VECTORS
+    ids, payloads, row_hashes = [], [], []
+    vectors = {name: [] for name in VECTORS}
+    for batch_ids, batch_payloads, arrays, batch_hashes in art.iter_batches(batch_size=5):
+        assert len(batch_ids) == len(batch_payloads) == len(batch_hashes)
+        for name, arr in arrays.items():
+            assert arr.dtype == np.float32 and arr.shape[0] == len(batch_ids)
+            vectors[name].append(arr)
+        ids += batch_ids
+        payloads += batch_payloads
+        row_hashes += batch_hashes
+    assert ids == list(range(11))
+    assert payloads == [{"row": i} for i in range(11)]
+    assert row_hashes == [f"h{i}" for i in range(11)]
+    for name, arr in expected.items():
+        np.testing.assert_allclose(np.concatenate(vectors[name]), arr, atol=atol)
+
+
+def test_writer_uses_temp_names_until_close(tmp_path):
+    prefix = tmp_path / "legal"
+    writer = EmbeddingArtifactWriter(str(prefix), VECTORS, row_group_rows=1)
+    writer.append([1], ["t"], [{}], {name: np.zeros((1, v["dims"])) for name, v in VECTORS.items()})
+    assert list_artifacts(str(tmp_path)) == {}
+    writer.close()
+    assert list_artifacts(str(tmp_path)) == {"legal": str(prefix)}
+    assert not list(tmp_path.glob("*.tmp"))
+
+
+def test_writer_close_without_commit_discards(tmp_path):
+    prefix = tmp_path / "medical"
+    writer = EmbeddingArtifactWriter(str(prefix), VECTORS, row_group_rows=1)
+    writer.append([1], ["t"], [{}], {name: np.zeros((1, v["dims"])) for name, v in VECTORS.items()})
+    writer.close(commit=False)
+    writer.close()  # 2回目は何もしない
+    assert list(tmp_path.iterdir()) == []
+
+
+def test_writer_rejects_wrong_shape(tmp_path):
+    writer = EmbeddingArtifactWriter(str(tmp_path / "x"), VECTORS)
+    with pytest.raises(ValueError):
+        writer.append([1], ["t"], [{}], {"primary": np.zeros((1, 4)), "secondary": np.zeros((1, 2))})
+    writer.close(commit=False)
+
+
+def test_artifact_rejects_row_mismatch(tmp_path):
+    prefix = tmp_path / "sciq"
+    write_artifact(prefix, rows=6)
+    path = EmbeddingArtifactWriter.vector_path(str(prefix), "primary")
+    np.save(path, np.zeros((5, 4), dtype=np.float32))
+    with pytest.raises(ValueError):
+        EmbeddingArtifact(str(prefix))